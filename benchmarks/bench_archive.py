@@ -0,0 +1,135 @@
+"""Measure startup and memory with call history kept hot vs archived.
+
+Seeds a call store with ended calls spread over the last year, then starts
+`uvicorn main:app` three times against the fake Vapi server:
+
+- hot: retention off, so every record is loaded into memory
+- archiving: retention on (CALL_RETENTION_DAYS, default 90), until the
+  first archive run has finished
+- archived: retention on again, now loading only the recent records
+
+For the hot and archived runs it reports time to serve, time until every
+record has loaded, RSS once loaded, and GET /api/calls/{id} latency for
+old (archived) and recent calls. Prints a JSON report and exits 1 if an
+archived call can't be read or the archived run uses more memory:
+
+    python benchmarks/bench_archive.py --records 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from load import FAKE_VAPI_PORT, free_port, git_revision, percentile, read_rss_mb, seed_store, start_app
+import fake_vapi
+import httpx
+from main import CallRetention, CallStore
+
+async def wait_for(http, predicate, timeout=600):
+    """Poll /api/archive/stats until predicate(stats) holds; returns the seconds waited"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        stats = (await http.get("/api/archive/stats")).json()
+        if predicate(stats):
+            return time.perf_counter() - started
+        await asyncio.sleep(0.05)
+    raise RuntimeError("Timed out waiting for the app")
+
+async def timed_reads(http, call_ids):
+    latencies = []
+    archived = 0
+    failed = 0
+    for call_id in call_ids:
+        started = time.perf_counter()
+        response = await http.get(f"/api/calls/{call_id}")
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            failed += 1
+        elif response.json().get("archived"):
+            archived += 1
+    return {
+        "reads": len(call_ids),
+        "archived": archived,
+        "failed": failed,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+async def measure(db_path, env, expected_hot, old_ids, recent_ids):
+    port = free_port()
+    process, startup_s = await start_app(db_path, port, 1, env)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as http:
+            loaded_s = startup_s + await wait_for(http, lambda stats: stats["hot_records"] >= expected_hot)
+            rss, _ = read_rss_mb(process.pid)
+            return {
+                "startup_s": round(startup_s, 2),
+                "fully_loaded_s": round(loaded_s, 2),
+                "hot_records": expected_hot,
+                "rss_mb": round(rss, 1) if rss else None,
+                "old_calls": await timed_reads(http, old_ids),
+                "recent_calls": await timed_reads(http, recent_ids),
+            }
+    finally:
+        process.terminate()
+        process.wait()
+
+async def main_async(args):
+    fake_vapi.serve_in_background(FAKE_VAPI_PORT)
+    rng = random.Random(args.seed)
+    report = {"benchmark": "archive", "commit": git_revision(), "records": args.records, "retention_days": args.days}
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "archive.db")
+        seed_store(db_path, args.records, rng)
+        # Seeded calls are spread over 365 days, oldest first. Only those
+        # before the retention cutoff (rounded down to midnight) are archived
+        store = CallStore(db_path)
+        cutoff = CallRetention(args.days, 0, 0).cutoff(store)
+        old = store.conn.execute("SELECT COUNT(*) FROM calls WHERE timestamp < ?", (cutoff,)).fetchone()[0]
+        store.conn.close()
+        old_ids = [f"seed-{i:08d}" for i in rng.sample(range(old), min(args.reads, old))]
+        recent_ids = [f"seed-{i:08d}" for i in rng.sample(range(old, args.records), min(args.reads, args.records - old))]
+        # Reads of unknown calls would go to the fake Vapi server; serve hot ones locally
+        env = {"RECONCILER_ENABLED": "false", "VAPI_WEBHOOK_SECRET": "bench", "CALL_ARCHIVE_DIR": os.path.join(directory, "archive")}
+
+        report["hot"] = await measure(db_path, dict(env, CALL_RETENTION_DAYS="0"), args.records, old_ids, recent_ids)
+        print(json.dumps({"hot": report["hot"]}), file=sys.stderr)
+
+        port = free_port()
+        process, _ = await start_app(db_path, port, 1, dict(env, CALL_RETENTION_DAYS=str(args.days)))
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as http:
+                archive_s = await wait_for(http, lambda stats: stats["runs"] >= 1)
+                report["archiving"] = {"seconds": round(archive_s, 2), "archive": (await http.get("/api/archive/stats")).json()["archive"]}
+        finally:
+            process.terminate()
+            process.wait()
+        print(json.dumps({"archiving": report["archiving"]}), file=sys.stderr)
+
+        hot_after = args.records - report["archiving"]["archive"]["records"]
+        report["archived"] = await measure(db_path, dict(env, CALL_RETENTION_DAYS=str(args.days)), hot_after, old_ids, recent_ids)
+        print(json.dumps({"archived": report["archived"]}), file=sys.stderr)
+
+    report["checks"] = {
+        "old_calls_read_from_archive": report["archived"]["old_calls"]["archived"] == len(old_ids),
+        "no_failed_reads": report["hot"]["old_calls"]["failed"] + report["archived"]["old_calls"]["failed"] + report["archived"]["recent_calls"]["failed"] == 0,
+        "less_memory": (report["archived"]["rss_mb"] or 0) < (report["hot"]["rss_mb"] or 0),
+    }
+    report["passed"] = all(report["checks"].values())
+    print(json.dumps(report, indent=2))
+    return report["passed"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=100000, help="ended calls seeded over the last year")
+    parser.add_argument("--days", type=int, default=90, help="CALL_RETENTION_DAYS for the archived runs")
+    parser.add_argument("--reads", type=int, default=200, help="GET /api/calls/{id} requests per group of calls")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main_async(parse_args())) else 1)
@@ -0,0 +1,87 @@
+"""Dispatch a large batch through POST /api/calls/batch against the fake Vapi server.
+
+Checks that every row is dialed exactly once and reports dispatch
+throughput under the configured scheduler limits:
+
+    python benchmarks/bench_batch.py [rows]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_vapi
+
+PORT = int(os.getenv("FAKE_VAPI_PORT", "8765"))
+os.environ["VAPI_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ.setdefault("VAPI_API_KEY", "bench")
+os.environ.setdefault("CALL_RECORDS_DB", os.path.join(tempfile.mkdtemp(), "bench.db"))
+os.environ.setdefault("DIAL_MAX_CONCURRENCY", "50")
+os.environ.setdefault("DIAL_PER_NUMBER_CONCURRENCY", "2")
+os.environ.setdefault("DIAL_RATE_PER_SECOND", "500")
+os.environ.setdefault("DIAL_RATE_BURST", "50")
+# Dial straight away whatever the time, rather than holding calls for carrier hours
+os.environ.setdefault("CARRIER_DEFAULT_HOURS", "always")
+
+import httpx
+import main
+
+ROW = {
+    "assistant_type": "general",
+    "appointment_date": "01-07-2025",
+    "insurance_rep": "WEB",
+    "insurance_carrier": "METLIFE PPO",
+    "insurance_phone": "(800)275-4638",
+    "insured_name": "Jane, Patrick",
+    "insured_dob": "09-07-1999",
+    "insured_ss": "N/A",
+    "insured_id": "104389769",
+    "relationship_to_patient": "SELF",
+    "patient_name": "Jane, Patrick",
+    "patient_dob": "09-07-1999",
+    "employer": "FEDERAL EMPLOYEES DENTAL AND",
+    "group_number": "121332",
+    "claims_address": "PO BOX 14093 EL PASO TX 79998",
+    "payor_id": "65978",
+    "clinic_name": "Blue Lines Dental Clinic",
+    "practice_tax_id": "123456",
+    "treating_dentist_name": "Dr. Mustafa",
+    "dentist_npi": "789012",
+}
+
+async def run(rows):
+    fake_vapi.serve_in_background(PORT)
+    main.load_call_records()
+    batch = [dict(ROW, phone_number=f"+1800555{i % 40:04d}") for i in range(rows)]
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=60) as http:
+        started = time.perf_counter()
+        response = await http.post("/api/calls/batch", json=batch)
+        assert response.status_code == 202, response.text
+        batch_id = response.json()["batch_id"]
+        while True:
+            progress = (await http.get(f"/api/calls/batch/{batch_id}")).json()
+            if progress["status"] == "completed":
+                break
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+
+    assert progress["dispatched"] == rows, progress["errors"][:5]
+    assert len(fake_vapi.calls) == rows
+    print(json.dumps({
+        "benchmark": "batch_dispatch",
+        "rows": rows,
+        "upstream_latency_s": fake_vapi.LATENCY,
+        "max_concurrency": main.dial_scheduler.global_slots._value,
+        "elapsed_s": round(elapsed, 3),
+        "calls_per_s": round(rows / elapsed, 1),
+        "failed": progress["failed"],
+    }))
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
@@ -0,0 +1,146 @@
+"""Measure cold-start time of the Vercel entry point (api/index.py).
+
+Each run is a fresh Python process that imports api.index, runs the
+startup handlers, renders /calls and then dials once through POST
+/api/calls against the fake Vapi server after a short pause, like a user
+filling in the form. With --baseline the same runs are made against a git
+ref exported to a temporary directory, so the report shows the change:
+
+    python benchmarks/bench_cold_start.py --records 10000 --baseline HEAD~1
+
+Prints one JSON object with the median of each phase and the slowest
+top-level imports from python -X importtime.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("VAPI_API_KEY", "bench")
+
+import fake_vapi
+from load import seed_store
+
+FAKE_VAPI_PORT = int(os.getenv("FAKE_VAPI_PORT", "8765"))
+
+# Runs inside the measured process. httpx is imported after the import
+# timestamp, so the in-process test client is not counted as app import time
+CHILD = """
+import asyncio, json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, os.getcwd())
+from api.index import app
+imported = time.perf_counter()
+import httpx
+
+async def run():
+    begin = time.perf_counter()
+    await app.router.startup()
+    ready = time.perf_counter()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://cold") as http:
+        response = await http.get("/calls")
+        assert response.status_code == 200, response.status_code
+        page = time.perf_counter()
+        await asyncio.sleep(float(sys.argv[1]))
+        dial_start = time.perf_counter()
+        response = await http.post("/api/calls", json={"phone_number": "+15551230000"})
+        assert response.status_code == 200, response.text
+        dialed = time.perf_counter()
+    print(json.dumps({
+        "import_s": imported - started,
+        "startup_s": ready - begin,
+        "first_page_s": page - ready,
+        "ready_to_first_page_s": (imported - started) + (page - begin),
+        "first_dial_s": dialed - dial_start,
+    }))
+    await app.router.shutdown()
+    os._exit(0)
+
+asyncio.run(run())
+"""
+
+def export_ref(ref, directory):
+    """Write the tree at a git ref into directory"""
+    archive = os.path.join(directory, "tree.tar")
+    subprocess.check_call(["git", "archive", "--format=tar", "-o", archive, ref], cwd=ROOT)
+    with tarfile.open(archive) as tar:
+        tar.extractall(directory)
+    return directory
+
+def measure(tree, db_path, think, env):
+    env = dict(env, CALL_RECORDS_DB=db_path)
+    output = subprocess.check_output([sys.executable, "-c", CHILD, str(think)], cwd=tree, env=env, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+def slowest_imports(tree, env, count=10):
+    """Modules imported directly by main, by cumulative import time, plus main itself"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api.index"],
+        cwd=tree, env=env, capture_output=True, text=True,
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and line.count("|") == 2:
+            _, self_us, cumulative_us, name = [part for part in line.replace("import time:", "|").split("|")]
+            if self_us.strip().isdigit():
+                entries.append((len(name) - len(name.lstrip()), name.strip(), int(self_us), int(cumulative_us)))
+    main_depth = next((depth for depth, name, _, _ in entries if name == "main"), None)
+    imports = [(name, cumulative) for depth, name, _, cumulative in entries if depth == (main_depth or 0) + 2]
+    imports += [("main (own code)", self_us) for depth, name, self_us, _ in entries if name == "main"]
+    imports.sort(key=lambda item: item[1], reverse=True)
+    return [{"module": name, "cumulative_s": round(us / 1e6, 4)} for name, us in imports[:count]]
+
+def run_tree(tree, args, env):
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(args.runs):
+            db_path = os.path.join(directory, f"cold-{i}.db")
+            if args.records:
+                seed_store(db_path, args.records, random.Random(args.seed))
+            runs.append(measure(tree, db_path, args.think, env))
+    summary = {key: round(statistics.median(run[key] for run in runs), 4) for key in runs[0]}
+    summary["slowest_imports"] = slowest_imports(tree, env)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--records", type=int, default=10000, help="records seeded into the call store before each run")
+    parser.add_argument("--think", type=float, default=5.0, help="seconds between the first page and the first dial")
+    parser.add_argument("--baseline", help="git ref to compare against")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ["FAKE_VAPI_LATENCY"] = os.getenv("FAKE_VAPI_LATENCY", "0.05")
+    fake_vapi.LATENCY = float(os.environ["FAKE_VAPI_LATENCY"])
+    fake_vapi.serve_in_background(FAKE_VAPI_PORT)
+    env = dict(
+        os.environ,
+        VAPI_API_KEY=os.getenv("VAPI_API_KEY", "bench"),
+        VAPI_BASE_URL=f"http://127.0.0.1:{FAKE_VAPI_PORT}",
+        RECONCILER_ENABLED="false",
+        CARRIER_DEFAULT_HOURS="always",
+        CALL_RETENTION_DAYS="0",
+    )
+
+    report = {"benchmark": "cold_start", "records": args.records, "runs": args.runs, "think_s": args.think}
+    report["head"] = run_tree(ROOT, args, env)
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as directory:
+            report["baseline"] = {"ref": args.baseline, **run_tree(export_ref(args.baseline, directory), args, env)}
+        report["speedup"] = {
+            key: round(report["baseline"][key] / report["head"][key], 2)
+            for key in report["head"]
+            if isinstance(report["head"][key], float) and report["head"][key] > 0
+        }
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
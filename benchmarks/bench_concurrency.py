@@ -0,0 +1,84 @@
+"""Measure how concurrent GET /api/calls/{id} requests overlap Vapi latency.
+
+Runs main.app in-process against the local fake Vapi server and compares the
+async client with the previous blocking client for the same workload. Exits 1
+if the async requests don't overlap: the whole batch must finish within a few
+upstream round trips and at least concurrency / 4 times faster than blocking:
+
+    python benchmarks/bench_concurrency.py [concurrency]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_vapi
+
+PORT = int(os.getenv("FAKE_VAPI_PORT", "8765"))
+os.environ["VAPI_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ.setdefault("VAPI_API_KEY", "bench")
+os.environ["CALL_RECORDS_DB"] = os.path.join(tempfile.mkdtemp(), "concurrency.db")
+os.environ["RECONCILER_ENABLED"] = "false"
+
+import httpx
+from vapi import Vapi
+import main
+
+async def run_requests(concurrency, prefix):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://app") as http:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[
+            http.get(f"/api/calls/{prefix}-{i}") for i in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+    assert all(r.status_code == 200 for r in responses), [r.text for r in responses if r.status_code != 200]
+    return elapsed
+
+async def main_bench(concurrency):
+    fake_vapi.serve_in_background(PORT)
+
+    # The first response pays the one-off cost of building the SDK's pydantic
+    # models; keep it out of both measurements
+    await run_requests(1, "warmup")
+    # Each run asks for its own ids so the result cache doesn't answer for Vapi
+    async_elapsed = await run_requests(concurrency, "async")
+
+    # Re-run the same workload with the blocking client the app used before,
+    # which stalls the event loop for the full duration of every round trip
+    blocking = Vapi(token="bench", base_url=os.environ["VAPI_BASE_URL"])
+
+    class BlockingCalls:
+        async def get(self, id, request_options=None):
+            return blocking.calls.get(id=id, request_options=request_options)
+
+    class BlockingClient:
+        calls = BlockingCalls()
+
+    main.client = BlockingClient()
+    blocking_elapsed = await run_requests(concurrency, "blocking")
+
+    speedup = blocking_elapsed / async_elapsed
+    report = {
+        "benchmark": "concurrent_get_call",
+        "concurrency": concurrency,
+        "upstream_latency_s": fake_vapi.LATENCY,
+        "async_elapsed_s": round(async_elapsed, 4),
+        "blocking_elapsed_s": round(blocking_elapsed, 4),
+        "speedup": round(speedup, 2),
+        "checks": {
+            # Serial requests would take concurrency round trips
+            "async_overlaps": async_elapsed < 4 * fake_vapi.LATENCY,
+            "min_speedup": speedup >= concurrency / 4,
+        },
+    }
+    report["passed"] = all(report["checks"].values())
+    print(json.dumps(report))
+    return report["passed"]
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main_bench(int(sys.argv[1]) if len(sys.argv) > 1 else 20)) else 1)
@@ -0,0 +1,193 @@
+"""Exercise the Vapi transport against the fault-injecting fake Vapi server.
+
+Runs main.app in-process with short timeouts and a fast-resetting circuit
+breaker, then injects one kind of fault per scenario:
+
+- transient_errors: 30% of Vapi requests fail with a 500; compares
+  GET /api/calls/{id} with and without transport retries
+- hangs: 20% of Vapi requests stall for 30 s; requests must finish
+  within the timeouts and retries instead of hanging
+- lost_creates: 30% of the creates place the call but answer with a 500;
+  every submission must succeed with exactly one call placed per number
+- outage: every Vapi request fails; the circuit must open, known calls
+  must be served stale and creates refused with 503 quickly, and the
+  circuit must close again once Vapi recovers
+
+Fake calls are kept in progress for the whole run: results of ended calls
+are cached without expiry, so reads of them would never reach Vapi.
+
+Prints a JSON report and exits 1 if any check fails:
+
+    python benchmarks/bench_faults.py
+"""
+import asyncio
+import collections
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_vapi
+
+PORT = int(os.getenv("FAKE_VAPI_PORT", "8765"))
+os.environ.update({
+    "VAPI_BASE_URL": f"http://127.0.0.1:{PORT}",
+    "VAPI_API_KEY": os.getenv("VAPI_API_KEY", "bench"),
+    "CALL_RECORDS_DB": os.path.join(tempfile.mkdtemp(), "faults.db"),
+    "RECONCILER_ENABLED": "false",
+    "CALL_CACHE_TTL": "0",
+    "VAPI_GET_TIMEOUT": "1",
+    "VAPI_CREATE_TIMEOUT": "1",
+    "VAPI_LIST_TIMEOUT": "1",
+    "VAPI_BREAKER_RESET": "2",
+    "CARRIER_DEFAULT_HOURS": "always",
+})
+
+import httpx
+import main
+from load import percentile
+
+def set_faults(error_rate=0.0, hang_rate=0.0, lost_create_rate=0.0):
+    fake_vapi.ERROR_RATE = error_rate
+    fake_vapi.HANG_RATE = hang_rate
+    fake_vapi.LOST_CREATE_RATE = lost_create_rate
+
+def reset_breaker():
+    main.vapi_breaker.__init__(main.vapi_breaker.failure_threshold, main.vapi_breaker.reset_timeout)
+
+async def timed_gets(http, call_ids, concurrency=4):
+    """GET each call once; returns latencies and a count of fresh, stale and failed responses"""
+    latencies = []
+    outcomes = collections.Counter()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def get(call_id):
+        async with slots:
+            started = time.perf_counter()
+            response = await http.get(f"/api/calls/{call_id}")
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                outcomes["failed"] += 1
+            else:
+                outcomes["stale" if response.json().get("stale") else "fresh"] += 1
+
+    await asyncio.gather(*(get(call_id) for call_id in call_ids))
+    return latencies, outcomes
+
+def summary(latencies, outcomes):
+    return {
+        **{key: outcomes.get(key, 0) for key in ("fresh", "stale", "failed")},
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+    }
+
+async def transient_errors(http, call_ids):
+    set_faults(error_rate=0.3)
+    transport = main.vapi_transport
+    report = {}
+    for label, retries in (("without_retries", 0), ("with_retries", main.VAPI_READ_RETRIES)):
+        reset_breaker()
+        transport.retries = retries
+        report[label] = summary(*await timed_gets(http, call_ids))
+    transport.retries = main.VAPI_READ_RETRIES
+    checks = {"retries_keep_reads_fresh": report["with_retries"]["fresh"] >= 0.97 * len(call_ids)}
+    return report, checks
+
+async def hangs(http, call_ids):
+    set_faults(hang_rate=0.2)
+    fake_vapi.HANG_SECONDS = 30
+    reset_breaker()
+    report = summary(*await timed_gets(http, call_ids, concurrency=16))
+    # Worst case: every attempt times out, plus the backoff between them
+    bound = (main.VAPI_READ_RETRIES + 1) * (main.VAPI_OPERATION_TIMEOUTS["get"] + main.VAPI_RETRY_MAX_DELAY)
+    checks = {"no_request_hangs": report["max_ms"] < bound * 1000, "no_failures": report["failed"] == 0}
+    return report, checks
+
+async def lost_creates(http, count=40):
+    set_faults(lost_create_rate=0.3)
+    reset_breaker()
+    placed_before = len(fake_vapi.calls)
+    numbers = [f"+1555777{i:04d}" for i in range(count)]
+    # One at a time, so the lookups between failures keep the circuit closed
+    responses = [await http.post("/api/calls", json={"phone_number": number}) for number in numbers]
+    placed = collections.Counter(call["customer"]["number"] for call in list(fake_vapi.calls.values())[placed_before:])
+    succeeded = [response for response in responses if response.status_code == 200]
+    report = {
+        "submissions": count,
+        "succeeded": len(succeeded),
+        "calls_placed": sum(placed.values()),
+        "numbers_dialled_twice": sum(1 for n in placed.values() if n > 1),
+        "errors": dict(collections.Counter(
+            f"{response.status_code}: {response.json().get('detail')}" for response in responses if response.status_code != 200
+        )),
+    }
+    known = {response.json()["call_id"] for response in succeeded}
+    checks = {
+        "every_submission_succeeds": len(succeeded) == count,
+        "no_double_dials": report["numbers_dialled_twice"] == 0,
+        "returned_ids_were_placed": known <= set(fake_vapi.calls),
+    }
+    return report, checks
+
+async def outage(http, call_ids):
+    set_faults(error_rate=1.0)
+    reset_breaker()
+    latencies, outcomes = await timed_gets(http, call_ids[:20], concurrency=1)
+    opened = main.vapi_breaker.is_open()
+    started = time.perf_counter()
+    create = await http.post("/api/calls", json={"phone_number": "+15558880000"})
+    create_ms = (time.perf_counter() - started) * 1000
+    set_faults()
+    await asyncio.sleep(main.vapi_breaker.reset_timeout + 0.1)
+    recovered, recovered_outcomes = await timed_gets(http, call_ids[:5], concurrency=1)
+    report = {
+        "during_outage": summary(latencies, outcomes),
+        "open_after_requests": opened,
+        "create_status": create.status_code,
+        "create_retry_after": create.headers.get("retry-after"),
+        "create_ms": round(create_ms, 1),
+        "after_recovery": summary(recovered, recovered_outcomes),
+        "breaker": main.vapi_breaker.stats(),
+    }
+    # Once open, reads are answered from local state without waiting on Vapi
+    checks = {
+        "circuit_opens": opened,
+        "reads_served_stale": outcomes.get("failed", 0) == 0,
+        "fast_fail_after_open": percentile(latencies, 0.5) < 0.05,
+        "create_refused_with_503": create.status_code == 503 and create.headers.get("retry-after") is not None and create_ms < 50,
+        "circuit_closes_after_recovery": main.vapi_breaker.state == "closed" and recovered_outcomes.get("fresh") == 5,
+    }
+    return report, checks
+
+async def run():
+    fake_vapi.LATENCY = 0.01
+    fake_vapi.CALL_SECONDS = 3600
+    fake_vapi.serve_in_background(PORT)
+    await main.app.router.startup()
+    report = {"benchmark": "faults", "results": {}, "checks": {}}
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://app", timeout=120) as http:
+            set_faults()
+            call_ids = [(await http.post("/api/calls", json={"phone_number": f"+1555666{i:04d}"})).json()["call_id"] for i in range(200)]
+            for name, scenario in (
+                ("transient_errors", transient_errors(http, call_ids)),
+                ("hangs", hangs(http, call_ids[:100])),
+                ("lost_creates", lost_creates(http)),
+                ("outage", outage(http, call_ids)),
+            ):
+                result, checks = await scenario
+                report["results"][name] = result
+                report["checks"].update({f"{name}.{check}": passed for check, passed in checks.items()})
+                print(json.dumps({name: result}), file=sys.stderr)
+    finally:
+        await main.app.router.shutdown()
+    report["passed"] = all(report["checks"].values())
+    print(json.dumps(report, indent=2))
+    return report["passed"]
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(run()) else 1)
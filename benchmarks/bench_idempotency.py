@@ -0,0 +1,113 @@
+"""Check that duplicate call creates dial once, across uvicorn workers.
+
+Starts `uvicorn main:app --workers N` against the fake Vapi server, then
+for each scenario fires bursts of identical creates at the same moment,
+each on its own connection so they spread over the workers:
+
+- idempotency_key: POST /api/calls with one Idempotency-Key per burst
+- content_hash: POST /api/calls without a key, one phone number per burst
+- web_double_submit: POST /create_call twice with the form's hidden key
+
+Every response in a burst must carry the same call id, and the fake Vapi
+server must have placed exactly one call per burst. Prints a JSON report
+and exits 1 if any check fails:
+
+    python benchmarks/bench_idempotency.py --workers 2 --bursts 20 --size 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import uuid
+
+from load import FAKE_VAPI_PORT, free_port, git_revision, start_app
+from bench_batch import ROW
+import fake_vapi
+import httpx
+
+def fresh_client(port):
+    """A client that opens a new connection per request, so requests spread over workers"""
+    return httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}", timeout=60,
+        limits=httpx.Limits(max_keepalive_connections=0), headers={"Connection": "close"},
+    )
+
+def burst_request(scenario, burst, phone_number):
+    """Return (path, request kwargs) shared by every request of one burst"""
+    if scenario == "idempotency_key":
+        return "/api/calls", {"json": {"phone_number": phone_number}, "headers": {"Idempotency-Key": str(uuid.uuid4())}}
+    if scenario == "content_hash":
+        return "/api/calls", {"json": {"phone_number": phone_number}}
+    data = {**ROW, "phone_number": phone_number, "assistant_type": "general", "idempotency_key": uuid.uuid4().hex}
+    return "/create_call", {"data": data}
+
+def call_id_of(response):
+    if response.status_code == 303:
+        return response.headers["location"].rsplit("/", 1)[-1]
+    if response.status_code == 200:
+        return response.json()["call_id"]
+    return None
+
+async def run_scenario(http, scenario, index, args):
+    numbers = [f"+1555{index}{burst:06d}" for burst in range(args.bursts)]
+    placed_before = len(fake_vapi.calls)
+    split_bursts = 0
+    failed = 0
+    for burst, phone_number in enumerate(numbers):
+        path, kwargs = burst_request(scenario, burst, phone_number)
+        size = 2 if scenario == "web_double_submit" else args.size
+        responses = await asyncio.gather(*(http.post(path, **kwargs) for _ in range(size)))
+        call_ids = {call_id_of(response) for response in responses}
+        failed += None in call_ids
+        split_bursts += len(call_ids - {None}) > 1
+    placed = [call["customer"]["number"] for call in list(fake_vapi.calls.values())[placed_before:]]
+    report = {
+        "bursts": args.bursts,
+        "requests": args.bursts * (2 if scenario == "web_double_submit" else args.size),
+        "calls_placed": len(placed),
+        "bursts_with_several_call_ids": split_bursts,
+        "failed_requests": failed,
+    }
+    checks = {
+        "one_call_per_burst": sorted(placed) == sorted(numbers),
+        "same_call_id_per_burst": split_bursts == 0,
+        "no_failures": failed == 0,
+    }
+    return report, checks
+
+async def main_async(args):
+    fake_vapi.LATENCY = args.vapi_latency
+    fake_vapi.serve_in_background(FAKE_VAPI_PORT)
+    report = {"benchmark": "idempotency", "commit": git_revision(), "workers": args.workers, "results": {}, "checks": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        port = free_port()
+        process, _ = await start_app(os.path.join(directory, "idempotency.db"), port, args.workers, {"RECONCILER_ENABLED": "false"})
+        try:
+            async with fresh_client(port) as http:
+                # Every worker builds the SDK's models on its first dial; keep that out of the bursts
+                for i in range(2 * args.workers):
+                    await http.post("/api/calls", json={"phone_number": f"+1555000{i:04d}"})
+                for index, scenario in enumerate(("idempotency_key", "content_hash", "web_double_submit"), start=1):
+                    result, checks = await run_scenario(http, scenario, index, args)
+                    report["results"][scenario] = result
+                    report["checks"].update({f"{scenario}.{check}": passed for check, passed in checks.items()})
+                    print(json.dumps({scenario: result}), file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait()
+    report["passed"] = all(report["checks"].values())
+    print(json.dumps(report, indent=2))
+    return report["passed"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--bursts", type=int, default=20, help="bursts per scenario")
+    parser.add_argument("--size", type=int, default=5, help="identical API requests per burst")
+    parser.add_argument("--vapi-latency", type=float, default=0.2, help="seconds the fake Vapi takes per request, so duplicates overlap")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main_async(parse_args())) else 1)
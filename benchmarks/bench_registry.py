@@ -0,0 +1,65 @@
+"""Compare CallRegistry with the list-based call_records it replaced.
+
+For each store size, times id lookup, newest-first listing and status
+filtering on both structures and prints one JSON object per size:
+
+    python benchmarks/bench_registry.py [size ...]
+"""
+import datetime
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("VAPI_API_KEY", "bench")
+
+from main import CallRegistry
+
+STATUSES = ["scheduled", "in_progress", "completed", "failed", "customer-did-not-answer"]
+
+def make_records(size):
+    start = datetime.datetime(2025, 1, 1)
+    return [
+        {
+            "id": f"call-{i:08d}",
+            "phone_number": f"+1555{i % 10000000:07d}",
+            "timestamp": (start + datetime.timedelta(seconds=i * 37)).strftime("%Y-%m-%d %H:%M:%S"),
+            "status": random.choice(STATUSES),
+            "assistant_type": random.choice(["general", "emblem_health"]),
+        }
+        for i in range(size)
+    ]
+
+def list_lookup(records, call_id):
+    for record in records:
+        if record["id"] == call_id:
+            return record
+    return None
+
+def per_op_us(stmt, number):
+    return round(min(timeit.repeat(stmt, number=number, repeat=3)) / number * 1e6, 3)
+
+def bench(size):
+    records = make_records(size)
+    registry = CallRegistry(records)
+    ids = [r["id"] for r in random.sample(records, min(size, 100))]
+    lookups = 200
+
+    return {
+        "benchmark": "call_registry",
+        "size": size,
+        "list_lookup_us": round(per_op_us(lambda: [list_lookup(records, i) for i in ids], 1) / len(ids), 3),
+        "registry_lookup_us": round(per_op_us(lambda: [registry.get(i) for i in ids], lookups) / len(ids), 3),
+        "list_newest_50_us": per_op_us(lambda: sorted(records, key=lambda x: x.get("timestamp", ""), reverse=True)[:50], 3),
+        "registry_newest_50_us": per_op_us(lambda: [r for _, r in zip(range(50), registry.newest_first())], lookups),
+        "list_in_progress_us": per_op_us(lambda: [r for r in records if r["status"] == "in_progress"], 3),
+        "registry_in_progress_us": per_op_us(lambda: registry.ids_with_status("in_progress"), lookups),
+    }
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    for size in sizes:
+        print(json.dumps(bench(size)))
@@ -0,0 +1,106 @@
+"""Measure the response cache and compression on the list pages.
+
+Runs main.app in-process over a seeded call store and, for /calls,
+GET /api/calls and the home page, times requests that render afresh
+(the data version is bumped before each one) against requests answered
+from the response cache. Also reports body size per content coding, and
+the headers of the hashed static files when `python main.py build-static`
+has been run. Prints a JSON report and exits 1 if cached list requests are not
+faster or gzip does not shrink the pages:
+
+    python benchmarks/bench_responses.py --records 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+DIRECTORY = tempfile.mkdtemp()
+os.environ.update({
+    "CALL_RECORDS_DB": os.path.join(DIRECTORY, "responses.db"),
+    "CALL_ARCHIVE_DIR": os.path.join(DIRECTORY, "archive"),
+    "RECONCILER_ENABLED": "false",
+    "CALL_RETENTION_DAYS": "0",
+    "VAPI_PREWARM": "false",
+})
+# main mounts static files and finds templates relative to the working directory
+os.chdir(ROOT)
+
+import httpx
+import main
+from load import git_revision, percentile, seed_store
+
+ROUTES = {"calls_page": "/calls", "api_list": "/api/calls?limit=50", "index": "/"}
+
+async def timed(http, path, requests, before=None):
+    latencies = []
+    for _ in range(requests):
+        if before:
+            before()
+        started = time.perf_counter()
+        response = await http.get(path, headers={"Accept-Encoding": "gzip"})
+        latencies.append(time.perf_counter() - started)
+        response.raise_for_status()
+    return round(percentile(latencies, 0.5) * 1000, 3)
+
+async def encoded_sizes(http, path, encodings):
+    sizes = {}
+    for encoding in encodings:
+        response = await http.get(path, headers={"Accept-Encoding": encoding})
+        sizes[response.headers.get("content-encoding", "identity")] = int(response.headers["content-length"])
+    return sizes
+
+async def run(args):
+    await main.app.router.startup()
+    while not main.call_record_loader.done:
+        await asyncio.sleep(0.05)
+    encodings = ["identity", "gzip"] + (["br"] if main.get_brotli() else [])
+    report = {"benchmark": "responses", "commit": git_revision(), "records": args.records, "routes": {}, "static": {}}
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://app") as http:
+            for name, path in ROUTES.items():
+                # The home page doesn't depend on the records; drop its entry instead
+                invalidate = (lambda: main.response_cache.entries.clear()) if name == "index" else main.call_records.mark_changed
+                report["routes"][name] = {
+                    "uncached_p50_ms": await timed(http, path, args.requests, invalidate),
+                    "cached_p50_ms": await timed(http, path, args.requests),
+                    "bytes": await encoded_sizes(http, path, encodings),
+                }
+                print(json.dumps({name: report["routes"][name]}), file=sys.stderr)
+            page = (await http.get("/calls")).text
+            for src in re.findall(r'<script src="(/static/[^"]+)"', page):
+                response = await http.get(src, headers={"Accept-Encoding": ", ".join(encodings[1:])})
+                report["static"][src] = {
+                    "content_encoding": response.headers.get("content-encoding"),
+                    "cache_control": response.headers.get("cache-control"),
+                    "bytes": len(response.content),
+                }
+    finally:
+        await main.app.router.shutdown()
+    report["checks"] = {
+        # The home page swaps a fresh form key into its cached render, so it is still compressed per request
+        **{f"{name}.cached_faster": route["uncached_p50_ms"] > route["cached_p50_ms"] for name, route in report["routes"].items() if name != "index"},
+        **{f"{name}.gzip_smaller": route["bytes"]["gzip"] < route["bytes"]["identity"] for name, route in report["routes"].items()},
+    }
+    report["passed"] = all(report["checks"].values())
+    print(json.dumps(report, indent=2))
+    return report["passed"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route and mode")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    seed_store(os.environ["CALL_RECORDS_DB"], args.records, random.Random(args.seed))
+    sys.exit(0 if asyncio.run(run(args)) else 1)
@@ -0,0 +1,87 @@
+"""Measure /api/search query latency over a synthetic search index.
+
+Indexes N calls with generated summaries, transcripts and structured data
+into a temporary call store, then times representative queries:
+
+    python benchmarks/bench_search.py [calls]
+"""
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("VAPI_API_KEY", "bench")
+
+from main import CallStore, build_search_query, flatten_structured_data
+
+CARRIERS = ["METLIFE PPO", "DELTA DENTAL", "CIGNA", "AETNA", "GUARDIAN", "UNITED CONCORDIA"]
+PHRASES = [
+    "the deductible is fifty dollars per calendar year",
+    "frequency is 2 per year for prophylaxis",
+    "the missing tooth clause applies to implants",
+    "orthodontic work in progress is covered",
+    "waiting period of twelve months for major services",
+    "coinsurance for periodontics is eighty percent",
+    "occlusal guard is not covered under this plan",
+    "please hold while I pull up the member",
+]
+QUERIES = [
+    ("missing tooth clause", "MetLife"),
+    ('"frequency is 2 per year"', None),
+    ("occlusal guard", None),
+    ("orthodontic progress", "Cigna"),
+    ("deductible calendar", None),
+]
+
+def transcript(rng):
+    return "\n".join(
+        f"{'AI' if i % 2 else 'User'}: {rng.choice(PHRASES)}" for i in range(rng.randint(20, 60))
+    )
+
+def build(calls, path):
+    rng = random.Random(42)
+    store = CallStore(path)
+    for i in range(calls):
+        structured = {
+            "deductible_individual": f"${rng.choice([25, 50, 75, 100])}",
+            "missing_tooth_clause": rng.choice(["applies", "not applicable"]),
+            "freq_prophy": rng.choice(["2 per year", "1 per 6 months"]),
+        }
+        store.index_call(
+            f"call-{i:07d}",
+            rng.choice(CARRIERS),
+            f"Verified benefits; {rng.choice(PHRASES)}.",
+            "\n".join(flatten_structured_data(structured)),
+            transcript(rng),
+        )
+    return store
+
+def main(calls):
+    path = os.path.join(tempfile.mkdtemp(), "search.db")
+    started = time.perf_counter()
+    store = build(calls, path)
+    build_s = time.perf_counter() - started
+
+    timings = []
+    for _ in range(5):
+        for text, carrier in QUERIES:
+            started = time.perf_counter()
+            store.search(build_search_query(text, carrier), 20)
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    print(json.dumps({
+        "benchmark": "search",
+        "calls": calls,
+        "index_build_s": round(build_s, 2),
+        "query_p50_ms": round(statistics.median(timings), 2),
+        "query_p99_ms": round(timings[int(len(timings) * 0.99) - 1], 2),
+        "query_max_ms": round(timings[-1], 2),
+    }))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,208 @@
+"""Run the app with several uvicorn workers on a shared state backend.
+
+For each backend (sqlite, redis) and worker count, seeds a fresh store,
+starts `uvicorn main:app --workers N` against the fake Vapi server and:
+
+- creates calls one connection at a time, so they land on different
+  workers, and times how long each takes to show up in /api/calls on
+  every worker (fresh connections until 2N reads in a row list it);
+- once every call has ended, checks that all workers report the same
+  /api/analytics totals, and reports the share of requests answered by
+  the reconciler lease holder (about 1/N when one worker polls);
+- measures read throughput per scenario with a pool of keep-alive
+  connections spread over the workers.
+
+The redis backend runs against fakeredis's TCP server unless --redis-url
+points at a real Redis:
+
+    python benchmarks/bench_workers.py --workers 1,2,4 --backends sqlite,redis
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from load import (
+    FAKE_VAPI_PORT, drive, free_port, git_revision, percentile, read_rss_mb,
+    seed_records, seed_store, start_app,
+)
+import fake_vapi
+import httpx
+import main
+
+READ_SCENARIOS = ["api_get", "api_list", "calls_page"]
+
+def start_fake_redis():
+    """Serve fakeredis on a free port from a daemon thread; returns its URL"""
+    from fakeredis import TcpFakeServer
+    port = free_port()
+    server = TcpFakeServer(("127.0.0.1", port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0"
+
+def seed_redis(url, prefix, index_path, size, rng):
+    import redis
+    store = main.RedisCallStore(redis.Redis.from_url(url), main.CallStore(index_path), prefix)
+    batch = []
+    for record in seed_records(size, rng):
+        batch.append(record)
+        if len(batch) == 10000:
+            store.save_many(batch)
+            batch = []
+    store.save_many(batch)
+
+def tree_rss_mb(pid):
+    """Resident set size of a process and its children, in MiB (Linux only)"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        rss, _ = read_rss_mb(current)
+        total += rss or 0
+        try:
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return round(total, 1)
+
+def fresh_client(port):
+    """A client that opens a new connection per request, so requests spread over workers"""
+    return httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}", timeout=30,
+        limits=httpx.Limits(max_keepalive_connections=0), headers={"Connection": "close"},
+    )
+
+async def visibility_lags(port, workers, creates, timeout=10.0):
+    """Seconds from each create until every worker lists the new call"""
+    lags = []
+    async with fresh_client(port) as http:
+        for i in range(creates):
+            response = await http.post("/api/calls", json={"phone_number": f"+1555999{i:04d}"})
+            response.raise_for_status()
+            call_id = response.json()["call_id"]
+            created = time.perf_counter()
+            streak = 0
+            while streak < 2 * workers:
+                if time.perf_counter() - created > timeout:
+                    lags.append(None)
+                    break
+                listed = await http.get("/api/calls", params={"limit": 20})
+                streak = streak + 1 if any(call["id"] == call_id for call in listed.json()) else 0
+            else:
+                lags.append(time.perf_counter() - created)
+    return lags
+
+async def worker_views(port, workers):
+    """Analytics totals and reconciler leadership as seen over 4N fresh connections"""
+    totals = set()
+    leaders = 0
+    samples = 4 * workers
+    async with fresh_client(port) as http:
+        for _ in range(samples):
+            overall = (await http.get("/api/analytics")).json()["overall"]
+            totals.add((overall["calls"], overall["successes"], overall["cost_total"]))
+            leaders += (await http.get("/api/reconciler/stats")).json()["leader"]
+    return totals, leaders / samples
+
+async def run_workers(backend, workers, args, redis_url, rng):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "workers.db")
+        extra_env = {"CALL_STATE_BACKEND": backend, "RECONCILE_FAST_INTERVAL": "0.5", "RECONCILE_CONVERSATION_INTERVAL": "0.5"}
+        if backend == "redis":
+            prefix = f"bench-{os.getpid()}-{workers}-{time.time_ns()}"
+            extra_env.update(REDIS_URL=redis_url, REDIS_KEY_PREFIX=prefix)
+            seed_redis(redis_url, prefix, db_path, args.records, rng)
+        else:
+            seed_store(db_path, args.records, rng)
+
+        port = free_port()
+        process, startup_s = await start_app(db_path, port, workers, extra_env)
+        try:
+            # Every worker builds the SDK's models on its first dial; keep that out of the numbers
+            async with fresh_client(port) as http:
+                for i in range(2 * workers):
+                    await http.post("/api/calls", json={"phone_number": f"+1555000{i:04d}"})
+
+            lags = await visibility_lags(port, workers, args.creates)
+            # Let every created call ring, talk and end, then give the reconciler a few rounds
+            await asyncio.sleep(fake_vapi.RING_SECONDS + fake_vapi.CALL_SECONDS + 3)
+            totals, leader_share = await worker_views(port, workers)
+            seen = [lag for lag in lags if lag is not None]
+            row = {
+                "backend": backend,
+                "workers": workers,
+                "startup_s": round(startup_s, 2),
+                "visibility_p50_ms": round(percentile(seen, 0.5) * 1000, 1) if seen else None,
+                "visibility_p99_ms": round(percentile(seen, 0.99) * 1000, 1) if seen else None,
+                "not_visible": len(lags) - len(seen),
+                "analytics_consistent": len(totals) == 1,
+                "analytics_calls": sorted(totals)[0][0] if totals else None,
+                "reconciler_leader_share": round(leader_share, 2),
+                "throughput_rps": {},
+            }
+
+            call_ids = [f"seed-{i:08d}" for i in rng.sample(range(args.records), min(args.records, 1000))]
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as http:
+                for scenario in READ_SCENARIOS:
+                    latencies, errors, elapsed = await drive(http, scenario, args.concurrency, args.duration, rng, call_ids)
+                    row["throughput_rps"][scenario] = round(len(latencies) / elapsed, 1)
+                    if errors:
+                        row.setdefault("errors", {})[scenario] = errors
+            row["rss_mb"] = tree_rss_mb(process.pid)
+            print(json.dumps(row), file=sys.stderr)
+            return row
+        finally:
+            process.terminate()
+            process.wait()
+
+async def main_async(args):
+    fake_vapi.RING_SECONDS = args.ring_seconds
+    fake_vapi.CALL_SECONDS = args.call_seconds
+    fake_vapi.LATENCY = args.vapi_latency
+    fake_vapi.serve_in_background(FAKE_VAPI_PORT)
+    redis_url = args.redis_url
+    if "redis" in args.backends and not redis_url:
+        redis_url = start_fake_redis()
+    rng = random.Random(args.seed)
+    results = []
+    for backend in args.backends:
+        for workers in args.workers:
+            results.append(await run_workers(backend, workers, args, redis_url, rng))
+    print(json.dumps({
+        "benchmark": "workers",
+        "commit": git_revision(),
+        "cpus": os.cpu_count(),
+        "config": {
+            "records": args.records,
+            "creates": args.creates,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "redis": "fakeredis" if redis_url and not args.redis_url else args.redis_url,
+        },
+        "results": results,
+    }, indent=2))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", type=lambda value: value.split(","), default=["sqlite", "redis"])
+    parser.add_argument("--workers", type=lambda value: [int(item) for item in value.split(",")], default=[1, 2, 4])
+    parser.add_argument("--records", type=int, default=10000, help="records seeded into the store")
+    parser.add_argument("--creates", type=int, default=20, help="calls created for the visibility check")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per read scenario")
+    parser.add_argument("--redis-url", help="use this Redis instead of a fakeredis server")
+    parser.add_argument("--ring-seconds", type=float, default=0.5)
+    parser.add_argument("--call-seconds", type=float, default=1.0)
+    parser.add_argument("--vapi-latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main_async(parse_args()))
@@ -0,0 +1,64 @@
+"""Compare two benchmarks/load.py reports and flag regressions.
+
+Rows are matched on (store size, scenario, concurrency). A row regresses
+when throughput drops, or p99 latency or RSS grows, by more than the
+threshold (default 10%). Exits with status 1 if any row regressed:
+
+    python benchmarks/compare.py base.json head.json [--threshold 0.1]
+"""
+import argparse
+import json
+import sys
+
+# metric -> +1 if higher is better, -1 if lower is better
+METRICS = {"throughput_rps": 1, "p50_ms": -1, "p99_ms": -1, "rss_mb": -1}
+# Metrics that count towards the exit status; p50 is informational
+GATED = ("throughput_rps", "p99_ms", "rss_mb")
+
+def load_rows(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report, {(row["store_size"], row["scenario"], row["concurrency"]): row for row in report["results"]}
+
+def change(base, head):
+    if base in (None, 0) or head is None:
+        return None
+    return (head - base) / base
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    base_report, base_rows = load_rows(args.base)
+    head_report, head_rows = load_rows(args.head)
+    print(f"base {base_report.get('commit')}  head {head_report.get('commit')}")
+    print(f"{'size':>8} {'scenario':<12} {'conc':>4} " + " ".join(f"{metric:>22}" for metric in METRICS))
+
+    regressions = 0
+    for key in sorted(base_rows.keys() & head_rows.keys()):
+        base, head = base_rows[key], head_rows[key]
+        cells = []
+        regressed = False
+        for metric, direction in METRICS.items():
+            delta = change(base.get(metric), head.get(metric))
+            mark = ""
+            if delta is not None and metric in GATED and delta * direction < -args.threshold:
+                mark = "!"
+                regressed = True
+            cell = f"{base.get(metric)} -> {head.get(metric)}"
+            if delta is not None:
+                cell += f" {delta:+.0%}{mark}"
+            cells.append(f"{cell:>22}")
+        regressions += regressed
+        print(f"{key[0]:>8} {key[1]:<12} {key[2]:>4} " + " ".join(cells))
+
+    for key in sorted(base_rows.keys() ^ head_rows.keys()):
+        print(f"only in {'base' if key in base_rows else 'head'}: {key}")
+    print(f"{regressions} regressed row(s) at a {args.threshold:.0%} threshold")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
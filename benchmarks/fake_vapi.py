@@ -0,0 +1,138 @@
+"""Local stand-in for the Vapi REST API used by the benchmarks.
+
+Only the endpoints main.py talks to are emulated. Behaviour is set with
+environment variables:
+
+- FAKE_VAPI_LATENCY: seconds every response is delayed (default 0.2)
+- FAKE_VAPI_ERROR_RATE: fraction of requests answered with a 500 (default 0)
+- FAKE_VAPI_HANG_RATE: fraction of requests that stall for
+  FAKE_VAPI_HANG_SECONDS before answering (defaults 0 and 60)
+- FAKE_VAPI_LOST_CREATE_RATE: fraction of creates that place the call but
+  answer with a 500, as if the response was lost (default 0)
+- FAKE_VAPI_RING_SECONDS / FAKE_VAPI_CALL_SECONDS: how long a created call
+  rings and then talks before it ends with an analysis (defaults 2 and 10)
+- FAKE_VAPI_SEED: seed for error injection and call outcomes (default 1)
+"""
+from fastapi import FastAPI, HTTPException, Request
+from typing import Optional
+import asyncio
+import datetime
+import os
+import random
+import threading
+import time
+import uuid
+import uvicorn
+
+LATENCY = float(os.getenv("FAKE_VAPI_LATENCY", "0.2"))
+ERROR_RATE = float(os.getenv("FAKE_VAPI_ERROR_RATE", "0"))
+HANG_RATE = float(os.getenv("FAKE_VAPI_HANG_RATE", "0"))
+HANG_SECONDS = float(os.getenv("FAKE_VAPI_HANG_SECONDS", "60"))
+LOST_CREATE_RATE = float(os.getenv("FAKE_VAPI_LOST_CREATE_RATE", "0"))
+RING_SECONDS = float(os.getenv("FAKE_VAPI_RING_SECONDS", "2"))
+CALL_SECONDS = float(os.getenv("FAKE_VAPI_CALL_SECONDS", "10"))
+
+# Drives both error injection and call outcomes so runs are repeatable
+rng = random.Random(int(os.getenv("FAKE_VAPI_SEED", "1")))
+
+# How calls end, with weights
+ENDED_REASONS = [("completed", 8), ("customer-did-not-answer", 1), ("customer-busy", 1)]
+
+app = FastAPI(title="Fake Vapi")
+
+# Calls created through the stub, keyed by id
+calls = {}
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+async def _respond():
+    """Wait out the configured latency, then stall or fail a share of requests"""
+    await asyncio.sleep(LATENCY)
+    if HANG_RATE and rng.random() < HANG_RATE:
+        await asyncio.sleep(HANG_SECONDS)
+    if ERROR_RATE and rng.random() < ERROR_RATE:
+        raise HTTPException(status_code=500, detail="Injected fake Vapi error")
+
+def _progress(call):
+    """Move a call through queued -> ringing -> in-progress -> ended by age"""
+    age = (_now() - call["_created"]).total_seconds()
+    if call["status"] == "ended":
+        return call
+    if age >= RING_SECONDS + CALL_SECONDS:
+        reason = rng.choices([r for r, _ in ENDED_REASONS], [w for _, w in ENDED_REASONS])[0]
+        started = call["_created"] + datetime.timedelta(seconds=RING_SECONDS)
+        call.update({
+            "status": "ended",
+            "endedReason": reason,
+            "endedAt": (started + datetime.timedelta(seconds=CALL_SECONDS)).isoformat(),
+            "cost": round(CALL_SECONDS * 0.0025, 4),
+        })
+        if reason == "completed":
+            call["startedAt"] = started.isoformat()
+            call["transcript"] = "AI: Hi, I'm calling to verify benefits.\nUser: Sure, go ahead.\n" * 20
+            call["analysis"] = {
+                "summary": "Verified dental benefits for the patient.",
+                "successEvaluation": "true" if rng.random() < 0.9 else "false",
+                "structuredData": {
+                    "deductible": {"individual": 50, "family": 150},
+                    "coinsurance": {"basic": 80, "major": 50},
+                    "frequency": "2 per year",
+                },
+            }
+    elif age >= RING_SECONDS:
+        call["status"] = "in-progress"
+        call["startedAt"] = (call["_created"] + datetime.timedelta(seconds=RING_SECONDS)).isoformat()
+    elif age > 0:
+        call["status"] = "ringing"
+    return call
+
+def _public(call):
+    return {key: value for key, value in call.items() if not key.startswith("_")}
+
+@app.post("/call")
+async def create_call(request: Request):
+    body = await request.json()
+    await _respond()
+    call_id = str(uuid.uuid4())
+    created = _now()
+    calls[call_id] = {
+        "id": call_id,
+        "name": body.get("name"),
+        "status": "queued",
+        "customer": body.get("customer"),
+        "createdAt": created.isoformat(),
+        "_created": created,
+    }
+    if LOST_CREATE_RATE and rng.random() < LOST_CREATE_RATE:
+        raise HTTPException(status_code=500, detail="Injected error after placing the call")
+    return _public(calls[call_id])
+
+@app.get("/call")
+async def list_calls(limit: int = 100, createdAtGe: Optional[str] = None):
+    await _respond()
+    matching = list(calls.values())
+    if createdAtGe:
+        since = datetime.datetime.fromisoformat(createdAtGe)
+        matching = [call for call in matching if call["_created"] >= since]
+    return [_public(_progress(call)) for call in matching[-limit:]]
+
+@app.get("/call/{call_id}")
+async def get_call(call_id: str):
+    await _respond()
+    if call_id not in calls:
+        return {"id": call_id, "status": "queued", "createdAt": _now().isoformat()}
+    return _public(_progress(calls[call_id]))
+
+def serve_in_background(port=8765):
+    """Start the stub on a daemon thread and wait until it accepts requests"""
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("FAKE_VAPI_PORT", "8765")))
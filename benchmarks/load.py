@@ -0,0 +1,273 @@
+"""Load-test the app over HTTP against the fake Vapi server.
+
+For each record-store size, seeds a fresh call store, starts the app with
+uvicorn in a subprocess, then drives every scenario at each concurrency
+level for a fixed time. Prints one JSON document with throughput, p50/p99
+latency and server RSS per (store size, scenario, concurrency):
+
+    python benchmarks/load.py --sizes 1000,100000,1000000 --concurrency 1,8,32 --output head.json
+    python benchmarks/compare.py base.json head.json
+
+Fake Vapi behaviour is set with the FAKE_VAPI_* variables in fake_vapi.py.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The app subprocess gets the caller's environment, not the defaults that
+# bench_batch sets for its own run when ROW is imported below
+APP_ENVIRON = dict(os.environ)
+
+import fake_vapi
+
+FAKE_VAPI_PORT = int(os.getenv("FAKE_VAPI_PORT", "8765"))
+os.environ.setdefault("VAPI_API_KEY", "bench")
+
+import httpx
+from bench_batch import ROW
+from main import CallStore
+
+SCENARIOS = ["api_create", "web_create", "api_list", "api_get", "calls_page"]
+SEED_STATUSES = ["completed", "completed", "completed", "failed", "customer-did-not-answer"]
+
+def seed_records(size, rng):
+    """Yield ended call records spread over the last year"""
+    start = datetime.datetime.now() - datetime.timedelta(days=365)
+    step = 365 * 86400 / max(size, 1)
+    for i in range(size):
+        status = rng.choice(SEED_STATUSES)
+        created = start + datetime.timedelta(seconds=i * step)
+        yield {
+            "id": f"seed-{i:08d}",
+            "phone_number": f"+1555{i % 10000000:07d}",
+            "timestamp": created.strftime("%Y-%m-%d %H:%M:%S"),
+            "status": status,
+            "assistant_type": "general",
+            "patient_data": {"insurance_carrier": rng.choice(["MetLife", "Cigna", "Delta Dental"])},
+            "results": {
+                "id": f"seed-{i:08d}",
+                "status": status,
+                "ended_reason": "completed" if status in ("completed", "failed") else status,
+                "success_evaluation": status == "completed",
+                "started_at": created.isoformat(),
+                "ended_at": (created + datetime.timedelta(seconds=rng.randint(30, 600))).isoformat(),
+                "cost": round(rng.uniform(0.05, 1.5), 4),
+            },
+        }
+
+def seed_store(path, size, rng):
+    store = CallStore(path)
+    batch = []
+    for record in seed_records(size, rng):
+        batch.append(record)
+        if len(batch) == 50000:
+            store.save_many(batch)
+            batch = []
+    store.save_many(batch)
+    store.conn.close()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def read_rss_mb(pid):
+    """Current and peak resident set size of a process, in MiB (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f)
+    except OSError:
+        return None, None
+    return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+
+def git_revision():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, text=True).strip())
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def start_app(db_path, port, workers=1, extra_env=None):
+    env = dict(
+        APP_ENVIRON,
+        VAPI_API_KEY=APP_ENVIRON.get("VAPI_API_KEY", "bench"),
+        CALL_RECORDS_DB=db_path,
+        VAPI_BASE_URL=f"http://127.0.0.1:{FAKE_VAPI_PORT}",
+        # Dial straight away whatever the time, rather than holding calls for carrier hours
+        CARRIER_DEFAULT_HOURS=APP_ENVIRON.get("CARRIER_DEFAULT_HOURS", "always"),
+        # Keep the seeded year of history in memory rather than archiving it during the run
+        CALL_RETENTION_DAYS=APP_ENVIRON.get("CALL_RETENTION_DAYS", "0"),
+    )
+    env.update(extra_env or {})
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as http:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"App exited during startup with code {process.returncode}")
+            try:
+                if (await http.get("/api/cache/stats")).status_code == 200:
+                    return process, time.perf_counter() - started
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.05)
+
+def make_request(scenario, rng, call_ids):
+    """Return (method, path, request kwargs) for one request of a scenario"""
+    phone_number = f"+1555{rng.randrange(10000000):07d}"
+    if scenario == "api_create":
+        return "POST", "/api/calls", {"json": {"phone_number": phone_number}}
+    if scenario == "web_create":
+        return "POST", "/create_call", {"data": {**ROW, "phone_number": phone_number}}
+    if scenario == "api_list":
+        return "GET", "/api/calls", {"params": {"limit": 50}}
+    if scenario == "api_get":
+        return "GET", f"/api/calls/{rng.choice(call_ids)}", {}
+    return "GET", "/calls", {}
+
+async def drive(http, scenario, concurrency, duration, rng, call_ids):
+    """Run concurrency workers for duration seconds; return latencies and error count"""
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            method, path, kwargs = make_request(scenario, rng, call_ids)
+            started = time.perf_counter()
+            try:
+                response = await http.request(method, path, **kwargs)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+            elif scenario == "api_create":
+                call_ids.append(response.json()["call_id"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, errors, time.perf_counter() - started
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+async def run_size(size, args, rng):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "load.db")
+        seed_started = time.perf_counter()
+        seed_store(db_path, size, rng)
+        seed_s = time.perf_counter() - seed_started
+
+        port = args.port or free_port()
+        process, startup_s = await start_app(db_path, port)
+        results = []
+        try:
+            limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as http:
+                # The first Vapi call builds the SDK's models; keep it out of the numbers
+                await http.post("/api/calls", json={"phone_number": "+15550000000"})
+                rss_idle, _ = read_rss_mb(process.pid)
+                call_ids = [f"seed-{i:08d}" for i in rng.sample(range(size), min(size, 1000))] if size else []
+                for scenario in args.scenarios:
+                    for concurrency in args.concurrency:
+                        if scenario == "api_get" and not call_ids:
+                            continue
+                        latencies, errors, elapsed = await drive(http, scenario, concurrency, args.duration, rng, call_ids)
+                        rss, peak_rss = read_rss_mb(process.pid)
+                        results.append({
+                            "store_size": size,
+                            "scenario": scenario,
+                            "concurrency": concurrency,
+                            "requests": len(latencies),
+                            "errors": errors,
+                            "throughput_rps": round(len(latencies) / elapsed, 2),
+                            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+                            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+                            "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+                            "rss_mb": round(rss, 1) if rss else None,
+                            "peak_rss_mb": round(peak_rss, 1) if peak_rss else None,
+                        })
+                        print(json.dumps(results[-1]), file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait()
+        return {
+            "store_size": size,
+            "seed_s": round(seed_s, 2),
+            "startup_s": round(startup_s, 2),
+            "idle_rss_mb": round(rss_idle, 1) if rss_idle else None,
+        }, results
+
+async def main(args):
+    fake_vapi.serve_in_background(FAKE_VAPI_PORT)
+    rng = random.Random(args.seed)
+    stores = []
+    results = []
+    for size in args.sizes:
+        store, size_results = await run_size(size, args, rng)
+        stores.append(store)
+        results.extend(size_results)
+    report = {
+        "benchmark": "load",
+        "commit": git_revision(),
+        "recorded_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {
+            "duration_s": args.duration,
+            "seed": args.seed,
+            "fake_vapi_latency_s": fake_vapi.LATENCY,
+            "fake_vapi_error_rate": fake_vapi.ERROR_RATE,
+        },
+        "stores": stores,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+def parse_args():
+    def int_list(value):
+        return [int(item) for item in value.split(",") if item]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int_list, default=[1000, 10000, 100000], help="record-store sizes, comma separated")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 4, 16, 64], help="concurrency levels, comma separated")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=SCENARIOS)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per scenario and concurrency level")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=0, help="port for the app (default: any free port)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -24,6 +24,10 @@ pip install -r requirements.txt --no-deps
 echo "Finalizing dependency installation..."
 pip install fastapi uvicorn[standard] python-multipart jinja2 python-dotenv pytz typing-extensions requests httpcore httpx
 
+# Content-hashed, precompressed static files, served with long-lived cache headers
+echo "Building static files..."
+python main.py build-static
+
 # Print installed packages for verification
 echo "Installed packages:"
 pip list
@@ -1,15 +1,37 @@
-from vapi import Vapi
-from fastapi import FastAPI, Request, Form, HTTPException, Depends
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi import FastAPI, Request, Form, Header, HTTPException, Depends, Query, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any, List
+from starlette.datastructures import Headers, MutableHeaders
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, Dict, Any, List, Mapping
+from dataclasses import dataclass
 from dotenv import load_dotenv
+import asyncio
+import base64
+import bisect
+import collections
+import contextlib
+import csv
 import datetime
+import hashlib
+import hmac
+import html
+import io
 import json
+import math
 import os
-import uvicorn
+import random
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import types
+import uuid
+import zlib
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,31 +39,859 @@ load_dotenv()
 # Create FastAPI app
 app = FastAPI(title="Dental Voice Agent System")
 
+# Serverless hosts freeze or stop the process between requests, so loops
+# started in the background there don't keep running. Vercel sets VERCEL
+# and AWS Lambda sets AWS_LAMBDA_FUNCTION_NAME.
+SERVERLESS = bool(os.getenv("VERCEL") or os.getenv("AWS_LAMBDA_FUNCTION_NAME"))
+
+# Latency histogram buckets in seconds, from 1 ms to 30 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Size histogram buckets in bytes, from 256 B to 4 MiB
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# Wait histogram buckets in seconds, from 1 s to 3 days
+WAIT_BUCKETS = (1, 10, 60, 300, 900, 1800, 3600, 7200, 14400, 28800, 43200, 86400, 259200)
+
+def format_metric_labels(names, values, extra=None):
+    """Render {name="value",...} with values escaped for the text format"""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    """Cumulative histogram with one series per set of label values.
+    
+    Observations may come from worker threads, so updates take a lock.
+    """
+    
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}  # label values -> [count per bucket..., sum, count]
+        self.lock = threading.Lock()
+    
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+    
+    @contextlib.contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted((labels, list(values)) for labels, values in self.series.items())
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                bucket_labels = format_metric_labels(self.label_names, labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = format_metric_labels(self.label_names, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {values[-1]}")
+            lines.append(f"{self.name}_sum{format_metric_labels(self.label_names, labels)} {values[-2]}")
+            lines.append(f"{self.name}_count{format_metric_labels(self.label_names, labels)} {values[-1]}")
+        return lines
+
+class MetricsRegistry:
+    """Histograms updated on the hot path plus gauges read when scraped"""
+    
+    def __init__(self):
+        self.histograms = []
+        self.readings = []  # (name, type, help, read, label names)
+    
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        histogram = Histogram(name, help_text, label_names, buckets)
+        self.histograms.append(histogram)
+        return histogram
+    
+    def gauge(self, name, help_text, read, metric_type="gauge", label_names=()):
+        """Register a value computed at scrape time; metric_type may be "counter".
+        
+        With label_names, read returns a dict of label value tuples to values.
+        """
+        self.readings.append((name, metric_type, help_text, read, label_names))
+    
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render())
+        for name, metric_type, help_text, read, label_names in self.readings:
+            try:
+                value = read()
+            except Exception as e:
+                print(f"Error reading metric {name}: {e}")
+                continue
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"])
+            if label_names:
+                lines.extend(f"{name}{format_metric_labels(label_names, labels)} {v}" for labels, v in sorted(value.items()))
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+VAPI_REQUEST_SECONDS = metrics.histogram(
+    "vapi_request_duration_seconds", "Vapi API round trips", ("operation", "outcome"))
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "Time to response headers per route", ("method", "route", "status"))
+TEMPLATE_RENDER_SECONDS = metrics.histogram(
+    "template_render_duration_seconds", "Jinja template render time", ("template",))
+CALL_STORE_WRITE_SECONDS = metrics.histogram(
+    "call_store_write_duration_seconds", "Call store writes", ("operation",))
+CALL_STORE_WRITE_BYTES = metrics.histogram(
+    "call_store_write_bytes", "Size of call store writes", ("operation",), SIZE_BUCKETS)
+EVENT_LOOP_LAG_SECONDS = metrics.histogram(
+    "event_loop_lag_seconds", "How late the event loop wakes a sleeping task")
+
+@contextlib.contextmanager
+def time_vapi_request(operation):
+    """Time one Vapi call, labelled with whether it raised"""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        VAPI_REQUEST_SECONDS.observe(time.perf_counter() - start, operation, outcome)
+
+class RequestMetricsMiddleware:
+    """Record per-route latency up to the response headers.
+    
+    Streaming responses are timed to their first byte, not to the end of
+    the stream.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        
+        def observe(status):
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, scope["method"], getattr(route, "path", "unmatched"), str(status))
+        
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                observe(message["status"])
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        except Exception:
+            observe(500)
+            raise
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+
+# Media types worth compressing; anything else (images, Parquet, event streams) is sent as is
+COMPRESSIBLE_TYPES = frozenset((
+    "text/html", "text/plain", "text/css", "text/csv", "text/javascript", "application/javascript",
+    "application/json", "application/x-ndjson", "image/svg+xml",
+))
+
+brotli_module = False
+
+def get_brotli():
+    """The brotli module if it is installed (`pip install brotli`), else None"""
+    global brotli_module
+    if brotli_module is False:
+        try:
+            import brotli as brotli_module
+        except ImportError:
+            brotli_module = None
+    return brotli_module
+
+def accepted_encodings(accept_encoding):
+    """br and gzip in the client's order of preference, leaving out any it refuses"""
+    weights = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        match = re.search(r"q\s*=\s*([0-9.]+)", params)
+        try:
+            weights[name.strip()] = float(match.group(1)) if match else 1.0
+        except ValueError:
+            weights[name.strip()] = 0.0
+    ranked = [(weights.get(encoding, weights.get("*", 0.0)), -rank, encoding) for rank, encoding in enumerate(("br", "gzip"))]
+    return [encoding for weight, _, encoding in sorted(ranked, reverse=True) if weight > 0]
+
+def negotiate_encoding(accept_encoding):
+    """The encoding to compress a response with, or None to send it as is"""
+    for encoding in accepted_encodings(accept_encoding):
+        if encoding == "gzip" or get_brotli() is not None:
+            return encoding
+    return None
+
+class StreamCompressor:
+    """gzip or brotli compressor for a body sent in one or more chunks"""
+    
+    def __init__(self, encoding, level=None):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = get_brotli().Compressor(quality=COMPRESS_BROTLI_QUALITY if level is None else level)
+        else:
+            # wbits=31 writes a gzip header and trailer around the deflate stream
+            self.compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL if level is None else level, zlib.DEFLATED, 31)
+    
+    def compress(self, data, final):
+        """Compress a chunk; unless final, flush so the client can decode everything sent so far"""
+        if self.encoding == "br":
+            return self.compressor.process(data) + (self.compressor.finish() if final else self.compressor.flush())
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+def compress_body(body, encoding, level=None):
+    return StreamCompressor(encoding, level).compress(body, True)
+
+class CompressionMiddleware:
+    """Compress text responses with brotli or gzip, as the client prefers.
+    
+    Bodies sent in one message are compressed when they reach
+    COMPRESS_MIN_BYTES; streamed bodies (exports) are compressed chunk by
+    chunk and flushed after each one. Responses that already carry a
+    Content-Encoding, such as cached and precompressed ones, partial
+    content and event streams are passed through untouched.
+    """
+    
+    def __init__(self, app, minimum_size=COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        start = None
+        compressor = None
+        
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                return await send(message)
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start["headers"])
+                media_type = headers.get("content-type", "").split(";")[0].strip()
+                if (
+                    "content-encoding" in headers or "content-range" in headers or start["status"] < 200
+                    or start["status"] in (204, 206, 304) or media_type not in COMPRESSIBLE_TYPES
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    await send(start)
+                    start = None
+                    return await send(message)
+                compressor = StreamCompressor(encoding)
+                headers["Content-Encoding"] = encoding
+                if "accept-encoding" not in headers.get("vary", "").lower():
+                    headers.add_vary_header("Accept-Encoding")
+                body = compressor.compress(body, not more_body)
+                if more_body:
+                    del headers["content-length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+                await send(start)
+                return await send({"type": "http.response.body", "body": body, "more_body": more_body})
+            await send({"type": "http.response.body", "body": compressor.compress(body, not more_body), "more_body": more_body})
+        
+        await self.app(scope, receive, send_compressed)
+
+# Added first so it runs inside the metrics middleware, which then times compression too
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
+
+# Seconds between event-loop lag samples
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+event_loop_lag = 0.0
+
+async def probe_event_loop_lag(interval):
+    """Measure how much later than requested the loop resumes a sleep"""
+    global event_loop_lag
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        event_loop_lag = max(time.perf_counter() - start - interval, 0.0)
+        EVENT_LOOP_LAG_SECONDS.observe(event_loop_lag)
+
+# The sampling profiler exposes stack traces, so it is off unless asked for
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+profiler_lock = asyncio.Lock()
+
+def sample_stacks(seconds, interval):
+    """Sample every other thread's stack and count identical stacks (blocking)"""
+    counts = collections.Counter()
+    sampler = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == sampler:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return counts
+
+STATIC_DIR = "static"
+# `python main.py build-static` writes content-hashed copies of the static
+# files here, plus a manifest mapping each original path to its copy
+STATIC_BUILD_DIR = os.path.join(STATIC_DIR, "dist")
+STATIC_MANIFEST = os.path.join(STATIC_BUILD_DIR, "manifest.json")
+# Static files that get .br and .gz copies at build time
+PRECOMPRESSED_EXTENSIONS = (".js", ".css", ".svg", ".html", ".json", ".txt", ".map")
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+def load_static_manifest():
+    """{original path: hashed path} from the last static build, or {} if there wasn't one"""
+    try:
+        with open(STATIC_MANIFEST) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Error reading {STATIC_MANIFEST}: {e}")
+        return {}
+
+def build_static_assets():
+    """Write content-hashed copies of the static files, with .gz and .br copies, and the manifest (blocking).
+    
+    Copies from earlier builds are left in place, so pages rendered before
+    a deploy keep working. Brotli copies need `pip install brotli`.
+    """
+    manifest = {}
+    for directory, subdirectories, names in os.walk(STATIC_DIR):
+        subdirectories[:] = sorted(name for name in subdirectories if os.path.join(directory, name) != STATIC_BUILD_DIR)
+        for name in sorted(names):
+            path = os.path.join(directory, name)
+            relative = os.path.relpath(path, STATIC_DIR).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            stem, extension = os.path.splitext(relative)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}"
+            output = os.path.join(STATIC_BUILD_DIR, *hashed.split("/"))
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            copies = {output: data}
+            if extension in PRECOMPRESSED_EXTENSIONS:
+                copies[output + PRECOMPRESSED_SUFFIXES["gzip"]] = compress_body(data, "gzip", 9)
+                if get_brotli() is not None:
+                    copies[output + PRECOMPRESSED_SUFFIXES["br"]] = compress_body(data, "br", 11)
+            for copy_path, content in copies.items():
+                with open(copy_path, "wb") as f:
+                    f.write(content)
+            manifest[relative] = os.path.relpath(output, STATIC_DIR).replace(os.sep, "/")
+    os.makedirs(STATIC_BUILD_DIR, exist_ok=True)
+    with open(STATIC_MANIFEST + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(STATIC_MANIFEST + ".tmp", STATIC_MANIFEST)
+    return manifest
+
+class PrecompressedStaticFiles(StaticFiles):
+    """Static files that serve a prebuilt .br or .gz copy when the client accepts it.
+    
+    Files under dist/ have their content hash in their name and never
+    change, so browsers may cache them for a year without asking again;
+    anything else is revalidated with its ETag on every use.
+    """
+    
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code == 200:
+            for encoding in accepted_encodings(Headers(scope=scope).get("accept-encoding", "")):
+                full_path, stat_result = await asyncio.to_thread(self.lookup_path, path + PRECOMPRESSED_SUFFIXES[encoding])
+                if stat_result is not None:
+                    content_type = response.headers["content-type"]
+                    response = self.file_response(full_path, stat_result, scope)
+                    response.headers["Content-Type"] = content_type
+                    response.headers["Content-Encoding"] = encoding
+                    break
+        response.headers["Vary"] = "Accept-Encoding"
+        immutable = path.replace(os.sep, "/").startswith("dist/")
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable" if immutable else "no-cache"
+        return response
+
 # Create a custom Jinja2Templates class to handle url_for
 class CustomJinja2Templates(Jinja2Templates):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.env.globals["url_for"] = self.url_for
+        self.static_manifest = load_static_manifest()
     
     def url_for(self, name, **path_params):
-        # Handle "static" route specially
+        # Static files resolve to their content-hashed copy once one has been built
         if name == "static" and "filename" in path_params:
-            return f"/static/{path_params['filename']}"
+            filename = path_params["filename"]
+            return f"/static/{self.static_manifest.get(filename, filename)}"
         return app.url_path_for(name, **path_params)
+    
+    def TemplateResponse(self, *args, **kwargs):
+        # The template is rendered while the response is built
+        name = kwargs.get("name") or next((arg for arg in args if isinstance(arg, str)), "unknown")
+        with TEMPLATE_RENDER_SECONDS.time(name):
+            return super().TemplateResponse(*args, **kwargs)
 
-# Configure Jinja2 templates
-templates = CustomJinja2Templates(directory="templates")
+# Jinja2 templates are configured on first render
+templates = None
+
+def get_templates():
+    global templates
+    if templates is None:
+        templates = CustomJinja2Templates(directory="templates")
+    return templates
 
 # Mount static files directory if it exists
-if os.path.exists("static"):
-    app.mount("/static", StaticFiles(directory="static"), name="static")
+if os.path.exists(STATIC_DIR):
+    app.mount("/static", PrecompressedStaticFiles(directory=STATIC_DIR), name="static")
+
+# Default read timeout (seconds) for Vapi round trips without their own below
+VAPI_TIMEOUT = float(os.getenv("VAPI_TIMEOUT", "30"))
+VAPI_OPERATION_TIMEOUTS = {
+    "create": float(os.getenv("VAPI_CREATE_TIMEOUT", "15")),
+    "get": float(os.getenv("VAPI_GET_TIMEOUT", "10")),
+    "list": float(os.getenv("VAPI_LIST_TIMEOUT", "20")),
+}
+VAPI_CONNECT_TIMEOUT = float(os.getenv("VAPI_CONNECT_TIMEOUT", "3"))
+
+# Connection pool shared by every Vapi request
+VAPI_MAX_CONNECTIONS = int(os.getenv("VAPI_MAX_CONNECTIONS", "20"))
+VAPI_MAX_KEEPALIVE = int(os.getenv("VAPI_MAX_KEEPALIVE", "10"))
+VAPI_KEEPALIVE_EXPIRY = float(os.getenv("VAPI_KEEPALIVE_EXPIRY", "30"))
+
+# Retries with jittered exponential backoff: reads are retried on errors,
+# timeouts, 429 and 5xx; creates see create_vapi_call
+VAPI_READ_RETRIES = int(os.getenv("VAPI_READ_RETRIES", "3"))
+VAPI_CREATE_RETRIES = int(os.getenv("VAPI_CREATE_RETRIES", "1"))
+VAPI_RETRY_BASE_DELAY = float(os.getenv("VAPI_RETRY_BASE_DELAY", "0.2"))
+VAPI_RETRY_MAX_DELAY = float(os.getenv("VAPI_RETRY_MAX_DELAY", "2"))
+
+# The SDK's own retries would also repeat creates, so they are turned off
+# and VapiTransport retries instead
+VAPI_REQUEST_OPTIONS = {"max_retries": 0}
+
+def vapi_retry_delay(attempt):
+    """Full-jitter exponential backoff before retry number attempt + 1"""
+    return random.uniform(0, min(VAPI_RETRY_MAX_DELAY, VAPI_RETRY_BASE_DELAY * 2 ** attempt))
+
+class VapiUnavailable(Exception):
+    """Raised without contacting Vapi while the circuit breaker is open"""
+    
+    def __init__(self, retry_after):
+        super().__init__(f"Vapi is unavailable; retry in {math.ceil(retry_after)}s")
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Stops sending requests to Vapi while it keeps failing.
+    
+    After failure_threshold consecutive failures (connection errors,
+    timeouts, 5xx) the circuit opens and requests fail at once with
+    VapiUnavailable for reset_timeout seconds. Then a single trial request
+    goes out: success closes the circuit, failure opens it again.
+    """
+    
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.opens = 0
+        self.rejected = 0
+    
+    def retry_after(self):
+        return max(self.opened_at + self.reset_timeout - time.monotonic(), 0.0)
+    
+    def is_open(self):
+        return self.state == "open" and self.retry_after() > 0
+    
+    def before_request(self):
+        """Raise VapiUnavailable unless a request may go out now"""
+        if self.state == "open":
+            if self.retry_after() > 0:
+                self.rejected += 1
+                raise VapiUnavailable(self.retry_after())
+            self.state = "half_open"
+            self.trial_in_flight = False
+        if self.state == "half_open":
+            if self.trial_in_flight:
+                self.rejected += 1
+                raise VapiUnavailable(1.0)
+            self.trial_in_flight = True
+    
+    def record_success(self):
+        if self.state != "closed":
+            print("Vapi circuit closed")
+        self.state = "closed"
+        self.failures = 0
+        self.trial_in_flight = False
+    
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+                print(f"Vapi circuit opened after {self.failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+    
+    def release(self):
+        """Forget a request that ended without telling us anything about Vapi"""
+        self.trial_in_flight = False
+    
+    def stats(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_after": round(self.retry_after(), 1) if self.state == "open" else None,
+            "opens": self.opens,
+            "rejected": self.rejected,
+        }
+
+vapi_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("VAPI_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("VAPI_BREAKER_RESET", "30")),
+)
+
+class VapiTransport:
+    """Transport under the Vapi client's httpx client.
+    
+    Sets per-operation timeouts, retries and checks the circuit breaker
+    around a pooled keep-alive transport. GETs are retried on connection
+    errors, timeouts, 429 and 5xx. Other requests are only retried when
+    the connection failed before anything was sent, since Vapi may have
+    acted on them. Implements httpx's AsyncBaseTransport interface as a
+    plain class so importing main doesn't import httpx.
+    """
+    
+    def __init__(self, transport, breaker, timeouts, connect_timeout, retries):
+        self.transport = transport
+        self.breaker = breaker
+        self.timeouts = timeouts
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.retried = 0
+    
+    def operation(self, request):
+        if request.method == "POST":
+            return "create"
+        return "list" if request.url.path.rstrip("/").rsplit("/", 1)[-1] == "call" else "get"
+    
+    async def handle_async_request(self, request):
+        import httpx
+        timeout = self.timeouts.get(self.operation(request), VAPI_TIMEOUT)
+        request.extensions["timeout"] = httpx.Timeout(timeout, connect=self.connect_timeout).as_dict()
+        for attempt in range(self.retries + 1):
+            retryable = request.method == "GET" and attempt < self.retries
+            self.breaker.before_request()
+            try:
+                response = await self.transport.handle_async_request(request)
+                # Read the body here, so a body that stalls times out this attempt
+                await response.aread()
+            except httpx.PoolTimeout:
+                # Every pooled connection is busy: local back-pressure, not a Vapi fault
+                self.breaker.release()
+                raise
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                self.breaker.record_failure()
+                # Nothing reached Vapi, so any request can be retried
+                if attempt >= self.retries:
+                    raise
+            except httpx.TransportError:
+                self.breaker.record_failure()
+                if not retryable:
+                    raise
+            except BaseException:
+                self.breaker.release()
+                raise
+            else:
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if not (retryable and (response.status_code >= 500 or response.status_code == 429)):
+                    return response
+                await response.aclose()
+            self.retried += 1
+            await asyncio.sleep(vapi_retry_delay(attempt))
+    
+    async def aclose(self):
+        await self.transport.aclose()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+# The async Vapi client keeps Vapi round trips off the event loop so
+# concurrent requests overlap their network waits instead of queueing behind
+# each other. It is built on first use so importing main stays cheap on cold
+# serverless instances. VAPI_BASE_URL can point it at a local stub for
+# benchmarking.
+client = None
+vapi_transport = None
+client_lock = threading.Lock()
+
+def get_vapi_client():
+    global client, vapi_transport
+    with client_lock:
+        if client is None:
+            import httpx
+            from vapi import AsyncVapi
+            vapi_transport = VapiTransport(
+                httpx.AsyncHTTPTransport(limits=httpx.Limits(
+                    max_connections=VAPI_MAX_CONNECTIONS,
+                    max_keepalive_connections=VAPI_MAX_KEEPALIVE,
+                    keepalive_expiry=VAPI_KEEPALIVE_EXPIRY,
+                )),
+                vapi_breaker, VAPI_OPERATION_TIMEOUTS, VAPI_CONNECT_TIMEOUT, VAPI_READ_RETRIES,
+            )
+            client = AsyncVapi(
+                token=os.getenv("VAPI_API_KEY"),
+                base_url=os.getenv("VAPI_BASE_URL") or None,
+                timeout=VAPI_TIMEOUT,
+                httpx_client=httpx.AsyncClient(transport=vapi_transport, timeout=VAPI_TIMEOUT),
+            )
+    return client
+
+def vapi_error_is_transient(error):
+    """True for failures that say nothing about whether Vapi acted on the request"""
+    import httpx
+    if isinstance(error, VapiUnavailable):
+        return False
+    if isinstance(error, httpx.TransportError):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and (status_code >= 500 or status_code == 429)
 
-# Initialize the Vapi client using API key from environment variables
-client = Vapi(token=os.getenv("VAPI_API_KEY"))
+async def find_placed_call(request, sent_at):
+    """A call matching a create request that Vapi placed after sent_at, or None.
+    
+    Calls this process already records are skipped, so an earlier call to
+    the same number is never mistaken for this one.
+    """
+    with time_vapi_request("list"):
+        calls = await get_vapi_client().calls.list(
+            created_at_ge=sent_at - datetime.timedelta(seconds=60), limit=100, request_options=VAPI_REQUEST_OPTIONS,
+        )
+    number = request["customer"]["number"]
+    for call in calls:
+        customer = getattr(call, "customer", None)
+        if (getattr(customer, "number", None) == number and getattr(call, "name", None) == request.get("name")
+                and call.id not in call_records):
+            return call
+    return None
+
+async def create_vapi_call(**request):
+    """calls.create, retried up to VAPI_CREATE_RETRIES times after transient failures.
+    
+    A 5xx or a timeout doesn't say whether the call was placed, so before
+    each retry Vapi is asked for a matching call created since the first
+    attempt, and that call is returned instead of dialling twice.
+    """
+    sent_at = datetime.datetime.now(datetime.timezone.utc)
+    for attempt in range(VAPI_CREATE_RETRIES + 1):
+        try:
+            with time_vapi_request("create"):
+                return await get_vapi_client().calls.create(**request, request_options=VAPI_REQUEST_OPTIONS)
+        except Exception as error:
+            if attempt >= VAPI_CREATE_RETRIES or not vapi_error_is_transient(error):
+                raise
+            print(f"Vapi create failed ({error!r}); checking whether the call was placed")
+        try:
+            placed = await find_placed_call(request, sent_at)
+        except Exception as error:
+            # Not a VapiUnavailable: asking the caller to retry could dial twice
+            raise RuntimeError(
+                f"Vapi failed and may have placed the call to {request['customer']['number']}; "
+                f"check the call list before retrying ({error})"
+            ) from error
+        if placed is not None:
+            return placed
+        await asyncio.sleep(vapi_retry_delay(attempt))
+
+# The SDK imports its call models (several seconds of CPU) the first time
+# client.calls is used; do that in a worker thread at startup instead of in
+# the first request that dials
+VAPI_PREWARM = os.getenv("VAPI_PREWARM", "true").lower() == "true"
+
+def prewarm_vapi_client():
+    """Import the SDK's call client and models (blocking)"""
+    started = time.perf_counter()
+    get_vapi_client().calls
+    print(f"Vapi client ready in {time.perf_counter() - started:.1f}s")
+
+# Shared secret for Vapi server messages sent to /api/vapi/webhook. When set,
+# webhooks keep call records current and read paths stop polling Vapi.
+VAPI_WEBHOOK_SECRET = os.getenv("VAPI_WEBHOOK_SECRET")
+
+class CallRegistry:
+    """In-memory call records with O(1) id lookup and maintained indexes.
+    
+    Records are kept in a dict by id, a timestamp-ordered list of
+    (timestamp, id) keys updated with bisect on insert, and secondary
+    indexes of ids by status and assistant_type. Timestamps use the fixed
+    "%Y-%m-%d %H:%M:%S" format, so string order is chronological order.
+    """
+    
+    def __init__(self, records=()):
+        self.replace_all(records)
+    
+    def __len__(self):
+        return len(self.by_id)
+    
+    def __contains__(self, call_id):
+        return call_id in self.by_id
+    
+    def __iter__(self):
+        """Iterate records oldest first"""
+        return (self.by_id[call_id] for _, call_id in self.order)
+    
+    def get(self, call_id):
+        return self.by_id.get(call_id)
+    
+    def mark_changed(self):
+        """Bump the data version after any record changes"""
+        self.version += 1
+    
+    def add(self, record):
+        """Insert a record, replacing any existing record with the same id"""
+        if record["id"] in self.by_id:
+            self.remove(record["id"])
+        self.mark_changed()
+        self.by_id[record["id"]] = record
+        bisect.insort(self.order, (record.get("timestamp", ""), record["id"]))
+        self.by_status.setdefault(record.get("status"), set()).add(record["id"])
+        self.by_assistant_type.setdefault(record.get("assistant_type"), set()).add(record["id"])
+    
+    def add_older(self, records):
+        """Add records, newest first, that are older than any added by an earlier call.
+        
+        Used to load history a chunk at a time: the chunk's keys are merged in
+        at the front of the order index in one step instead of one insort per
+        record. Ids already present are skipped; returns the records added.
+        """
+        added = []
+        keys = []
+        for record in reversed(records):
+            if record["id"] in self.by_id:
+                continue
+            self.by_id[record["id"]] = record
+            self.by_status.setdefault(record.get("status"), set()).add(record["id"])
+            self.by_assistant_type.setdefault(record.get("assistant_type"), set()).add(record["id"])
+            keys.append((record.get("timestamp", ""), record["id"]))
+            added.append(record)
+        if keys:
+            self.mark_changed()
+            # Records added out of order with add() may sit among the new keys
+            head = bisect.bisect_right(self.order, keys[-1])
+            self.order[:head] = sorted(self.order[:head] + keys)
+        return added
+    
+    def remove(self, call_id):
+        record = self.by_id.pop(call_id, None)
+        if record is None:
+            return None
+        self.mark_changed()
+        key = (record.get("timestamp", ""), call_id)
+        index = bisect.bisect_left(self.order, key)
+        if index < len(self.order) and self.order[index] == key:
+            del self.order[index]
+        self.by_status.get(record.get("status"), set()).discard(call_id)
+        self.by_assistant_type.get(record.get("assistant_type"), set()).discard(call_id)
+        return record
+    
+    def set_status(self, record, status):
+        """Change a record's status and move it to the matching index"""
+        old_status = record.get("status")
+        if old_status == status:
+            return
+        self.mark_changed()
+        self.by_status.get(old_status, set()).discard(record["id"])
+        record["status"] = status
+        self.by_status.setdefault(status, set()).add(record["id"])
+    
+    def ids_with_status(self, status):
+        return self.by_status.get(status, set())
+    
+    def ids_with_assistant_type(self, assistant_type):
+        return self.by_assistant_type.get(assistant_type, set())
+    
+    def newest_first(self):
+        """Iterate records newest first without sorting"""
+        return (self.by_id[call_id] for _, call_id in reversed(self.order))
+    
+    def page(self, limit, before=None, since=None, until=None, predicate=None):
+        """Return up to limit records newest first, plus the key to resume from.
+        
+        before is an exclusive (timestamp, id) key from a previous page and
+        since/until bound the timestamp, so a page only walks the part of
+        the order index it returns instead of the whole history.
+        """
+        index = len(self.order) if before is None else bisect.bisect_left(self.order, tuple(before))
+        if until is not None:
+            index = min(index, bisect.bisect_right(self.order, (until, "\uffff")))
+        
+        records = []
+        index -= 1
+        while index >= 0 and len(records) < limit:
+            timestamp, call_id = self.order[index]
+            if since is not None and timestamp < since:
+                return records, None
+            # Exports page from a worker thread, so the record may have just been removed
+            record = self.by_id.get(call_id)
+            if record is not None and (predicate is None or predicate(record)):
+                records.append(record)
+            index -= 1
+        
+        if index < 0 or not records:
+            return records, None
+        last = records[-1]
+        return records, (last.get("timestamp", ""), last["id"])
+    
+    def replace_all(self, records):
+        """Drop every record and index, then load the given records"""
+        self.by_id = {}
+        self.order = []
+        self.by_status = {}
+        self.by_assistant_type = {}
+        self.version = 0
+        for record in records:
+            self.add(record)
 
-# Store call records (in-memory database for simplicity)
-# In a production environment, use a proper database
-call_records = []
+# Store call records (in-memory, persisted to the call store)
+call_records = CallRegistry()
 
 # Create Pydantic models for request/response validation
 class PhoneNumberRequest(BaseModel):
@@ -49,11 +899,43 @@ class PhoneNumberRequest(BaseModel):
 
 class CallResponse(BaseModel):
     success: bool
-    call_id: str
+    call_id: Optional[str] = None
+    # Set when the carrier is closed and the call waits in the call queue
+    queue_id: Optional[str] = None
+    scheduled_for: Optional[datetime.datetime] = None
 
 class ErrorResponse(BaseModel):
     error: str
 
+class CallRequestRow(BaseModel):
+    """One batch row, with the same fields as the /create_call form"""
+    phone_number: str = Field(..., min_length=1)
+    assistant_type: str = "general"
+    appointment_date: str
+    insurance_rep: str
+    insurance_carrier: str
+    insurance_phone: str
+    insured_name: str
+    insured_dob: str
+    insured_ss: str
+    insured_id: str
+    relationship_to_patient: str
+    patient_name: str
+    patient_dob: str
+    employer: str
+    group_number: str
+    claims_address: str
+    payor_id: str
+    clinic_name: str
+    practice_tax_id: str
+    treating_dentist_name: str
+    dentist_npi: str
+
+class BatchResponse(BaseModel):
+    success: bool
+    batch_id: str
+    total: int
+
 class CallData(BaseModel):
     id: str
     status: str
@@ -70,432 +952,3898 @@ class CallData(BaseModel):
     started_at_formatted: Optional[str] = None
     ended_at_formatted: Optional[str] = None
 
-patient_clinic_data = {
-    "appointment_date": "01-07-2025",
-    "insurance_rep": "WEB",
-    "insurance_carrier": "METLIFE PPO",
-    "insurance_phone": "(800)275-4638",
+# Sample patient and clinic data dialed by POST /api/calls, which only
+# takes a phone number. Never reassigned; web and batch calls carry their
+# own data in a CallContext.
+patient_clinic_data = {
+    "appointment_date": "01-07-2025",
+    "insurance_rep": "WEB",
+    "insurance_carrier": "METLIFE PPO",
+    "insurance_phone": "(800)275-4638",
+    
+    "insured_name": "Jane, Patrick",
+    "insured_dob": "09-07-1999",
+    "insured_ss": "N/A",
+    "insured_id": "104389769",
+
+    "relationship_to_patient": "SELF",
+    
+    "patient_name": "Jane, Patrick",
+    "patient_dob": "09-07-1999",
+    "employer": "FEDERAL EMPLOYEES DENTAL AND",
+    "group_number": "121332",  # Keeping the same key name for compatibility, but it represents Member ID now
+
+    "claims_address": "PO BOX 14093 EL PASO TX 79998",
+    "payor_id": "65978",
+    
+    "clinic_name": "Blue Lines Dental Clinic",
+    "practice_tax_id": "123456",
+    "treating_dentist_name": "Dr. Mustafa",
+    "dentist_npi": "789012",  # Keeping the same key name for compatibility, but it represents NPI Number now
+}
+
+# Form fields the Emblem Health assistant uses; the squad uses every field
+EMBLEM_HEALTH_FIELDS = (
+    "patient_name",
+    "group_number",  # Member ID
+    "patient_dob",
+    "dentist_npi",   # NPI Number
+)
+
+@dataclass(frozen=True)
+class CallContext:
+    """Everything needed to place one call, fixed when the request arrives.
+    
+    Each request builds its own context, so concurrent submissions can no
+    longer dial one patient with another patient's data.
+    """
+    phone_number: str
+    assistant_type: str
+    variables: Mapping[str, str]
+    attempt: int = 1  # 2 and up for redials
+    
+    @classmethod
+    def create(cls, phone_number, assistant_type, form_data, attempt=1):
+        if assistant_type == "emblem_health":
+            form_data = {key: form_data[key] for key in EMBLEM_HEALTH_FIELDS}
+        else:
+            assistant_type = "general"
+        return cls(phone_number, assistant_type, types.MappingProxyType(dict(form_data)), attempt)
+
+# Declarative squad definition: (assistant id, step, next assistant id,
+# handoff condition). Compiled once into the members payload below.
+SQUAD_CONFIG = (
+    ("5cd5625c-2f48-46e1-9575-3dc2b5efedc4", "1. Introduction",
+     "7ca934ef-e8fa-4308-8b80-abdbba8d9e80",
+     "Occurs once the payment_basis and in_network_status are captured."),
+    ("7ca934ef-e8fa-4308-8b80-abdbba8d9e80", "2. Deductibles & Maximums",
+     "eff2f1a7-4614-43bc-96ab-cd53ffd44a72",
+     "Occurs once the waiting_period and missing_tooth_clause are captured."),
+    ("eff2f1a7-4614-43bc-96ab-cd53ffd44a72", "3. Coinsurance Percentages",
+     "9d6589f4-d0f3-4565-b2a9-7165dda1fae2",
+     "Occurs once the coinsurance_periodontics and coinsurance_oral_surgery are All captured."),
+    ("9d6589f4-d0f3-4565-b2a9-7165dda1fae2", "4. Freq A",
+     "2f460c63-bd99-4393-8c17-10b9864e9a14",
+     "Occurs once the srp_4341_coverage and all_four_quads_same_day_allowed are captured."),
+    ("2f460c63-bd99-4393-8c17-10b9864e9a14", "5. Freq B",
+     "f40c8e73-5c26-4e1e-8bd2-2fb04106f4cd",
+     "Occurs once the perio_maint_4910_coverage and missing_tooth_clause_applies are captured."),
+    ("f40c8e73-5c26-4e1e-8bd2-2fb04106f4cd", "6. Freq C",
+     "98b18cf5-3975-4352-9c4c-2c634b3f6108",
+     "Occurs once the ortho_balance_payment_schedule and ortho_work_in_progress_applies and occlusal_guard_9944_covered are All captured."),
+)
+
+EMBLEM_HEALTH_ASSISTANT_ID = "a41cc19c-ff10-4bb7-93f1-e53101b7ec48"
+
+def compile_squad_members(config):
+    """Build the squad members payload, with assistant destinations, from SQUAD_CONFIG"""
+    return [
+        {
+            "assistantId": assistant_id,
+            "assistantDestinations": [
+                {
+                    "type": "assistant",
+                    "assistantId": next_assistant_id,
+                    "description": description,
+                }
+            ],
+        }
+        for assistant_id, _step, next_assistant_id, description in config
+    ]
+
+SQUAD_MEMBERS = compile_squad_members(SQUAD_CONFIG)
+
+async def record_new_call(call_id, context):
+    """Store the initial record for a call that was just created"""
+    # Store call record with patient and clinic data
+    call_record = {
+        "id": call_id,
+        "phone_number": context.phone_number,
+        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "status": "scheduled",  # Initial status is scheduled
+        "assistant_type": context.assistant_type,
+        "patient_data": dict(context.variables),  # Store a copy of the patient data used for this call
+        "attempt": context.attempt,
+    }
+    call_records.add(call_record)
+    
+    # Persist the record to the call store
+    change = await persist_call_record(call_record)
+    call_events.publish(call_record, change)
+    return call_record
+
+async def call_emblem_health(context):
+    """Call the Emblem Health assistant for the given call context"""
+    try:
+        test_call = await create_vapi_call(
+            name="emblem_health_call",
+            assistant_id=EMBLEM_HEALTH_ASSISTANT_ID,
+            phone_number_id=os.getenv("PHONE_NUMBER_ID"),
+            customer={
+                "number": context.phone_number,
+            },
+            assistant_overrides={
+                "variableValues": dict(context.variables)
+            }
+        )
+
+        print(f"Emblem Health call initiated: {test_call.id}")
+        await record_new_call(test_call.id, context)
+        return test_call.id
+    except Exception as error:
+        print(f"Error initiating Emblem Health call: {error}")
+        raise error
+
+async def call_squad(context):
+    """Call the verification squad for the given call context"""
+    try:
+        test_call = await create_vapi_call(
+            name="test_call",
+            squad={
+                "members": SQUAD_MEMBERS,
+                # Variables are sent once and applied to every member
+                "membersOverrides": {
+                    "variableValues": dict(context.variables)
+                },
+            },
+            phone_number_id=os.getenv("PHONE_NUMBER_ID"),
+            customer={
+                "number": context.phone_number,
+            },
+        )
+
+        print(f"Test call initiated: {test_call.id}")
+        await record_new_call(test_call.id, context)
+        return test_call.id
+    except Exception as error:
+        print(f"Error testing workflow: {error}")
+        raise error
+
+async def dispatch_call(context):
+    """Place the squad or Emblem Health call for a call context"""
+    if context.assistant_type == "emblem_health":
+        return await call_emblem_health(context)
+    return await call_squad(context)
+
+def parse_success_evaluation(value):
+    """Convert string "true"/"false" evaluations to boolean values"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.lower() == "true"
+    return bool(value)
+
+def derive_call_status(started_at, ended_reason, success_evaluation):
+    """Determine the call status based on different properties"""
+    call_status = "scheduled"  # Default status
+    
+    if started_at:
+        call_status = "in_progress"
+        
+    if ended_reason == "completed":
+        # Use the evaluation for the status when it is available
+        if success_evaluation is not None:
+            call_status = "completed" if success_evaluation else "failed"
+        else:
+            call_status = "completed"
+    elif ended_reason:
+        call_status = ended_reason
+    
+    return call_status
+
+def add_call_duration(analysis_data):
+    """Calculate call duration and display timestamps if we have both timestamps"""
+    if analysis_data["started_at"] and analysis_data["ended_at"]:
+        try:
+            # Handle datetime objects directly
+            start_time = analysis_data["started_at"]
+            end_time = analysis_data["ended_at"]
+            
+            # Calculate duration in seconds
+            duration_seconds = (end_time - start_time).total_seconds()
+            
+            # Format as minutes and seconds
+            minutes = int(duration_seconds // 60)
+            seconds = int(duration_seconds % 60)
+            analysis_data["duration"] = f"{minutes}m {seconds}s"
+            
+            # Format timestamps for display
+            analysis_data["started_at_formatted"] = start_time.strftime("%Y-%m-%d %H:%M:%S UTC")
+            analysis_data["ended_at_formatted"] = end_time.strftime("%Y-%m-%d %H:%M:%S UTC")
+        except Exception as e:
+            print(f"Error calculating duration: {e}")
+            # Provide a fallback
+            analysis_data["duration"] = "Unknown"
+
+def empty_call_results(call_id, status="scheduled"):
+    """Results payload for a call that has no analysis data yet"""
+    return {
+        "id": call_id,
+        "status": status,
+        "summary": None,
+        "structured_data": {},
+        "ended_reason": None,
+        "success_evaluation": None,
+        "started_at": None,
+        "ended_at": None,
+        "duration": None,  # Will calculate if both timestamps exist
+        "transcript": None,
+        "recording_url": None,
+        "cost": None
+    }
+
+def find_call_record(call_id):
+    """Return the stored record for a call, or None"""
+    call_record = call_records.get(call_id)
+    if call_record is None and not call_record_loader.done:
+        # Older records are still loading; a primary-key read is cheap enough
+        # to do inline, and keeps updates from replacing a record not yet loaded
+        call_record = get_call_store().load(call_id)
+        if call_record is not None:
+            call_record_loader.adopt(call_record)
+    return call_record
+
+def move_transcript_out(call_id, results, previous=None):
+    """Store results["transcript"] out of line and leave its line count behind.
+    
+    Blocking; returns True if a transcript was moved.
+    """
+    transcript = results.get("transcript")
+    if not transcript:
+        # Keep pointing at a transcript stored by an earlier update
+        if previous and previous.get("transcript_lines"):
+            results["transcript_lines"] = previous["transcript_lines"]
+        return False
+    CALL_STORE_WRITE_BYTES.observe(len(transcript), "transcript")
+    with CALL_STORE_WRITE_SECONDS.time("transcript"):
+        results["transcript_lines"] = get_call_store().save_transcript(call_id, transcript)
+    results["transcript"] = None
+    return True
+
+def flatten_structured_data(data, prefix=""):
+    """Flatten structured data into "key words: value" lines for the search index"""
+    lines = []
+    if isinstance(data, dict):
+        for key, value in data.items():
+            lines.extend(flatten_structured_data(value, f"{prefix}{key}."))
+    elif isinstance(data, list):
+        for value in data:
+            lines.extend(flatten_structured_data(value, prefix))
+    elif data is not None:
+        key = prefix.rstrip(".")
+        lines.append(f"{key} {key.replace('_', ' ').replace('.', ' ')}: {data}")
+    return lines
+
+def call_carrier(call_record):
+    """Insurance carrier a call was placed to, for search and reporting"""
+    patient_data = call_record.get("patient_data") or {}
+    if patient_data.get("insurance_carrier"):
+        return patient_data["insurance_carrier"]
+    if call_record.get("assistant_type") == "emblem_health":
+        return "Emblem Health"
+    return None
+
+# Private-use characters that mark matches in FTS5 snippets until the text is escaped
+SNIPPET_MARK_OPEN = "\ue000"
+SNIPPET_MARK_CLOSE = "\ue001"
+
+def highlight_snippet(snippet):
+    """Escape call text from an FTS5 snippet and wrap its matches in <mark>"""
+    return html.escape(snippet).replace(SNIPPET_MARK_OPEN, "<mark>").replace(SNIPPET_MARK_CLOSE, "</mark>")
+
+def index_call_record(call_record, transcript=None):
+    """Update the search index for a record (blocking)"""
+    results = call_record.get("results") or {}
+    if not (transcript or results.get("summary") or results.get("structured_data")):
+        return
+    get_call_store().index_call(
+        call_record["id"],
+        call_carrier(call_record) or "",
+        results.get("summary") or "",
+        "\n".join(flatten_structured_data(results.get("structured_data"))),
+        transcript,
+    )
+
+def call_duration_seconds(results):
+    """Call length in seconds, or None when either timestamp is missing"""
+    started_at = parse_webhook_timestamp(results.get("started_at"))
+    ended_at = parse_webhook_timestamp(results.get("ended_at"))
+    if not (started_at and ended_at):
+        return None
+    try:
+        return max((ended_at - started_at).total_seconds(), 0.0)
+    except TypeError:
+        # One naive and one aware timestamp
+        return None
+
+class CallAnalytics:
+    """Rollups of terminal calls, maintained one record update at a time.
+    
+    Every ended call adds to an overall bucket and to one bucket per
+    dimension (creation day, assistant type, carrier, ended reason). A
+    bucket keeps counts, totals and fixed-size log histograms of cost and
+    duration, so percentiles are read without touching the call records.
+    """
+    
+    DIMENSIONS = ("day", "assistant_type", "carrier", "ended_reason")
+    # Histogram bucket i covers values up to min_value * RATIO ** i
+    HISTOGRAM_RATIO = 2 ** 0.25
+    HISTOGRAMS = {"cost": (0.001, 96), "duration": (1.0, 64)}
+    
+    def __init__(self):
+        self.buckets = {}
+        self.version = 0
+        self.summaries = {}
+        # False while the rollups are being rebuilt from the call records
+        self.complete = True
+    
+    def contribution(self, call_record, results):
+        """What one record adds to the rollups, or None while the call is active"""
+        if not results or results.get("status") in CallReconciler.ACTIVE_STATUSES:
+            return None
+        keys = [("all", "all")]
+        keys.append(("day", (call_record.get("timestamp") or "")[:10] or "unknown"))
+        keys.append(("assistant_type", call_record.get("assistant_type") or "unknown"))
+        keys.append(("carrier", call_carrier(call_record) or "unknown"))
+        keys.append(("ended_reason", results.get("ended_reason") or "unknown"))
+        cost = results.get("cost")
+        return {
+            "keys": keys,
+            "success": results.get("status") == "completed",
+            "cost": float(cost) if cost is not None else None,
+            "duration": call_duration_seconds(results),
+        }
+    
+    def empty_bucket(self):
+        bucket = {"calls": 0, "successes": 0}
+        for name, (_, size) in self.HISTOGRAMS.items():
+            bucket[f"{name}_calls"] = 0
+            bucket[f"{name}_total"] = 0.0
+            bucket[f"{name}_hist"] = [0] * size
+        return bucket
+    
+    def histogram_index(self, name, value):
+        min_value, size = self.HISTOGRAMS[name]
+        if value <= min_value:
+            return 0
+        index = int(math.ceil(math.log(value / min_value, self.HISTOGRAM_RATIO)))
+        return min(index, size - 1)
+    
+    def add_increments(self, contribution, sign, increments):
+        """Add a contribution's field deltas to {(dimension, key): {field: delta}}.
+        
+        Histogram cells are fields of their own ("cost_hist.17"), so any
+        store can apply the deltas with plain additions.
+        """
+        for key in contribution["keys"]:
+            fields = increments.setdefault(key, {})
+            fields["calls"] = fields.get("calls", 0) + sign
+            if contribution["success"]:
+                fields["successes"] = fields.get("successes", 0) + sign
+            for name in self.HISTOGRAMS:
+                value = contribution[name]
+                if value is None:
+                    continue
+                cell = f"{name}_hist.{self.histogram_index(name, value)}"
+                for field, delta in ((f"{name}_calls", sign), (f"{name}_total", sign * value), (cell, sign)):
+                    fields[field] = fields.get(field, 0) + delta
+        return increments
+    
+    def apply_increments(self, increments):
+        """Add field deltas to the in-memory buckets, dropping buckets left with no calls"""
+        for key, fields in increments.items():
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = self.empty_bucket()
+            for field, delta in fields.items():
+                name, _, index = field.partition(".")
+                if index:
+                    bucket[name][int(index)] += delta
+                else:
+                    bucket[field] += delta
+            if bucket["calls"] <= 0:
+                del self.buckets[key]
+    
+    def apply(self, contribution, sign):
+        """Add (sign=1) or remove (sign=-1) a contribution; returns the keys touched"""
+        self.apply_increments(self.add_increments(contribution, sign, {}))
+        return contribution["keys"]
+    
+    def update(self, call_record, previous, results):
+        """Move a record's contribution from its previous results to its new ones.
+        
+        Returns the field deltas applied, so the saved rollups can be moved
+        by the same amounts.
+        """
+        old = self.contribution(call_record, previous)
+        new = self.contribution(call_record, results)
+        if old == new:
+            return {}
+        increments = {}
+        if old:
+            self.add_increments(old, -1, increments)
+        if new:
+            self.add_increments(new, 1, increments)
+        self.apply_increments(increments)
+        self.version += 1
+        return increments
+    
+    def rebuild(self, records):
+        """Recompute every rollup from scratch"""
+        self.buckets = {}
+        for call_record in records:
+            contribution = self.contribution(call_record, call_record.get("results"))
+            if contribution:
+                self.apply(contribution, 1)
+        self.version += 1
+    
+    def flatten(self, bucket):
+        """A bucket as {field: value}, leaving out zero fields"""
+        fields = {}
+        for field, value in bucket.items():
+            if isinstance(value, list):
+                fields.update((f"{field}.{index}", count) for index, count in enumerate(value) if count)
+            elif value:
+                fields[field] = value
+        return fields
+    
+    def unflatten(self, fields):
+        bucket = self.empty_bucket()
+        for field, value in fields.items():
+            name, _, index = field.partition(".")
+            if not field.endswith("_total"):
+                value = int(round(value))
+            if index:
+                bucket[name][int(index)] = value
+            else:
+                bucket[field] = value
+        return bucket
+    
+    def load(self, rows):
+        """Restore rollups saved by export(); returns False for rows in the old nested format"""
+        buckets = {}
+        for dimension, key, data in rows:
+            fields = json.loads(data)
+            if any(isinstance(value, list) for value in fields.values()):
+                return False
+            buckets[(dimension, key)] = self.unflatten(fields)
+        self.buckets = buckets
+        self.version += 1
+        return True
+    
+    def export(self):
+        """(dimension, key, data) rows for every bucket"""
+        return [(key[0], key[1], json.dumps(self.flatten(bucket))) for key, bucket in self.buckets.items()]
+    
+    def percentile(self, name, bucket, fraction):
+        """Upper bound of the histogram bucket holding the given percentile"""
+        count = bucket[f"{name}_calls"]
+        if not count:
+            return None
+        min_value, _ = self.HISTOGRAMS[name]
+        target = fraction * count
+        seen = 0
+        for index, bucket_count in enumerate(bucket[f"{name}_hist"]):
+            seen += bucket_count
+            if seen >= target:
+                return round(min_value * self.HISTOGRAM_RATIO ** index, 4)
+        return None
+    
+    def summarize(self, bucket):
+        calls = bucket["calls"]
+        duration_calls = bucket["duration_calls"]
+        return {
+            "calls": calls,
+            "successes": bucket["successes"],
+            "success_rate": round(bucket["successes"] / calls, 4) if calls else None,
+            "cost_total": round(bucket["cost_total"], 4),
+            "cost_p50": self.percentile("cost", bucket, 0.5),
+            "cost_p95": self.percentile("cost", bucket, 0.95),
+            "duration_total": round(bucket["duration_total"], 1),
+            "duration_avg": round(bucket["duration_total"] / duration_calls, 1) if duration_calls else None,
+            "duration_p50": self.percentile("duration", bucket, 0.5),
+            "duration_p95": self.percentile("duration", bucket, 0.95),
+        }
+    
+    def report(self, dimension=None):
+        """Summaries for the overall bucket and each requested dimension.
+        
+        Summaries are cached per dimension until the next update.
+        """
+        dimensions = [dimension] if dimension else list(self.DIMENSIONS)
+        report = {"complete": self.complete, "overall": self.summarize(self.buckets.get(("all", "all")) or self.empty_bucket())}
+        for name in dimensions:
+            cached = self.summaries.get(name)
+            if cached is None or cached[0] != self.version:
+                groups = {key: self.summarize(bucket) for (dim, key), bucket in sorted(self.buckets.items()) if dim == name}
+                cached = self.summaries[name] = (self.version, groups)
+            report[name] = cached[1]
+        return report
+
+call_analytics = CallAnalytics()
+
+async def persist_call_analytics(increments):
+    """Add rollup deltas to the saved rollups without blocking the event loop.
+    
+    Deltas rather than whole buckets are saved, so processes sharing the
+    call store never overwrite each other's counts.
+    """
+    if not increments:
+        return
+    try:
+        with CALL_STORE_WRITE_SECONDS.time("rollups"):
+            await asyncio.to_thread(get_call_store().add_to_rollups, increments)
+    except Exception as e:
+        print(f"Error saving call analytics: {e}")
+
+def iter_all_call_records():
+    """Every loaded record, then every archived record not also loaded (blocking)"""
+    yield from call_records
+    for call_record in call_archive.iter_records():
+        if call_record["id"] not in call_records:
+            yield call_record
+
+def rebuild_call_analytics():
+    """Recompute the rollups from the loaded and archived call records and replace the saved ones (blocking)"""
+    call_analytics.rebuild(iter_all_call_records())
+    get_call_store().replace_rollups(call_analytics.export())
+
+# Updates of a call in progress, keyed by call id: [lock, holders and waiters]
+call_update_locks = {}
+
+@contextlib.asynccontextmanager
+async def call_update_lock(call_id):
+    """Apply updates of one call one at a time.
+    
+    Hold it across reading a record's results and storing new ones, so an
+    update that awaits in between can't overwrite a concurrent one.
+    """
+    entry = call_update_locks.get(call_id)
+    if entry is None:
+        entry = call_update_locks[call_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del call_update_locks[call_id]
+
+async def store_call_results(call_id, analysis_data, phone_number=None):
+    """Update (or create) the call record with new results and persist it"""
+    async with call_update_lock(call_id):
+        return await update_call_results(call_id, analysis_data, phone_number)
+
+async def update_call_results(call_id, analysis_data, phone_number=None):
+    """store_call_results for callers already holding call_update_lock(call_id)"""
+    call_record = find_call_record(call_id)
+    transcript = analysis_data.get("transcript")
+    try:
+        await asyncio.to_thread(move_transcript_out, call_id, analysis_data, call_record.get("results") if call_record else None)
+    except Exception as e:
+        print(f"Error storing transcript for call {call_id}: {e}")
+    
+    # Read the record again: while the transcript was written, the change
+    # watcher may have copied in another process's update, and the rollup
+    # delta has to be taken against the results being replaced
+    call_record = find_call_record(call_id)
+    previous = call_record.get("results") if call_record else None
+    if call_record is not None:
+        call_records.set_status(call_record, analysis_data["status"])
+        call_record["results"] = analysis_data
+        call_records.mark_changed()
+    else:
+        # If no record found, create one
+        call_record = {
+            "id": call_id,
+            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "status": analysis_data["status"],
+            "results": analysis_data
+        }
+        if phone_number:
+            call_record["phone_number"] = phone_number
+        call_records.add(call_record)
+    
+    analytics_increments = call_analytics.update(call_record, previous, analysis_data)
+    
+    # Persist the record to the call store
+    change = await persist_call_record(call_record)
+    await persist_call_analytics(analytics_increments)
+    call_events.publish(call_record, change)
+    
+    if analysis_data.get("ended_reason") in call_queue.redial_reasons and not (previous or {}).get("ended_reason"):
+        try:
+            await call_queue.redial(call_record)
+        except Exception as e:
+            print(f"Error queueing a redial of call {call_id}: {e}")
+    
+    try:
+        with CALL_STORE_WRITE_SECONDS.time("search_index"):
+            await asyncio.to_thread(index_call_record, call_record, transcript)
+    except Exception as e:
+        print(f"Error indexing call {call_id}: {e}")
+    
+    return call_record
+
+async def apply_vapi_call(call):
+    """Convert a Vapi call object to results and store them on the call record"""
+    call_id = call.id
+    success_evaluation = None
+    if hasattr(call, 'analysis') and hasattr(call.analysis, 'success_evaluation'):
+        success_evaluation = parse_success_evaluation(call.analysis.success_evaluation)
+    
+    ended_reason = call.ended_reason if hasattr(call, 'ended_reason') else None
+    started_at = call.started_at if hasattr(call, 'started_at') else None
+    call_status = derive_call_status(started_at, ended_reason, success_evaluation)
+    
+    # Get analysis data with proper null checks
+    analysis_data = empty_call_results(call_id, call_status)
+    analysis_data.update({
+        "ended_reason": ended_reason,
+        "success_evaluation": success_evaluation,
+        "started_at": started_at,
+        "ended_at": call.ended_at if hasattr(call, 'ended_at') else None,
+        "transcript": call.transcript if hasattr(call, 'transcript') else None,
+        "recording_url": call.recordingUrl if hasattr(call, 'recordingUrl') else None,
+        "cost": call.cost if hasattr(call, 'cost') else None
+    })
+    
+    # Extract analysis data carefully
+    if hasattr(call, 'analysis'):
+        if hasattr(call.analysis, 'summary'):
+            analysis_data["summary"] = call.analysis.summary
+            
+        if hasattr(call.analysis, 'structured_data'):
+            analysis_data["structured_data"] = call.analysis.structured_data
+    
+    add_call_duration(analysis_data)
+    
+    # Get phone number if available
+    phone_number = None
+    if hasattr(call, 'customer') and hasattr(call.customer, 'number'):
+        phone_number = call.customer.number
+    
+    await store_call_results(call_id, analysis_data, phone_number)
+    
+    return analysis_data
+
+async def get_call_results(call_id):
+    try:
+        with time_vapi_request("get"):
+            call = await get_vapi_client().calls.get(id=call_id, request_options=VAPI_REQUEST_OPTIONS)
+        return await apply_vapi_call(call)
+    except Exception as error:
+        print(f"Error retrieving call results: {error}")
+        raise error
+
+class CallResultCache:
+    """LRU cache of get_call_results output with single-flight fetches.
+    
+    Results of calls that have an ended_reason never change and are kept
+    until evicted; other results expire after ttl seconds. Entries are
+    evicted least recently used first once either max_entries or
+    max_bytes (measured on the JSON encoding) is exceeded. Concurrent
+    misses for the same call id share one upstream fetch.
+    """
+    
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024, ttl=5.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.in_flight = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+    
+    def lookup(self, call_id):
+        """Return cached results that are still fresh, or None"""
+        entry = self.entries.get(call_id)
+        if entry is None:
+            return None
+        results, expires_at, _ = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.discard(call_id)
+            return None
+        self.entries.move_to_end(call_id)
+        return results
+    
+    def put(self, call_id, results):
+        self.discard(call_id)
+        size = len(json.dumps(results, default=str))
+        expires_at = None if results.get("ended_reason") else time.monotonic() + self.ttl
+        self.entries[call_id] = (results, expires_at, size)
+        self.total_bytes += size
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            oldest = next(iter(self.entries))
+            self.discard(oldest)
+            self.evictions += 1
+    
+    def discard(self, call_id):
+        entry = self.entries.pop(call_id, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+    
+    async def get(self, call_id, fetch):
+        """Return cached results or await fetch(call_id), sharing in-flight fetches"""
+        results = self.lookup(call_id)
+        if results is not None:
+            self.hits += 1
+            return results
+        
+        task = self.in_flight.get(call_id)
+        if task is None:
+            self.misses += 1
+            # The fetch runs as its own task so a disconnecting client does
+            # not cancel it for the other requests waiting on the same call
+            task = asyncio.ensure_future(self.fetch_and_store(call_id, fetch))
+            task.add_done_callback(lambda done: self.fetch_done(call_id, done))
+            self.in_flight[call_id] = task
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+    
+    async def fetch_and_store(self, call_id, fetch):
+        results = await fetch(call_id)
+        self.put(call_id, results)
+        return results
+    
+    def fetch_done(self, call_id, task):
+        """Forget a finished fetch and retrieve its error, in case every waiter has gone"""
+        if self.in_flight.get(call_id) is task:
+            del self.in_flight[call_id]
+        if not task.cancelled():
+            task.exception()
+    
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else None,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "in_flight": len(self.in_flight),
+        }
+
+call_result_cache = CallResultCache(
+    max_entries=int(os.getenv("CALL_CACHE_MAX_ENTRIES", "1000")),
+    max_bytes=int(os.getenv("CALL_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl=float(os.getenv("CALL_CACHE_TTL", "5")),
+)
+
+def local_state_is_current():
+    """True when webhooks or the reconciler keep stored records up to date"""
+    return bool(VAPI_WEBHOOK_SECRET) or call_reconciler.running
+
+async def get_call_data(call_id):
+    """Return the latest known results for a call.
+    
+    When the Vapi webhook or the background reconciler keeps stored records
+    current, known calls are served from local state and only unknown ids
+    go upstream. Archived calls have ended, so they never go upstream.
+    """
+    call_record = find_call_record(call_id)
+    if call_record is None:
+        archived = await find_archived_call(call_id)
+        if archived is not None:
+            return {**archived["results"], "archived": True}
+    elif local_state_is_current():
+        return call_record.get("results") or empty_call_results(call_id, call_record.get("status", "scheduled"))
+    try:
+        return await call_result_cache.get(call_id, get_call_results)
+    except Exception:
+        # Vapi is failing or the circuit is open: serve the last known state
+        call_record = find_call_record(call_id)
+        if call_record is None:
+            raise
+        results = call_record.get("results") or empty_call_results(call_id, call_record.get("status", "scheduled"))
+        return {**results, "stale": True}
+
+def parse_webhook_timestamp(value):
+    """Parse an ISO-8601 timestamp from a Vapi server message"""
+    if not value:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value
+    try:
+        return datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+def verify_webhook_signature(body, headers):
+    """Check a Vapi server message against VAPI_WEBHOOK_SECRET.
+    
+    Accepts either an HMAC-SHA256 hex digest of the raw body in
+    X-Vapi-Signature or the shared secret itself in X-Vapi-Secret.
+    """
+    if not VAPI_WEBHOOK_SECRET:
+        return False
+    signature = headers.get("x-vapi-signature")
+    if signature:
+        if signature.startswith("sha256="):
+            signature = signature[len("sha256="):]
+        expected = hmac.new(VAPI_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature, expected)
+    secret = headers.get("x-vapi-secret")
+    if secret:
+        return hmac.compare_digest(secret, VAPI_WEBHOOK_SECRET)
+    return False
+
+# Vapi lifecycle statuses mapped onto the statuses used by call records
+WEBHOOK_STATUS_MAP = {
+    "scheduled": "scheduled",
+    "queued": "scheduled",
+    "ringing": "scheduled",
+    "in-progress": "in_progress",
+    "forwarding": "in_progress",
+}
+
+async def apply_webhook_message(message):
+    """Apply a status-update or end-of-call-report message to the stored record"""
+    call = message.get("call") or {}
+    call_id = call.get("id")
+    if not call_id:
+        return None
+    
+    async with call_update_lock(call_id):
+        return await apply_webhook_update(message, call, call_id)
+
+async def apply_webhook_update(message, call, call_id):
+    """apply_webhook_message for a caller holding call_update_lock(call_id)"""
+    message_type = message.get("type")
+    call_record = find_call_record(call_id)
+    results = dict(call_record["results"]) if call_record and call_record.get("results") else empty_call_results(call_id, call_record["status"] if call_record else "scheduled")
+    phone_number = (call.get("customer") or {}).get("number")
+    
+    if message_type == "status-update":
+        started_at = parse_webhook_timestamp(call.get("startedAt"))
+        if started_at and not results["started_at"]:
+            results["started_at"] = started_at
+        status = WEBHOOK_STATUS_MAP.get(message.get("status"))
+        ended_reason = message.get("endedReason")
+        if ended_reason:
+            results["ended_reason"] = ended_reason
+            results["status"] = derive_call_status(results["started_at"], ended_reason, results["success_evaluation"])
+        elif status and not results["ended_reason"]:
+            # A status-update delivered after the call ended must not reopen it
+            results["status"] = status
+    elif message_type == "end-of-call-report":
+        analysis = message.get("analysis") or {}
+        artifact = message.get("artifact") or {}
+        results["ended_reason"] = message.get("endedReason") or results["ended_reason"]
+        results["summary"] = analysis.get("summary", results["summary"])
+        results["structured_data"] = analysis.get("structuredData") or results["structured_data"]
+        if "successEvaluation" in analysis:
+            results["success_evaluation"] = parse_success_evaluation(analysis["successEvaluation"])
+        results["transcript"] = message.get("transcript") or artifact.get("transcript") or results["transcript"]
+        results["recording_url"] = message.get("recordingUrl") or artifact.get("recordingUrl") or results["recording_url"]
+        if message.get("cost") is not None:
+            results["cost"] = message["cost"]
+        # Stored timestamps come back from the JSON backup as strings
+        results["started_at"] = parse_webhook_timestamp(message.get("startedAt") or call.get("startedAt") or results["started_at"])
+        results["ended_at"] = parse_webhook_timestamp(message.get("endedAt") or call.get("endedAt") or results["ended_at"])
+        results["status"] = derive_call_status(results["started_at"], results["ended_reason"], results["success_evaluation"])
+        add_call_duration(results)
+    else:
+        return None
+    
+    await update_call_results(call_id, results, phone_number)
+    call_result_cache.put(call_id, results)
+    return results
+
+# Tags this process's writes in the shared change log
+PROCESS_ID = uuid.uuid4().hex
+
+class CallStore:
+    """Durable call record store backed by SQLite in WAL mode.
+    
+    Each status change is a single-row upsert, so writes cost O(1) however
+    much history exists, and SQLite's journal keeps the file consistent if
+    the process dies mid-write. Several processes can share one file:
+    SQLite's file locks serialise their writes, and every record save also
+    appends to a change log that the other processes follow.
+    """
+    
+    # The search index lives in the same file, so every process sees every update
+    shared_index = True
+    # Change log rows kept for processes catching up
+    change_log_size = 10000
+    
+    def __init__(self, path, origin=None):
+        self.path = path
+        self.origin = origin or PROCESS_ID
+        self.lock = threading.Lock()
+        self.seen_data_version = None
+        # Wait for other processes' write locks rather than failing with "database is locked"
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS calls ("
+            "id TEXT PRIMARY KEY, timestamp TEXT NOT NULL, data TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS calls_timestamp ON calls (timestamp)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS calls_order ON calls (timestamp, id)")
+        # Transcripts live out of line, zlib-compressed, and are only read on demand
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS transcripts ("
+            "call_id TEXT PRIMARY KEY, lines INTEGER NOT NULL, data BLOB NOT NULL)"
+        )
+        # Full-text index over summaries, transcripts and structured data;
+        # search_docs gives each call a stable rowid in the FTS table
+        self.conn.execute("CREATE TABLE IF NOT EXISTS search_docs (rowid INTEGER PRIMARY KEY, call_id TEXT UNIQUE NOT NULL)")
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS call_search USING fts5("
+            "carrier, summary, transcript, structured, tokenize='porter unicode61')"
+        )
+        # Analytics rollups, one row per (dimension, key) bucket
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS call_rollups ("
+            "dimension TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (dimension, key))"
+        )
+        # Record saves in commit order, tagged with the saving process
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS call_changes ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, call_id TEXT NOT NULL, origin TEXT NOT NULL)"
+        )
+        # Named leases for work only one process should do, like reconciliation
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        # Call ids of recent creates, by idempotency key or content hash;
+        # call_id stays NULL while the first request is still dialling
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+            "identity TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, call_id TEXT, expires_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idempotency_keys_expiry ON idempotency_keys (expires_at)")
+        # Calls held until their carrier's line opens; data is the whole entry as JSON
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS call_queue ("
+            "id TEXT PRIMARY KEY, carrier TEXT NOT NULL, priority INTEGER NOT NULL, not_before REAL NOT NULL, "
+            "status TEXT NOT NULL, enqueued_at REAL NOT NULL, data TEXT NOT NULL, claimed_at REAL)"
+        )
+        # Queues created before claims were timed lack claimed_at
+        if "claimed_at" not in [row[1] for row in self.conn.execute("PRAGMA table_info(call_queue)")]:
+            self.conn.execute("ALTER TABLE call_queue ADD COLUMN claimed_at REAL")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS call_queue_due ON call_queue (status, priority, not_before)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS call_queue_carrier ON call_queue (carrier, status, not_before)")
+        self.idempotency_claims = 0
+        self.conn.commit()
+    
+    def load_all(self):
+        """Return every stored record, oldest first"""
+        with self.lock:
+            rows = self.conn.execute("SELECT data FROM calls ORDER BY timestamp, id").fetchall()
+        return [json.loads(data) for (data,) in rows]
+    
+    def load_page(self, before, limit):
+        """Return up to limit records older than the (timestamp, id) key before, newest first"""
+        with self.lock:
+            if before is None:
+                rows = self.conn.execute(
+                    "SELECT data FROM calls ORDER BY timestamp DESC, id DESC LIMIT ?", (limit,)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT data FROM calls WHERE (timestamp, id) < (?, ?) "
+                    "ORDER BY timestamp DESC, id DESC LIMIT ?",
+                    (before[0], before[1], limit),
+                ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+    
+    def load(self, call_id):
+        """Return one stored record, or None"""
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM calls WHERE id = ?", (call_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def load_range(self, after, before_timestamp, limit):
+        """Return up to limit records newer than the (timestamp, id) key after and older than before_timestamp, oldest first"""
+        with self.lock:
+            if after is None:
+                rows = self.conn.execute(
+                    "SELECT data FROM calls WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?", (before_timestamp, limit)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT data FROM calls WHERE (timestamp, id) > (?, ?) AND timestamp < ? ORDER BY timestamp, id LIMIT ?",
+                    (after[0], after[1], before_timestamp, limit),
+                ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+    
+    def nth_newest_timestamp(self, n):
+        """Timestamp of the nth newest record, or None if there are fewer than n"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT timestamp FROM calls ORDER BY timestamp DESC, id DESC LIMIT 1 OFFSET ?", (n - 1,)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def delete_calls(self, records):
+        """Delete records and their transcripts, logging each removal for the other processes"""
+        call_ids = [record["id"] for record in records]
+        with self.lock, self.conn:
+            for start in range(0, len(call_ids), 500):
+                batch = call_ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                self.conn.execute(f"DELETE FROM calls WHERE id IN ({placeholders})", batch)
+                self.conn.execute(f"DELETE FROM transcripts WHERE call_id IN ({placeholders})", batch)
+            self.conn.executemany(
+                "INSERT INTO call_changes (call_id, origin) VALUES (?, ?)", [(call_id, self.origin) for call_id in call_ids]
+            )
+    
+    def save(self, call_id, timestamp, data):
+        """Insert or replace one serialised record and log the change; returns its position in the log"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO calls (id, timestamp, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET timestamp = excluded.timestamp, data = excluded.data",
+                (call_id, timestamp, data),
+            )
+            seq = self.conn.execute(
+                "INSERT INTO call_changes (call_id, origin) VALUES (?, ?)", (call_id, self.origin)
+            ).lastrowid
+            if seq % 1000 == 0:
+                self.conn.execute("DELETE FROM call_changes WHERE seq <= ?", (seq - self.change_log_size,))
+        return seq
+    
+    def latest_change(self):
+        """Position of the newest logged change, to follow changes from"""
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM call_changes").fetchone()[0]
+    
+    def changes_since(self, cursor, limit=1000):
+        """Return (new cursor, [(position, call_id, origin, record)]) for changes after cursor.
+        
+        Repeated calls are cheap: PRAGMA data_version only moves when another
+        connection commits, so the log is not read until something changed.
+        """
+        with self.lock:
+            data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self.seen_data_version:
+                return cursor, []
+            rows = self.conn.execute(
+                "SELECT c.seq, c.call_id, c.origin, calls.data FROM call_changes c "
+                "LEFT JOIN calls ON calls.id = c.call_id WHERE c.seq > ? ORDER BY c.seq LIMIT ?",
+                (cursor, limit),
+            ).fetchall()
+        if len(rows) < limit:
+            self.seen_data_version = data_version
+        if rows:
+            cursor = rows[-1][0]
+        return cursor, [(seq, call_id, origin, json.loads(data) if data else None) for seq, call_id, origin, data in rows]
+    
+    def acquire_lease(self, name, owner, ttl):
+        """Take or renew a named lease for ttl seconds; False while another owner holds it"""
+        now = time.time()
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                (name, owner, now + ttl, now),
+            ).rowcount == 1
+    
+    def release_lease(self, name, owner):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+    
+    def claim_idempotency(self, identity, fingerprint, ttl, max_entries):
+        """Claim an identity for ttl seconds.
+        
+        Returns None when the claim is ours, otherwise the (fingerprint,
+        call_id) of the unexpired entry that holds it. Every 100th claim
+        drops expired entries and the oldest completed ones beyond
+        max_entries.
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            claimed = self.conn.execute(
+                "INSERT INTO idempotency_keys (identity, fingerprint, call_id, expires_at) VALUES (?, ?, NULL, ?) "
+                "ON CONFLICT(identity) DO UPDATE SET fingerprint = excluded.fingerprint, call_id = NULL, expires_at = excluded.expires_at "
+                "WHERE idempotency_keys.expires_at < ?",
+                (identity, fingerprint, now + ttl, now),
+            ).rowcount == 1
+            if not claimed:
+                return self.conn.execute(
+                    "SELECT fingerprint, call_id FROM idempotency_keys WHERE identity = ?", (identity,)
+                ).fetchone()
+            self.idempotency_claims += 1
+            if self.idempotency_claims % 100 == 0:
+                self.conn.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+                (count,) = self.conn.execute("SELECT COUNT(*) FROM idempotency_keys").fetchone()
+                if count > max_entries:
+                    self.conn.execute(
+                        "DELETE FROM idempotency_keys WHERE identity IN ("
+                        "SELECT identity FROM idempotency_keys WHERE call_id IS NOT NULL ORDER BY expires_at LIMIT ?)",
+                        (count - max_entries,),
+                    )
+            return None
+    
+    def complete_idempotency(self, identity, fingerprint, call_id, ttl):
+        """Record the call id placed for a claimed identity and keep it for ttl seconds"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE idempotency_keys SET call_id = ?, expires_at = ? WHERE identity = ?",
+                (call_id, time.time() + ttl, identity),
+            )
+    
+    def release_idempotency(self, identity):
+        """Drop an identity whose create failed, so the next request dials"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM idempotency_keys WHERE identity = ? AND call_id IS NULL", (identity,))
+    
+    def lookup_idempotency(self, identity):
+        """Return the (fingerprint, call_id) of an unexpired identity, or None"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT fingerprint, call_id FROM idempotency_keys WHERE identity = ? AND expires_at >= ?",
+                (identity, time.time()),
+            ).fetchone()
+    
+    def enqueue_call(self, entry):
+        """Add a call queue entry; False if one with its id already exists"""
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "INSERT OR IGNORE INTO call_queue (id, carrier, priority, not_before, status, enqueued_at, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (entry["id"], entry["carrier"], entry["priority"], entry["not_before"], entry["status"], entry["enqueued_at"], json.dumps(entry)),
+            ).rowcount == 1
+    
+    def update_queued_call(self, entry):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE call_queue SET priority = ?, not_before = ?, status = ?, data = ? WHERE id = ?",
+                (entry["priority"], entry["not_before"], entry["status"], json.dumps(entry), entry["id"]),
+            )
+    
+    def load_queued_call(self, entry_id):
+        with self.lock:
+            row = self.conn.execute("SELECT status, data FROM call_queue WHERE id = ?", (entry_id,)).fetchone()
+        return dict(json.loads(row[1]), status=row[0]) if row else None
+    
+    def claim_due_calls(self, now, limit):
+        """Mark up to limit queued entries due by now as dialling and return them, most urgent first.
+        
+        A single UPDATE, so each entry is claimed by exactly one process.
+        """
+        with self.lock, self.conn:
+            rows = self.conn.execute(
+                "UPDATE call_queue SET status = 'dialling', claimed_at = ? WHERE id IN ("
+                "SELECT id FROM call_queue WHERE status = 'queued' AND not_before <= ? ORDER BY priority, not_before LIMIT ?) "
+                "RETURNING data",
+                (now, now, limit),
+            ).fetchall()
+        entries = [dict(json.loads(data), status="dialling", claimed_at=now) for (data,) in rows]
+        entries.sort(key=lambda entry: (entry["priority"], entry["not_before"]))
+        return entries
+    
+    def last_queued_slot(self, carrier, start, end):
+        """Latest not_before of a queued entry for carrier in [start, end), or None"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT MAX(not_before) FROM call_queue WHERE carrier = ? AND status = 'queued' AND not_before >= ? AND not_before < ?",
+                (carrier, start, end),
+            ).fetchone()[0]
+    
+    def queue_depth(self):
+        """Queued entries per carrier"""
+        with self.lock:
+            return dict(self.conn.execute("SELECT carrier, COUNT(*) FROM call_queue WHERE status = 'queued' GROUP BY carrier").fetchall())
+    
+    def requeue_stale_calls(self, claimed_before):
+        """Queue again entries claimed before the given time and never updated; returns how many"""
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "UPDATE call_queue SET status = 'queued', claimed_at = NULL "
+                "WHERE status = 'dialling' AND (claimed_at IS NULL OR claimed_at < ?)",
+                (claimed_before,),
+            ).rowcount
+    
+    def prune_call_queue(self, before):
+        """Drop placed and failed entries enqueued before the given time"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM call_queue WHERE status IN ('placed', 'failed') AND enqueued_at < ?", (before,))
+    
+    def save_many(self, records):
+        """Bulk insert records, used when importing the legacy JSON backup"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO calls (id, timestamp, data) VALUES (?, ?, ?)",
+                [(r["id"], r.get("timestamp", ""), json.dumps(r, default=str)) for r in records],
+            )
+    
+    def save_transcript(self, call_id, transcript):
+        """Compress and store a transcript, returning its line count"""
+        lines = len(transcript.splitlines())
+        data = zlib.compress(transcript.encode("utf-8"), 6)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO transcripts (call_id, lines, data) VALUES (?, ?, ?)",
+                (call_id, lines, data),
+            )
+        return lines
+    
+    def load_transcript(self, call_id):
+        """Return the decompressed transcript for a call, or None"""
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM transcripts WHERE call_id = ?", (call_id,)).fetchone()
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+    
+    def load_transcripts(self, call_ids):
+        """Return {call_id: transcript} for the given calls that have one"""
+        call_ids = list(call_ids)
+        transcripts = {}
+        for start in range(0, len(call_ids), 500):
+            batch = call_ids[start:start + 500]
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT call_id, data FROM transcripts WHERE call_id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+            for call_id, data in rows:
+                transcripts[call_id] = zlib.decompress(data).decode("utf-8")
+        return transcripts
+    
+    def index_call(self, call_id, carrier, summary, structured, transcript=None):
+        """Add or update a call in the search index.
+        
+        The transcript column is only rewritten when a transcript is given,
+        so status updates don't need to reload it.
+        """
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO search_docs (call_id) VALUES (?)", (call_id,))
+            (rowid,) = self.conn.execute("SELECT rowid FROM search_docs WHERE call_id = ?", (call_id,)).fetchone()
+            if transcript is None:
+                updated = self.conn.execute(
+                    "UPDATE call_search SET carrier = ?, summary = ?, structured = ? WHERE rowid = ?",
+                    (carrier, summary, structured, rowid),
+                ).rowcount
+                if updated:
+                    return
+            self.conn.execute(
+                "INSERT OR REPLACE INTO call_search (rowid, carrier, summary, transcript, structured) VALUES (?, ?, ?, ?, ?)",
+                (rowid, carrier, summary, transcript or "", structured),
+            )
+    
+    def search(self, query, limit, candidates=500):
+        """Return (rows, truncated) for an FTS5 query.
+        
+        rows are (call_id, rank, snippet), best first, with the snippet
+        HTML-escaped and its matches wrapped in <mark>. Only the newest
+        `candidates` matches are ranked: FTS5 walks matches in rowid order
+        cheaply, and bounding the rowid range keeps bm25 from scoring every
+        call for terms that appear in most of them. truncated is True when
+        older matches were left out.
+        """
+        with self.lock:
+            boundary = self.conn.execute(
+                "SELECT rowid FROM call_search WHERE call_search MATCH ? "
+                "ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                (query, candidates),
+            ).fetchone()
+            rows = self.conn.execute(
+                "SELECT d.call_id, bm25(call_search, 1.0, 5.0, 1.0, 3.0) AS rank, "
+                "snippet(call_search, -1, ?, ?, '...', 16) "
+                "FROM call_search JOIN search_docs d ON d.rowid = call_search.rowid "
+                "WHERE call_search MATCH ? AND call_search.rowid > ? "
+                "ORDER BY rank LIMIT ?",
+                (SNIPPET_MARK_OPEN, SNIPPET_MARK_CLOSE, query, boundary[0] if boundary else -1, limit),
+            ).fetchall()
+        return [(call_id, rank, highlight_snippet(snippet)) for call_id, rank, snippet in rows], boundary is not None
+    
+    def load_rollups(self):
+        with self.lock:
+            return self.conn.execute("SELECT dimension, key, data FROM call_rollups").fetchall()
+    
+    def add_to_rollups(self, increments):
+        """Add {(dimension, key): {field: delta}} to the saved buckets in one transaction.
+        
+        BEGIN IMMEDIATE takes the write lock before the buckets are read, so
+        concurrent processes can't lose each other's updates. Buckets left
+        with no calls are deleted.
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for (dimension, key), fields in increments.items():
+                    row = self.conn.execute(
+                        "SELECT data FROM call_rollups WHERE dimension = ? AND key = ?", (dimension, key)
+                    ).fetchone()
+                    data = json.loads(row[0]) if row else {}
+                    for field, delta in fields.items():
+                        data[field] = data.get(field, 0) + delta
+                    if data.get("calls", 0) > 0:
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO call_rollups (dimension, key, data) VALUES (?, ?, ?)",
+                            (dimension, key, json.dumps(data)),
+                        )
+                    elif row:
+                        self.conn.execute("DELETE FROM call_rollups WHERE dimension = ? AND key = ?", (dimension, key))
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+    
+    def replace_rollups(self, rows):
+        """Replace every saved rollup in one transaction"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM call_rollups")
+            self.conn.executemany("INSERT INTO call_rollups (dimension, key, data) VALUES (?, ?, ?)", rows)
+    
+    def search_is_empty(self):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM search_docs LIMIT 1").fetchone() is None
+    
+    def is_empty(self):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM calls LIMIT 1").fetchone() is None
+
+class RedisCallStore:
+    """Call store kept in Redis, for processes on more than one host.
+    
+    Offers the same methods as CallStore. Records are JSON in one hash,
+    ordered by a sorted set of "timestamp NUL id" members that are paged
+    with ZREVRANGEBYLEX, and every save is added to a capped stream that
+    the other processes follow. Rollup fields are counters bumped with
+    HINCRBYFLOAT. Full-text search stays in a local SQLite index, which
+    each process keeps current from the change stream.
+    """
+    
+    shared_index = False
+    change_log_size = CallStore.change_log_size
+    
+    def __init__(self, redis_client, index, prefix="calls", origin=None):
+        self.redis = redis_client
+        self.index = index
+        self.prefix = prefix
+        self.origin = origin or PROCESS_ID
+        kwargs = redis_client.connection_pool.connection_kwargs
+        self.path = f"redis://{kwargs.get('host', 'localhost')}:{kwargs.get('port', 6379)}/{kwargs.get('db', 0)} ({prefix})"
+    
+    def key(self, name):
+        return f"{self.prefix}:{name}"
+    
+    def order_member(self, call_id, timestamp):
+        return f"{timestamp}\x00{call_id}"
+    
+    def load_records(self, call_ids):
+        if not call_ids:
+            return []
+        return [json.loads(data) for data in self.redis.hmget(self.key("records"), call_ids) if data is not None]
+    
+    def load_all(self):
+        """Return every stored record, oldest first"""
+        records = [json.loads(data) for data in self.redis.hvals(self.key("records"))]
+        records.sort(key=lambda record: (record.get("timestamp", ""), record["id"]))
+        return records
+    
+    def load_page(self, before, limit):
+        """Return up to limit records older than the (timestamp, id) key before, newest first"""
+        high = "+" if before is None else "(" + self.order_member(before[1], before[0])
+        members = self.redis.zrevrangebylex(self.key("order"), high, "-", start=0, num=limit)
+        return self.load_records([member.decode("utf-8").split("\x00", 1)[1] for member in members])
+    
+    def load(self, call_id):
+        data = self.redis.hget(self.key("records"), call_id)
+        return json.loads(data) if data is not None else None
+    
+    def load_range(self, after, before_timestamp, limit):
+        """Return up to limit records newer than the (timestamp, id) key after and older than before_timestamp, oldest first"""
+        low = "-" if after is None else "(" + self.order_member(after[1], after[0])
+        members = self.redis.zrangebylex(self.key("order"), low, "(" + before_timestamp, start=0, num=limit)
+        return self.load_records([member.decode("utf-8").split("\x00", 1)[1] for member in members])
+    
+    def nth_newest_timestamp(self, n):
+        members = self.redis.zrevrange(self.key("order"), n - 1, n - 1)
+        return members[0].decode("utf-8").split("\x00", 1)[0] if members else None
+    
+    def delete_calls(self, records):
+        if not records:
+            return
+        call_ids = [record["id"] for record in records]
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.key("records"), *call_ids)
+        pipe.hdel(self.key("transcripts"), *call_ids)
+        pipe.zrem(self.key("order"), *[self.order_member(record["id"], record.get("timestamp", "")) for record in records])
+        for call_id in call_ids:
+            pipe.xadd(self.key("changes"), {"call_id": call_id, "origin": self.origin}, maxlen=self.change_log_size, approximate=True)
+        pipe.execute()
+    
+    def save(self, call_id, timestamp, data):
+        """Insert or replace one serialised record and log the change; returns its position in the log"""
+        pipe = self.redis.pipeline()
+        pipe.hset(self.key("records"), call_id, data)
+        pipe.zadd(self.key("order"), {self.order_member(call_id, timestamp): 0})
+        pipe.xadd(self.key("changes"), {"call_id": call_id, "origin": self.origin}, maxlen=self.change_log_size, approximate=True)
+        return pipe.execute()[2].decode("utf-8")
+    
+    def save_many(self, records):
+        pipe = self.redis.pipeline()
+        for record in records:
+            pipe.hset(self.key("records"), record["id"], json.dumps(record, default=str))
+            pipe.zadd(self.key("order"), {self.order_member(record["id"], record.get("timestamp", "")): 0})
+        pipe.execute()
+    
+    def latest_change(self):
+        entries = self.redis.xrevrange(self.key("changes"), count=1)
+        return entries[0][0].decode("utf-8") if entries else "0-0"
+    
+    def changes_since(self, cursor, limit=1000):
+        """Return (new cursor, [(position, call_id, origin, record)]) for changes after cursor"""
+        entries = self.redis.xrange(self.key("changes"), min="(" + cursor, count=limit)
+        if not entries:
+            return cursor, []
+        changes = [
+            (entry_id.decode("utf-8"), fields[b"call_id"].decode("utf-8"), fields[b"origin"].decode("utf-8"))
+            for entry_id, fields in entries
+        ]
+        remote_ids = list(dict.fromkeys(call_id for _, call_id, origin in changes if origin != self.origin))
+        records = {record["id"]: record for record in self.load_records(remote_ids)}
+        return changes[-1][0], [(position, call_id, origin, records.get(call_id)) for position, call_id, origin in changes]
+    
+    # Leases are renewed and released only by their owner, checked and
+    # changed in one step so a lease that expired and was taken by another
+    # owner in between is left alone
+    RENEW_LEASE = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('PEXPIRE', KEYS[1], ARGV[2]) end return 0"
+    RELEASE_LEASE = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end return 0"
+    
+    def acquire_lease(self, name, owner, ttl):
+        key = self.key(f"lease:{name}")
+        milliseconds = int(ttl * 1000)
+        if self.redis.set(key, owner, nx=True, px=milliseconds):
+            return True
+        return bool(self.redis.eval(self.RENEW_LEASE, 1, key, owner, milliseconds))
+    
+    def release_lease(self, name, owner):
+        self.redis.eval(self.RELEASE_LEASE, 1, self.key(f"lease:{name}"), owner)
+    
+    def claim_idempotency(self, identity, fingerprint, ttl, max_entries):
+        # Entries expire on their own, so max_entries is not needed here
+        key = self.key(f"idempotency:{identity}")
+        milliseconds = int(ttl * 1000)
+        while True:
+            if self.redis.set(key, json.dumps([fingerprint, None]), nx=True, px=milliseconds):
+                return None
+            data = self.redis.get(key)
+            if data is not None:
+                return tuple(json.loads(data))
+    
+    def complete_idempotency(self, identity, fingerprint, call_id, ttl):
+        self.redis.set(self.key(f"idempotency:{identity}"), json.dumps([fingerprint, call_id]), px=int(ttl * 1000))
+    
+    def release_idempotency(self, identity):
+        key = self.key(f"idempotency:{identity}")
+        data = self.redis.get(key)
+        if data is not None and json.loads(data)[1] is None:
+            self.redis.delete(key)
+    
+    def lookup_idempotency(self, identity):
+        data = self.redis.get(self.key(f"idempotency:{identity}"))
+        return tuple(json.loads(data)) if data is not None else None
+    
+    # The call queue is a hash of JSON entries plus sorted sets of queued ids
+    # by not_before: one over every carrier, and one per carrier
+    def enqueue_call(self, entry):
+        if not self.redis.hsetnx(self.key("queue"), entry["id"], json.dumps(entry)):
+            return False
+        self.index_queued_call(entry)
+        return True
+    
+    def index_queued_call(self, entry):
+        carrier_key = self.key(f"queue:carrier:{entry['carrier']}")
+        pipe = self.redis.pipeline()
+        if entry["status"] == "queued":
+            pipe.sadd(self.key("queue:carriers"), entry["carrier"])
+            pipe.zadd(self.key("queue:due"), {entry["id"]: entry["not_before"]})
+            pipe.zadd(carrier_key, {entry["id"]: entry["not_before"]})
+        else:
+            pipe.zrem(self.key("queue:due"), entry["id"])
+            pipe.zrem(carrier_key, entry["id"])
+        pipe.execute()
+    
+    def update_queued_call(self, entry):
+        self.redis.hset(self.key("queue"), entry["id"], json.dumps(entry))
+        self.index_queued_call(entry)
+    
+    def load_queued_call(self, entry_id):
+        data = self.redis.hget(self.key("queue"), entry_id)
+        return json.loads(data) if data is not None else None
+    
+    def claim_due_calls(self, now, limit):
+        # Look at a few times more due ids than needed so priority can reorder them;
+        # whoever removes an id from the due set has claimed it
+        ids = [entry_id.decode("utf-8") for entry_id in self.redis.zrangebyscore(self.key("queue:due"), "-inf", now, start=0, num=limit * 4)]
+        if not ids:
+            return []
+        candidates = [json.loads(data) for data in self.redis.hmget(self.key("queue"), ids) if data is not None]
+        candidates.sort(key=lambda entry: (entry["priority"], entry["not_before"]))
+        claimed = []
+        for entry in candidates:
+            if len(claimed) == limit:
+                break
+            if self.redis.zrem(self.key("queue:due"), entry["id"]):
+                entry.update(status="dialling", claimed_at=now)
+                self.update_queued_call(entry)
+                claimed.append(entry)
+        return claimed
+    
+    def last_queued_slot(self, carrier, start, end):
+        found = self.redis.zrevrangebyscore(self.key(f"queue:carrier:{carrier}"), f"({end}", start, start=0, num=1, withscores=True)
+        return found[0][1] if found else None
+    
+    def queue_depth(self):
+        carriers = [carrier.decode("utf-8") for carrier in self.redis.smembers(self.key("queue:carriers"))]
+        pipe = self.redis.pipeline()
+        for carrier in carriers:
+            pipe.zcard(self.key(f"queue:carrier:{carrier}"))
+        return {carrier: depth for carrier, depth in zip(carriers, pipe.execute()) if depth}
+    
+    def requeue_stale_calls(self, claimed_before):
+        requeued = 0
+        for _, data in self.redis.hscan_iter(self.key("queue")):
+            entry = json.loads(data)
+            if entry["status"] == "dialling" and (entry.get("claimed_at") or 0) < claimed_before:
+                entry.update(status="queued", claimed_at=None)
+                self.update_queued_call(entry)
+                requeued += 1
+        return requeued
+    
+    def prune_call_queue(self, before):
+        stale = []
+        for entry_id, data in self.redis.hscan_iter(self.key("queue")):
+            entry = json.loads(data)
+            if entry["status"] in ("placed", "failed") and entry["enqueued_at"] < before:
+                stale.append(entry_id)
+        if stale:
+            self.redis.hdel(self.key("queue"), *stale)
+    
+    def save_transcript(self, call_id, transcript):
+        self.redis.hset(self.key("transcripts"), call_id, zlib.compress(transcript.encode("utf-8"), 6))
+        return len(transcript.splitlines())
+    
+    def load_transcript(self, call_id):
+        data = self.redis.hget(self.key("transcripts"), call_id)
+        return zlib.decompress(data).decode("utf-8") if data is not None else None
+    
+    def load_transcripts(self, call_ids):
+        call_ids = list(call_ids)
+        if not call_ids:
+            return {}
+        blobs = self.redis.hmget(self.key("transcripts"), call_ids)
+        return {call_id: zlib.decompress(data).decode("utf-8") for call_id, data in zip(call_ids, blobs) if data is not None}
+    
+    def index_call(self, *args, **kwargs):
+        self.index.index_call(*args, **kwargs)
+    
+    def search(self, query, limit, candidates=500):
+        return self.index.search(query, limit, candidates)
+    
+    def search_is_empty(self):
+        return self.index.search_is_empty()
+    
+    def load_rollups(self):
+        """(dimension, key, data) rows built from the per-field counters"""
+        buckets = {}
+        for name, value in self.redis.hgetall(self.key("rollups")).items():
+            dimension, key, field = name.decode("utf-8").split("\x1f")
+            buckets.setdefault((dimension, key), {})[field] = float(value)
+        return [(dimension, key, json.dumps(fields)) for (dimension, key), fields in buckets.items() if fields.get("calls", 0) > 0]
+    
+    def add_to_rollups(self, increments):
+        pipe = self.redis.pipeline()
+        for (dimension, key), fields in increments.items():
+            for field, delta in fields.items():
+                pipe.hincrbyfloat(self.key("rollups"), f"{dimension}\x1f{key}\x1f{field}", delta)
+        pipe.execute()
+    
+    def replace_rollups(self, rows):
+        mapping = {}
+        for dimension, key, data in rows:
+            for field, value in json.loads(data).items():
+                mapping[f"{dimension}\x1f{key}\x1f{field}"] = value
+        pipe = self.redis.pipeline()
+        pipe.delete(self.key("rollups"))
+        if mapping:
+            pipe.hset(self.key("rollups"), mapping=mapping)
+        pipe.execute()
+    
+    def is_empty(self):
+        return not self.redis.exists(self.key("records"))
+
+def call_store_path():
+    """Use /tmp on Vercel or the local directory in development"""
+    if os.getenv("CALL_RECORDS_DB"):
+        return os.getenv("CALL_RECORDS_DB")
+    return '/tmp/call_records.db' if os.path.exists('/tmp') else 'call_records.db'
+
+# Where call state is kept: "sqlite" (one host, any number of processes) or
+# "redis" (any number of hosts; needs `pip install redis` and REDIS_URL)
+CALL_STATE_BACKEND = os.getenv("CALL_STATE_BACKEND", "sqlite").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "calls")
+
+call_store = None
+
+def get_call_store():
+    """Open the call store on first use"""
+    global call_store
+    if call_store is None:
+        if CALL_STATE_BACKEND == "redis":
+            import redis
+            call_store = RedisCallStore(redis.Redis.from_url(REDIS_URL), CallStore(call_store_path()), REDIS_KEY_PREFIX)
+        elif CALL_STATE_BACKEND == "sqlite":
+            call_store = CallStore(call_store_path())
+        else:
+            raise ValueError(f"Unknown CALL_STATE_BACKEND {CALL_STATE_BACKEND!r}; use sqlite or redis")
+    return call_store
+
+async def persist_call_record(call_record):
+    """Save one call record without blocking the event loop; returns its change-log position, or None"""
+    # Serialise on the loop so the worker thread never reads a dict that a
+    # request handler is mutating at the same time
+    data = json.dumps(call_record, default=str)
+    CALL_STORE_WRITE_BYTES.observe(len(data), "call")
+    try:
+        with CALL_STORE_WRITE_SECONDS.time("call"):
+            return await asyncio.to_thread(get_call_store().save, call_record["id"], call_record.get("timestamp", ""), data)
+    except Exception as e:
+        print(f"Error saving call record {call_record['id']}: {e}")
+        return None
+
+# Records read from the call store per chunk while loading
+LOAD_CHUNK_SIZE = int(os.getenv("LOAD_CHUNK_SIZE", "5000"))
+
+class CallRecordLoader:
+    """Loads the call store into call_records newest first, one chunk at a time.
+    
+    Startup only waits for the first chunk, so recent calls are listed
+    straight away, and older chunks follow in the background. Until they
+    are all in, find_call_record reads ids it doesn't have from the store.
+    One-off migrations (inline transcripts, missing analytics rollups) are
+    applied to each chunk as it loads; missing rollups also count the
+    archive in the background first, and analytics report themselves
+    incomplete until the rebuild is saved. A missing search index is built
+    afterwards in a separate pass, oldest first, so index rowids follow
+    call order the way they do for calls indexed as they happen.
+    """
+    
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.before = None
+        self.done = True
+        self.backfill_search = False
+        self.rebuild_analytics = False
+    
+    def begin(self):
+        """Import the legacy JSON backup if needed and reset for a new load (blocking)"""
+        store = get_call_store()
+        
+        # Import records from the JSON backup used by earlier versions
+        if store.is_empty():
+            for file_path in ['/tmp/call_records.json', 'call_records.json']:
+                try:
+                    if os.path.exists(file_path):
+                        with open(file_path, 'r') as f:
+                            store.save_many(json.load(f))
+                        print(f"Imported call records from {file_path}")
+                        break
+                except Exception as e:
+                    print(f"Error importing call records from {file_path}: {e}")
+        
+        call_records.replace_all([])
+        self.before = None
+        self.done = False
+        # Build the search index for records stored before it existed
+        self.backfill_search = store.search_is_empty()
+        # Restore analytics rollups, or compute them as records load
+        rollups = store.load_rollups()
+        self.rebuild_analytics = not (rollups and call_analytics.load(rollups))
+        if self.rebuild_analytics:
+            # Archived calls are counted by count_archived; loaded ones as their chunks arrive
+            call_analytics.rebuild([])
+            call_analytics.complete = False
+    
+    def read_chunk(self):
+        """Read the next chunk from the store and migrate it (blocking)"""
+        store = get_call_store()
+        records = store.load_page(self.before, self.chunk_size)
+        for call_record in records:
+            results = call_record.get("results")
+            # Move transcripts still stored inside records out of line, once
+            if results and move_transcript_out(call_record["id"], results):
+                store.save(call_record["id"], call_record.get("timestamp", ""), json.dumps(call_record, default=str))
+        return records
+    
+    def build_search_index(self):
+        """Index every stored record, oldest first (blocking).
+        
+        CallStore.search ranks the matches with the highest rowids, so the
+        index has to be filled in call order for those to be the newest.
+        """
+        store = get_call_store()
+        after = None
+        indexed = 0
+        while True:
+            # "9999" sorts after every stored timestamp
+            records = store.load_range(after, "9999", self.chunk_size)
+            transcripts = store.load_transcripts(r["id"] for r in records)
+            for call_record in records:
+                index_call_record(call_record, transcripts.get(call_record["id"]))
+            indexed += len(records)
+            if len(records) < self.chunk_size:
+                break
+            after = (records[-1].get("timestamp", ""), records[-1]["id"])
+        self.backfill_search = False
+        if indexed:
+            print("Built search index")
+    
+    def add_chunk(self, records):
+        """Add a chunk from read_chunk to call_records; returns False once loading is complete"""
+        for call_record in call_records.add_older(records):
+            self.count_analytics(call_record)
+        if records:
+            last = records[-1]
+            self.before = (last.get("timestamp", ""), last["id"])
+        if len(records) < self.chunk_size:
+            self.finish()
+            return False
+        return True
+    
+    def adopt(self, call_record):
+        """Add a record that was looked up before its chunk loaded"""
+        call_records.add(call_record)
+        self.count_analytics(call_record)
+    
+    def count_analytics(self, call_record):
+        if self.rebuild_analytics:
+            contribution = call_analytics.contribution(call_record, call_record.get("results"))
+            if contribution:
+                call_analytics.apply(contribution, 1)
+                call_analytics.version += 1
+    
+    def count_archived(self):
+        """Rollup deltas for every archived call (blocking; apply them with add_archived)"""
+        increments = {}
+        for call_record in call_archive.iter_records():
+            contribution = call_analytics.contribution(call_record, call_record.get("results"))
+            if contribution:
+                call_analytics.add_increments(contribution, 1, increments)
+        return increments
+    
+    def add_archived(self, increments):
+        call_analytics.apply_increments(increments)
+        call_analytics.version += 1
+    
+    def save_analytics(self, rows):
+        """Replace the saved rollups with the rebuilt ones from call_analytics.export() (blocking)"""
+        get_call_store().replace_rollups(rows)
+        self.rebuild_analytics = False
+        call_analytics.complete = True
+        if len(call_records):
+            print("Built call analytics")
+    
+    def finish(self):
+        self.done = True
+        print(f"Loaded {len(call_records)} call records from {get_call_store().path}")
+    
+    def load_next(self):
+        """Load one chunk (blocking); returns False once loading is complete"""
+        return self.add_chunk(self.read_chunk())
+    
+    async def run(self):
+        """Load the remaining chunks without blocking the event loop"""
+        try:
+            if self.rebuild_analytics:
+                self.add_archived(await asyncio.to_thread(self.count_archived))
+            while not self.done:
+                records = await asyncio.to_thread(self.read_chunk)
+                self.add_chunk(records)
+            if self.rebuild_analytics:
+                await asyncio.to_thread(self.save_analytics, call_analytics.export())
+            if self.backfill_search:
+                await asyncio.to_thread(self.build_search_index)
+        except Exception as e:
+            print(f"Error loading call records: {e}")
+
+call_record_loader = CallRecordLoader(LOAD_CHUNK_SIZE)
+
+def load_call_records():
+    """Load every call record from the call store, importing the old JSON backup once"""
+    call_record_loader.begin()
+    if call_record_loader.rebuild_analytics:
+        call_record_loader.add_archived(call_record_loader.count_archived())
+    while call_record_loader.load_next():
+        pass
+    if call_record_loader.rebuild_analytics:
+        call_record_loader.save_analytics(call_analytics.export())
+    if call_record_loader.backfill_search:
+        call_record_loader.build_search_index()
+
+# Seconds between reads of the change log written by other processes
+CHANGE_POLL_INTERVAL = float(os.getenv("CHANGE_POLL_INTERVAL", "0.25"))
+
+class CallChangeWatcher:
+    """Follows the call store's change log to pick up other processes' writes.
+    
+    With several workers or hosts sharing a call store, each process keeps
+    its own call_records. Records saved elsewhere are copied in, counted in
+    the analytics, dropped from the result cache and published to this
+    process's event streams, so list, detail and live views agree whichever
+    process serves them.
+    """
+    
+    def __init__(self, interval):
+        self.interval = interval
+        self.cursor = None
+        self.applied = 0
+    
+    def mark(self):
+        """Follow changes logged from now on (blocking); call before loading records"""
+        self.cursor = get_call_store().latest_change()
+    
+    def apply(self, call_record, change=None):
+        current = call_records.get(call_record["id"])
+        if current is None and not call_record_loader.done:
+            # Not loaded yet; the saved rollups already count the change
+            call_record_loader.adopt(call_record)
+        else:
+            call_analytics.update(call_record, current.get("results") if current else None, call_record.get("results"))
+            call_records.add(call_record)
+        call_result_cache.discard(call_record["id"])
+        call_events.publish(call_record, change)
+        self.applied += 1
+    
+    def index(self, changed):
+        """Add other processes' records to a search index this process keeps (blocking)"""
+        store = get_call_store()
+        for call_record in changed:
+            results = call_record.get("results") or {}
+            transcript = store.load_transcript(call_record["id"]) if results.get("transcript_lines") else None
+            index_call_record(call_record, transcript)
+    
+    async def poll(self):
+        store = get_call_store()
+        self.cursor, changes = await asyncio.to_thread(store.changes_since, self.cursor)
+        latest = {}
+        for position, call_id, origin, call_record in changes:
+            if origin != PROCESS_ID:
+                latest[call_id] = (position, call_record)
+        saved = []
+        for call_id, (position, call_record) in latest.items():
+            if call_record is None:
+                # Deleted since, by the archiver; the rollups keep counting it
+                call_records.remove(call_id)
+                call_result_cache.discard(call_id)
+                call_archive.invalidate()
+            else:
+                self.apply(call_record, position)
+                saved.append(call_record)
+        if saved and not store.shared_index:
+            await asyncio.to_thread(self.index, saved)
+        return len(changes)
+    
+    async def run(self):
+        while True:
+            try:
+                # Keep reading while a backlog is coming in full pages
+                while await self.poll() >= 1000:
+                    pass
+            except Exception as e:
+                print(f"Error reading call changes: {e}")
+            await asyncio.sleep(self.interval)
+
+call_change_watcher = CallChangeWatcher(CHANGE_POLL_INTERVAL)
+
+class CallArchive:
+    """Immutable compressed segments of call records moved out of the call store.
+    
+    Each segment file holds calls from one day (by call timestamp), sorted
+    by id and zlib-compressed block_size records at a time, transcripts
+    included. A footer at the end of the file holds a sparse index (the
+    first id of each block) and a Bloom filter of every id. Lookups skip
+    segments whose filter rules the call out, then decompress the one
+    block that can hold it. Footers are small and kept in memory; decoded
+    blocks go in a small LRU cache. Segments are written under a temporary
+    name and renamed into place, so processes sharing the directory only
+    ever see complete files. Lookups only list the directory again after
+    invalidate() reports that another process has archived calls.
+    """
+    
+    MAGIC = b"CALLSEG1"
+    TRAILER = struct.Struct(">QQ")
+    # Every segment's filter is checked on a lookup, so keep false positives
+    # rare (about 1 in 2000) to avoid reading blocks that don't hold the call
+    BLOOM_HASHES = 11
+    BLOOM_BITS_PER_ID = 16
+    
+    def __init__(self, directory, block_size=128, cached_blocks=16):
+        self.directory = directory
+        self.block_size = block_size
+        self.cached_blocks = cached_blocks
+        self.lock = threading.Lock()
+        # Footer per segment path, or None for a file that could not be read
+        self.segments = {}
+        # Bumped when other processes may have written segments; the
+        # directory is listed again when it differs from refreshed
+        self.generation = 1
+        self.refreshed = 0
+        self.blocks = collections.OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+        self.block_reads = 0
+    
+    @staticmethod
+    def partition(call_record):
+        """Day a record is archived under"""
+        return (call_record.get("timestamp") or "0000-00-00")[:10]
+    
+    @staticmethod
+    def bloom_hash(call_id):
+        """Two 64-bit hashes of an id; filter positions are first + i * step"""
+        digest = hashlib.blake2b(call_id.encode("utf-8"), digest_size=16).digest()
+        return int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+    
+    def bloom_positions(self, hashed, size):
+        first, step = hashed
+        return [(first + i * step) % size for i in range(self.BLOOM_HASHES)]
+    
+    def may_contain(self, footer, hashed):
+        bits = footer["bloom_bits"]
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self.bloom_positions(hashed, len(bits) * 8))
+    
+    def open_footer(self, footer, path):
+        """Add the fields lookups use to a footer read from or written to path"""
+        footer["bloom_bits"] = base64.b64decode(footer["bloom"])
+        footer["first_ids"] = [first_id for first_id, _, _ in footer["blocks"]]
+        footer["bytes"] = os.path.getsize(path)
+        return footer
+    
+    def read_footer(self, path):
+        with open(path, "rb") as f:
+            f.seek(-(self.TRAILER.size + len(self.MAGIC)), os.SEEK_END)
+            tail = f.read()
+            if tail[self.TRAILER.size:] != self.MAGIC:
+                raise ValueError("not a call archive segment")
+            offset, length = self.TRAILER.unpack(tail[:self.TRAILER.size])
+            f.seek(offset)
+            footer = json.loads(zlib.decompress(f.read(length)))
+        return self.open_footer(footer, path)
+    
+    def invalidate(self):
+        """Note that another process has archived calls since the last refresh"""
+        self.generation += 1
+    
+    def refresh(self):
+        """Read the footers of segments this process hasn't seen yet (blocking; hold the lock)"""
+        self.refreshed = self.generation
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if name.endswith(".seg") and path not in self.segments:
+                try:
+                    self.segments[path] = self.read_footer(path)
+                except (OSError, ValueError, zlib.error) as e:
+                    print(f"Error reading archive segment {path}: {e}")
+                    self.segments[path] = None
+    
+    def read_block(self, path, offset, length):
+        key = (path, offset)
+        block = self.blocks.get(key)
+        if block is not None:
+            self.blocks.move_to_end(key)
+            return block
+        with open(path, "rb") as f:
+            f.seek(offset)
+            block = json.loads(zlib.decompress(f.read(length)))
+        self.block_reads += 1
+        self.blocks[key] = block
+        while len(self.blocks) > self.cached_blocks:
+            self.blocks.popitem(last=False)
+        return block
+    
+    def find(self, call_id, partition=None):
+        """Return (record, transcript) for an archived call, or None (blocking).
+        
+        A partition, when known, limits the search to that day's segments.
+        """
+        hashed = self.bloom_hash(call_id)
+        with self.lock:
+            if self.refreshed != self.generation:
+                self.refresh()
+            self.lookups += 1
+            for path, footer in self.segments.items():
+                if footer is None or (partition is not None and footer["partition"] != partition):
+                    continue
+                if not self.may_contain(footer, hashed):
+                    continue
+                index = bisect.bisect_right(footer["first_ids"], call_id) - 1
+                if index < 0:
+                    continue
+                _, offset, length = footer["blocks"][index]
+                for entry_id, call_record, transcript in self.read_block(path, offset, length):
+                    if entry_id == call_id:
+                        self.hits += 1
+                        return call_record, transcript
+        return None
+    
+    def archived_ids(self, records):
+        """Ids of the given records that are already archived (blocking)"""
+        with self.lock:
+            self.refresh()
+        return {
+            call_record["id"] for call_record in records
+            if self.find(call_record["id"], self.partition(call_record)) is not None
+        }
+    
+    def write_segment(self, partition, entries):
+        """Write [(record, transcript)] from one partition as a new segment (blocking)"""
+        entries = sorted(entries, key=lambda entry: entry[0]["id"])
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"calls-{partition}-{uuid.uuid4().hex[:8]}.seg")
+        bits = bytearray(max(8, (len(entries) * self.BLOOM_BITS_PER_ID + 7) // 8))
+        blocks = []
+        with open(path + ".tmp", "wb") as f:
+            f.write(self.MAGIC)
+            for start in range(0, len(entries), self.block_size):
+                block = entries[start:start + self.block_size]
+                data = zlib.compress(json.dumps([[r["id"], r, t] for r, t in block], default=str).encode("utf-8"), 6)
+                blocks.append([block[0][0]["id"], f.tell(), len(data)])
+                f.write(data)
+            for call_record, _ in entries:
+                for position in self.bloom_positions(self.bloom_hash(call_record["id"]), len(bits) * 8):
+                    bits[position >> 3] |= 1 << (position & 7)
+            timestamps = [call_record.get("timestamp", "") for call_record, _ in entries]
+            footer = {
+                "partition": partition,
+                "count": len(entries),
+                "first_timestamp": min(timestamps),
+                "last_timestamp": max(timestamps),
+                "blocks": blocks,
+                "bloom": base64.b64encode(bits).decode("ascii"),
+            }
+            data = zlib.compress(json.dumps(footer).encode("utf-8"), 6)
+            offset = f.tell()
+            f.write(data)
+            f.write(self.TRAILER.pack(offset, len(data)))
+            f.write(self.MAGIC)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        with self.lock:
+            self.segments[path] = self.open_footer(footer, path)
+        return path
+    
+    def iter_records(self, since=None, until=None):
+        """Yield archived records within the timestamp bounds, newest day first (blocking).
+        
+        Records of one day are read together and sorted newest first, so
+        memory use is bounded by the busiest day rather than the archive.
+        """
+        with self.lock:
+            self.refresh()
+            days = {}
+            for path, footer in self.segments.items():
+                if footer is None:
+                    continue
+                if (since is None or footer["last_timestamp"] >= since) and (until is None or footer["first_timestamp"] <= until):
+                    days.setdefault(footer["partition"], []).append((path, footer))
+        for day in sorted(days, reverse=True):
+            records = []
+            for path, footer in days[day]:
+                with open(path, "rb") as f:
+                    for _, offset, length in footer["blocks"]:
+                        f.seek(offset)
+                        for _, call_record, _ in json.loads(zlib.decompress(f.read(length))):
+                            timestamp = call_record.get("timestamp", "")
+                            if (since is None or timestamp >= since) and (until is None or timestamp <= until):
+                                records.append(call_record)
+            records.sort(key=lambda call_record: (call_record.get("timestamp", ""), call_record["id"]), reverse=True)
+            yield from records
+    
+    def stats(self):
+        with self.lock:
+            self.refresh()
+            footers = [footer for footer in self.segments.values() if footer is not None]
+            return {
+                "directory": self.directory,
+                "segments": len(footers),
+                "unreadable_segments": len(self.segments) - len(footers),
+                "records": sum(footer["count"] for footer in footers),
+                "bytes": sum(footer["bytes"] for footer in footers),
+                "oldest": min((footer["first_timestamp"] for footer in footers), default=None),
+                "newest": max((footer["last_timestamp"] for footer in footers), default=None),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "block_reads": self.block_reads,
+                "cached_blocks": len(self.blocks),
+            }
+
+# Where archived calls are kept; with the redis backend on several hosts,
+# this must be storage every host can read, such as a shared volume
+CALL_ARCHIVE_DIR = os.getenv("CALL_ARCHIVE_DIR") or os.path.join(os.path.dirname(os.path.abspath(call_store_path())), "call_archive")
+
+call_archive = CallArchive(CALL_ARCHIVE_DIR)
+
+async def find_archived_call(call_id):
+    """Return the archived record for a call, or None"""
+    found = await asyncio.to_thread(call_archive.find, call_id)
+    return found[0] if found else None
+
+class CallRetention:
+    """Moves ended calls out of the call store and into the call archive.
+    
+    Every interval seconds, the process holding the "archiver" lease
+    archives calls that have an ended_reason and are older than days days,
+    or older than the newest max_hot records. Both cutoffs are rounded down
+    to midnight, so each day is archived in one go. Segments are written
+    before the records are deleted: a run that stops in between leaves
+    calls in both places, and the next run deletes them without archiving
+    them twice. Other processes drop deleted records when they read the
+    change log. Analytics rollups keep counting archived calls.
+    """
+    
+    def __init__(self, days, max_hot, interval, batch_size=5000, lease_ttl=300.0):
+        self.days = days
+        self.max_hot = max_hot
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lease_ttl = lease_ttl
+        self.enabled = days > 0 or max_hot > 0
+        # The lease is per process; this keeps two runs in one process apart
+        self.running = asyncio.Lock()
+        self.runs = 0
+        self.archived = 0
+        self.last_run = None
+    
+    def cutoff(self, store):
+        """Timestamp before which ended calls are archived, or None (blocking)"""
+        cutoffs = []
+        if self.days > 0:
+            cutoffs.append((datetime.date.today() - datetime.timedelta(days=self.days)).isoformat())
+        if self.max_hot > 0:
+            timestamp = store.nth_newest_timestamp(self.max_hot)
+            if timestamp:
+                cutoffs.append(timestamp[:10])
+        return max(cutoffs) + " 00:00:00" if cutoffs else None
+    
+    def archive_batch(self, store, after, cutoff):
+        """Archive the ended calls among the next batch_size records before cutoff (blocking).
+        
+        Returns the key to continue from (None when done) and the records archived.
+        """
+        records = store.load_range(after, cutoff, self.batch_size)
+        if not records:
+            return None, []
+        ended = [call_record for call_record in records if (call_record.get("results") or {}).get("ended_reason")]
+        transcripts = store.load_transcripts(
+            call_record["id"] for call_record in ended if call_record["results"].get("transcript_lines")
+        )
+        # Calls archived by a run that stopped before deleting them are only deleted
+        archived = call_archive.archived_ids(ended)
+        days = {}
+        for call_record in ended:
+            if call_record["id"] not in archived:
+                days.setdefault(CallArchive.partition(call_record), []).append((call_record, transcripts.get(call_record["id"])))
+        for day, entries in days.items():
+            call_archive.write_segment(day, entries)
+        store.delete_calls(ended)
+        last = records[-1]
+        return ((last.get("timestamp", ""), last["id"]) if len(records) == self.batch_size else None), ended
+    
+    async def run_once(self):
+        """Archive every call that is due, if no other run is; returns how many were archived"""
+        async with self.running:
+            return await self.archive_due()
+    
+    async def archive_due(self):
+        store = get_call_store()
+        if not await asyncio.to_thread(store.acquire_lease, "archiver", PROCESS_ID, self.lease_ttl):
+            return 0
+        count = 0
+        try:
+            cutoff = await asyncio.to_thread(self.cutoff, store)
+            after = None
+            while cutoff is not None:
+                after, archived = await asyncio.to_thread(self.archive_batch, store, after, cutoff)
+                for call_record in archived:
+                    call_records.remove(call_record["id"])
+                    call_result_cache.discard(call_record["id"])
+                count += len(archived)
+                if after is None or not await asyncio.to_thread(store.acquire_lease, "archiver", PROCESS_ID, self.lease_ttl):
+                    break
+        finally:
+            await asyncio.to_thread(store.release_lease, "archiver", PROCESS_ID)
+        self.runs += 1
+        self.archived += count
+        self.last_run = time.time()
+        if count:
+            print(f"Archived {count} call records to {call_archive.directory}")
+        return count
+    
+    async def run(self):
+        # Records deleted while the loader is still reading them could be loaded back in
+        while not call_record_loader.done:
+            await asyncio.sleep(1)
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Error archiving call records: {e}")
+            await asyncio.sleep(self.interval)
+    
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "retention_days": self.days,
+            "max_hot_records": self.max_hot,
+            "hot_records": len(call_records),
+            "runs": self.runs,
+            "archived": self.archived,
+            "last_run": format_epoch(self.last_run) if self.last_run else None,
+            "archive": call_archive.stats(),
+        }
+
+# Ended calls older than CALL_RETENTION_DAYS, or beyond the newest
+# CALL_HOT_MAX_RECORDS, are moved to the archive; 0 turns either limit off.
+# Archiving runs in the background, so it is off by default on serverless hosts
+call_retention = CallRetention(
+    days=float(os.getenv("CALL_RETENTION_DAYS", "0" if SERVERLESS else "90")),
+    max_hot=int(os.getenv("CALL_HOT_MAX_RECORDS", "0")),
+    interval=float(os.getenv("CALL_ARCHIVE_INTERVAL", "3600")),
+)
+
+# Fields returned by list views unless the caller asks for more with ?fields=
+LIST_FIELDS = ["id", "phone_number", "timestamp", "status", "assistant_type"]
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, call_id = json.loads(base64.urlsafe_b64decode(padded))
+        return str(timestamp), str(call_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def normalize_timestamp_bound(value, end_of_day=False):
+    """Turn a date or ISO datetime query value into the stored timestamp format"""
+    if not value:
+        return None
+    value = value.replace("T", " ")[:19]
+    if len(value) == 10 and end_of_day:
+        return value + " 23:59:59"
+    return value
+
+def project_call(call_record, fields):
+    """Copy only the requested top-level fields of a call record"""
+    return {field: call_record[field] for field in fields if field in call_record}
+
+def list_calls(limit=50, cursor=None, status=None, assistant_type=None, since=None, until=None, phone_number=None, fields=None):
+    """Return one page of projected call records, newest first, and the next cursor"""
+    status_ids = call_records.ids_with_status(status) if status else None
+    type_ids = call_records.ids_with_assistant_type(assistant_type) if assistant_type else None
+    
+    def matches(call_record):
+        if status_ids is not None and call_record["id"] not in status_ids:
+            return False
+        if type_ids is not None and call_record["id"] not in type_ids:
+            return False
+        if phone_number and call_record.get("phone_number") != phone_number:
+            return False
+        return True
+    
+    records, next_key = call_records.page(
+        limit,
+        before=decode_cursor(cursor) if cursor else None,
+        since=normalize_timestamp_bound(since),
+        until=normalize_timestamp_bound(until, end_of_day=True),
+        predicate=matches if (status or assistant_type or phone_number) else None,
+    )
+    fields = fields or LIST_FIELDS
+    return [project_call(r, fields) for r in records], (encode_cursor(next_key) if next_key else None)
+
+def not_modified(request, etag):
+    """True if the request's If-None-Match already names etag"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+class ResponseCache:
+    """Rendered response bodies, reused until call_records changes.
+    
+    Entries are keyed on a route and its parameters and tagged with the
+    call_records data version they were built from, so any record change
+    makes the next lookup miss and the route render afresh. Entries built
+    with versioned=False don't depend on the records and are kept until
+    evicted. Compressed copies are made the first time each encoding is
+    asked for and kept with the entry, so a repeat request costs neither a
+    render nor a compression. Entries are evicted least recently used
+    first once either max_entries or max_bytes (bodies plus compressed
+    copies) is exceeded.
+    """
+    
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024, minimum_size=COMPRESS_MIN_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.minimum_size = minimum_size
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry["version"] not in (None, call_records.version):
+            self.discard(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+    
+    def put(self, key, body, content_type, headers=None, versioned=True):
+        entry = {
+            "key": key,
+            "body": body,
+            "content_type": content_type,
+            "headers": headers or {},
+            "version": call_records.version if versioned else None,
+            "encoded": {},
+            "size": len(body),
+        }
+        self.discard(key)
+        self.entries[key] = entry
+        self.total_bytes += entry["size"]
+        self.evict()
+        return entry
+    
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry["size"]
+    
+    def evict(self):
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            self.discard(next(iter(self.entries)))
+    
+    def respond(self, request, entry, headers=None):
+        """A response with the entry's body, compressed as the client prefers"""
+        headers = {**entry["headers"], **(headers or {}), "Content-Type": entry["content_type"], "Vary": "Accept-Encoding"}
+        body = entry["body"]
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", "")) if len(body) >= self.minimum_size else None
+        if encoding is not None:
+            if encoding not in entry["encoded"]:
+                entry["encoded"][encoding] = compress_body(body, encoding)
+                entry["size"] += len(entry["encoded"][encoding])
+                if self.entries.get(entry["key"]) is entry:
+                    self.total_bytes += len(entry["encoded"][encoding])
+                    self.evict()
+            body = entry["encoded"][encoding]
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, headers=headers)
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+        }
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256")),
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+)
+
+# Rendered into the cached home page in place of the form's idempotency key,
+# then swapped for a fresh key in every response
+FORM_KEY_PLACEHOLDER = "__idempotency_key__"
+
+# Columns every structured data export starts with; structured data fields follow
+EXPORT_BASE_COLUMNS = [
+    "id", "timestamp", "status", "assistant_type", "carrier", "phone_number",
+    "ended_reason", "success_evaluation", "cost", "duration_seconds",
+]
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+# Records read from the registry and written out per chunk
+EXPORT_CHUNK_ROWS = 500
+
+def structured_data_columns(data, prefix="structured_data."):
+    """Flatten structured data into {"structured_data.a.b": value} columns.
+    
+    Lists are kept as one JSON-encoded column so the schema does not
+    depend on how many items a call returned.
+    """
+    columns = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            columns.update(structured_data_columns(value, f"{prefix}{key}."))
+    elif data is not None:
+        columns[prefix.rstrip(".")] = json.dumps(data, default=str) if isinstance(data, list) else data
+    return columns
+
+def export_row(call_record):
+    """One flat export row for a call record"""
+    results = call_record.get("results") or {}
+    row = {
+        "id": call_record["id"],
+        "timestamp": call_record.get("timestamp"),
+        "status": call_record.get("status"),
+        "assistant_type": call_record.get("assistant_type"),
+        "carrier": call_carrier(call_record),
+        "phone_number": call_record.get("phone_number"),
+        "ended_reason": results.get("ended_reason"),
+        "success_evaluation": results.get("success_evaluation"),
+        "cost": results.get("cost"),
+        "duration_seconds": call_duration_seconds(results),
+    }
+    row.update(structured_data_columns(results.get("structured_data")))
+    return row
+
+def iter_export_chunks(since=None, until=None, carrier=None, status=None):
+    """Yield lists of matching records, newest first, EXPORT_CHUNK_ROWS at a time.
     
-    "insured_name": "Jane, Patrick",
-    "insured_dob": "09-07-1999",
-    "insured_ss": "N/A",
-    "insured_id": "104389769",
+    Each chunk resumes from the previous one's key, so records added while
+    an export is running don't shift it. Archived calls follow the ones in
+    memory, read from the archive a day at a time.
+    """
+    status_ids = call_records.ids_with_status(status) if status else None
+    since = normalize_timestamp_bound(since)
+    until = normalize_timestamp_bound(until, end_of_day=True)
+    
+    def matches(call_record):
+        if status_ids is not None and call_record["id"] not in status_ids:
+            return False
+        if carrier and (call_carrier(call_record) or "").lower() != carrier.lower():
+            return False
+        return True
+    
+    before = None
+    while True:
+        records, before = call_records.page(
+            EXPORT_CHUNK_ROWS,
+            before=before,
+            since=since,
+            until=until,
+            predicate=matches if (status or carrier) else None,
+        )
+        if records:
+            yield records
+        if before is None:
+            break
+    
+    records = []
+    for call_record in call_archive.iter_records(since, until):
+        # Skip calls still in memory while another process finishes archiving them
+        if call_record["id"] in call_records or (status and call_record.get("status") != status):
+            continue
+        if carrier and (call_carrier(call_record) or "").lower() != carrier.lower():
+            continue
+        records.append(call_record)
+        if len(records) == EXPORT_CHUNK_ROWS:
+            yield records
+            records = []
+    if records:
+        yield records
 
-    "relationship_to_patient": "SELF",
+def export_columns(chunks):
+    """Base columns plus every structured data column seen in the chunks, sorted"""
+    structured = set()
+    for records in chunks:
+        for call_record in records:
+            structured.update(structured_data_columns((call_record.get("results") or {}).get("structured_data")))
+    return EXPORT_BASE_COLUMNS + sorted(structured)
+
+class ExportSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain"""
     
-    "patient_name": "Jane, Patrick",
-    "patient_dob": "09-07-1999",
-    "employer": "FEDERAL EMPLOYEES DENTAL AND",
-    "group_number": "121332",  # Keeping the same key name for compatibility, but it represents Member ID now
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self.position
+    
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
 
-    "claims_address": "PO BOX 14093 EL PASO TX 79998",
-    "payor_id": "65978",
+def export_csv_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return "" if value is None else value
+
+async def iter_in_thread(iterator):
+    """Yield the items of a blocking iterator, advancing it in a worker thread"""
+    while True:
+        item = await asyncio.to_thread(next, iterator, None)
+        if item is None:
+            return
+        yield item
+
+async def export_structured_data(export_format, columns, chunks):
+    """Stream rows in the requested format, one chunk of records at a time.
     
-    "clinic_name": "Blue Lines Dental Clinic",
-    "practice_tax_id": "123456",
-    "treating_dentist_name": "Dr. Mustafa",
-    "dentist_npi": "789012",  # Keeping the same key name for compatibility, but it represents NPI Number now
-}
+    Chunks are pulled in a worker thread, since archived ones are read and
+    decompressed from disk.
+    """
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        async for records in iter_in_thread(chunks):
+            for call_record in records:
+                row = export_row(call_record)
+                writer.writerow([export_csv_value(row.get(column)) for column in columns])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    elif export_format == "ndjson":
+        async for records in iter_in_thread(chunks):
+            lines = []
+            for call_record in records:
+                row = export_row(call_record)
+                lines.append(json.dumps({column: row.get(column) for column in columns}, default=str) + "\n")
+            yield "".join(lines)
+    else:
+        import pyarrow
+        import pyarrow.parquet
+        # Structured data values vary in type between calls, so they are stored as strings
+        typed_columns = {"success_evaluation": pyarrow.bool_(), "cost": pyarrow.float64(), "duration_seconds": pyarrow.float64()}
+        schema = pyarrow.schema([(column, typed_columns.get(column, pyarrow.string())) for column in columns])
+        sink = ExportSink()
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+        async for records in iter_in_thread(chunks):
+            rows = [export_row(call_record) for call_record in records]
+            values = {}
+            for column in columns:
+                if column in typed_columns:
+                    values[column] = [row.get(column) for row in rows]
+                else:
+                    values[column] = [None if row.get(column) is None else str(row[column]) for row in rows]
+            writer.write_table(pyarrow.Table.from_pydict(values, schema=schema))
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
 
-def call_emblem_health(phone_num):
-    """Call the Emblem Health assistant with the given phone number"""
-    try:
-        test_call = client.calls.create(
-            name="emblem_health_call",
-            assistant_id="a41cc19c-ff10-4bb7-93f1-e53101b7ec48", # Emblem Health assistant
-            phone_number_id=os.getenv("PHONE_NUMBER_ID"),
-            customer={
-                "number": phone_num,  
-            },
-            assistant_overrides={
-                "variableValues": patient_clinic_data
-            }
-        )
+# Seconds between SSE heartbeat comments on idle streams
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", "15"))
 
-        print(f"Emblem Health call initiated: {test_call.id}")
-        
-        # Store call record with patient and clinic data
-        call_record = {
-            "id": test_call.id,
-            "phone_number": phone_num,
-            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "status": "scheduled",  # Initial status is scheduled
-            "assistant_type": "emblem_health",  # Mark this as an Emblem Health call
-            "patient_data": patient_clinic_data.copy()  # Store a copy of the patient data used for this call
+# Without webhooks, seconds between Vapi refreshes for a watched call stream
+STREAM_POLL_INTERVAL = float(os.getenv("STREAM_POLL_INTERVAL", "10"))
+
+class CallEventBus:
+    """Fan out call record changes to Server-Sent Events subscribers.
+    
+    Event ids are the change-log positions of the saves they report, so
+    they mean the same on every worker, and recent events are kept in a
+    ring buffer so a reconnecting browser can resume from its Last-Event-ID
+    whichever worker it reaches. A subscriber may watch a single call,
+    and then only that call's events are queued for it. A subscriber whose
+    queue fills up is dropped; its stream ends and the browser reconnects
+    and replays.
+    """
+    
+    def __init__(self, history=1000, queue_size=256):
+        self.history = collections.deque(maxlen=history)
+        self.queue_size = queue_size
+        # Queue -> the call id it watches, or None for every call
+        self.subscribers = {}
+        # Newest change-log position published, as an event id
+        self.last_id = "0"
+    
+    @staticmethod
+    def order_key(event_id):
+        """Sort key of an event id: a SQLite change seq ("42") or a Redis stream id ("1700000000000-0")"""
+        return tuple(int(part) for part in str(event_id).split("-"))
+    
+    def make_event(self, call_record, event_id):
+        results = call_record.get("results") or {}
+        return {
+            "event_id": event_id,
+            "call_id": call_record["id"],
+            "data": json.dumps({
+                "id": call_record["id"],
+                "status": call_record.get("status"),
+                "timestamp": call_record.get("timestamp"),
+                "phone_number": call_record.get("phone_number"),
+                "assistant_type": call_record.get("assistant_type"),
+                "summary": results.get("summary"),
+                "structured_data": results.get("structured_data"),
+                "ended_reason": results.get("ended_reason"),
+                "success_evaluation": results.get("success_evaluation"),
+                "duration": results.get("duration"),
+                "cost": results.get("cost"),
+                "transcript_lines": results.get("transcript_lines"),
+            }, default=str),
         }
-        call_records.append(call_record)
-        
-        # Save to JSON file as backup
-        save_call_records()
-        
-        return test_call.id
-    except Exception as error:
-        print(f"Error initiating Emblem Health call: {error}")
-        raise error
+    
+    def publish(self, call_record, change=None):
+        """Publish a record saved at change-log position change (None when the save failed)"""
+        event_id = self.last_id if change is None else str(change)
+        if self.order_key(event_id) > self.order_key(self.last_id):
+            self.last_id = event_id
+        event = self.make_event(call_record, event_id)
+        self.history.append(event)
+        for queue, call_id in list(self.subscribers.items()):
+            if call_id is not None and call_id != event["call_id"]:
+                continue
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.subscribers.pop(queue, None)
+    
+    def subscribe(self, last_event_id=None, call_id=None):
+        """Return a queue of new events for call_id (or every call), pre-filled with any missed since last_event_id"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        if last_event_id is not None:
+            for event in self.history:
+                if self.order_key(event["event_id"]) > last_event_id and (call_id is None or event["call_id"] == call_id) and not queue.full():
+                    queue.put_nowait(event)
+        self.subscribers[queue] = call_id
+        return queue
+    
+    def send_snapshot(self, queue, call_record):
+        """Queue the current state of one record for a single subscriber"""
+        if not queue.full():
+            queue.put_nowait(self.make_event(call_record, self.last_id))
+    
+    def unsubscribe(self, queue):
+        self.subscribers.pop(queue, None)
 
-def call_squad(phone_num):
-    try:
-        test_call = client.calls.create(
-            name="test_call",
-            squad={
-                "members": [
-                    {
-                        "assistantId": "5cd5625c-2f48-46e1-9575-3dc2b5efedc4", # 1. Introduction
-                        "assistantDestinations": [
-                            {
-                                "type": "assistant",
-                                "assistantId": "7ca934ef-e8fa-4308-8b80-abdbba8d9e80",
-                                "description": "Occurs once the payment_basis and in_network_status are captured.",
-                            }
-                        ],
-                        
-                        "assistantOverrides": {
-                            "variableValues": patient_clinic_data
-                        }
-                    },
-                    {
-                        "assistantId": "7ca934ef-e8fa-4308-8b80-abdbba8d9e80", # 2. Deductibles & Maximums
-                        "assistantDestinations": [
-                            {
-                                "type": "assistant",
-                                "assistantId": "eff2f1a7-4614-43bc-96ab-cd53ffd44a72",
-                                "description": "Occurs once the waiting_period and missing_tooth_clause are captured.",
-                            }
-                        ],
-                        
-                        "assistantOverrides": {
-                            "variableValues": patient_clinic_data
-                        }
-                    },
-                    {
-                        "assistantId": "eff2f1a7-4614-43bc-96ab-cd53ffd44a72", # 3. Coinsurance Percentages
-                        "assistantDestinations": [
-                            {
-                                "type": "assistant",
-                                "assistantId": "9d6589f4-d0f3-4565-b2a9-7165dda1fae2",
-                                "description": "Occurs once the coinsurance_periodontics and coinsurance_oral_surgery are All captured.",
-                            }
-                        ],
-                        
-                        "assistantOverrides": {
-                            "variableValues": patient_clinic_data
-                        }
-                    },
-                    {
-                        "assistantId": "9d6589f4-d0f3-4565-b2a9-7165dda1fae2", # 4. Freq A
-                        "assistantDestinations": [
-                            {
-                                "type": "assistant",
-                                "assistantId": "2f460c63-bd99-4393-8c17-10b9864e9a14",
-                                "description": "Occurs once the srp_4341_coverage and all_four_quads_same_day_allowed are captured.",
-                            }
-                        ],
-                        
-                        "assistantOverrides": {
-                            "variableValues": patient_clinic_data
-                        }
-                    },
-                    {
-                        "assistantId": "2f460c63-bd99-4393-8c17-10b9864e9a14", # 5. Freq B
-                        "assistantDestinations": [
-                            {
-                                "type": "assistant",
-                                "assistantId": "f40c8e73-5c26-4e1e-8bd2-2fb04106f4cd",
-                                "description": "Occurs once the perio_maint_4910_coverage and missing_tooth_clause_applies are captured.",
-                            }
-                        ],
-                        
-                        "assistantOverrides": {
-                            "variableValues": patient_clinic_data
-                        }
-                    },
-                    {
-                        "assistantId": "f40c8e73-5c26-4e1e-8bd2-2fb04106f4cd", # 6. Freq C
-                        "assistantDestinations": [
-                            {
-                                "type": "assistant",
-                                "assistantId": "98b18cf5-3975-4352-9c4c-2c634b3f6108",
-                                "description": "Occurs once the ortho_balance_payment_schedule and ortho_work_in_progress_applies and occlusal_guard_9944_covered are All captured.",
-                            }
-                        ],
-                        
-                        "assistantOverrides": {
-                            "variableValues": patient_clinic_data
-                        }
-                    },
-                ]
-            },
-            phone_number_id=os.getenv("PHONE_NUMBER_ID"),
-            customer={
-                "number": phone_num,  
-            },
-        )
+call_events = CallEventBus()
 
-        print(f"Test call initiated: {test_call.id}")
-        
-        # Store call record with patient and clinic data
-        call_record = {
-            "id": test_call.id,
-            "phone_number": phone_num,
-            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "status": "scheduled",  # Initial status is scheduled
-            "assistant_type": "general",  # Mark this as a General call (default squad)
-            "patient_data": patient_clinic_data.copy()  # Store a copy of the patient data used for this call
-        }
-        call_records.append(call_record)
-        
-        # Save to JSON file as backup
-        save_call_records()
-        
-        return test_call.id
-    except Exception as error:
-        print(f"Error testing workflow: {error}")
-        raise error
+def format_sse(event):
+    return f"id: {event['event_id']}\nevent: call\ndata: {event['data']}\n\n"
 
-def get_call_results(call_id):
+async def call_event_stream(request, queue, call_id=None, poll=None):
+    """Yield SSE frames for call events until the client disconnects.
+    
+    poll, when given, is awaited whenever the stream is idle so a watched
+    call keeps refreshing even without webhooks; any change it stores is
+    published back through the bus.
+    """
+    timeout = STREAM_POLL_INTERVAL if poll else STREAM_HEARTBEAT
     try:
-        call = client.calls.get(id=call_id)
-        
-        # Determine the call status based on different properties
-        call_status = "scheduled"  # Default status
+        yield "retry: 3000\n\n"
+        while queue in call_events.subscribers:
+            if await request.is_disconnected():
+                break
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                if poll:
+                    try:
+                        await poll()
+                    except Exception as e:
+                        print(f"Error refreshing call {call_id} for stream: {e}")
+                continue
+            yield format_sse(event)
+    finally:
+        call_events.unsubscribe(queue)
+
+def parse_last_event_id(request, last_event_id):
+    value = request.headers.get("last-event-id") or last_event_id
+    try:
+        return CallEventBus.order_key(value) if value else None
+    except ValueError:
+        return None
+
+def stream_response(generator):
+    return StreamingResponse(generator, media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+class TokenBucket:
+    """Token-bucket rate limiter: rate tokens per second, up to burst saved"""
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class DialScheduler:
+    """Bound outbound dial requests globally, per destination number and by rate"""
+    
+    def __init__(self, max_concurrency, per_destination, rate, burst):
+        self.global_slots = asyncio.Semaphore(max_concurrency)
+        self.per_destination = per_destination
+        self.destination_slots = {}  # number -> [semaphore, waiting + active users]
+        self.bucket = TokenBucket(rate, burst)
+        self.queued = 0
+        self.active = 0
+    
+    async def run(self, destination, dial):
+        """Wait for a free slot and a rate token, then await dial()"""
+        entry = self.destination_slots.get(destination)
+        if entry is None:
+            entry = self.destination_slots[destination] = [asyncio.Semaphore(self.per_destination), 0]
+        entry[1] += 1
+        self.queued += 1
+        started = False
+        try:
+            async with entry[0], self.global_slots:
+                await self.bucket.acquire()
+                self.queued -= 1
+                started = True
+                self.active += 1
+                try:
+                    return await dial()
+                finally:
+                    self.active -= 1
+        finally:
+            if not started:
+                self.queued -= 1
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.destination_slots[destination]
+
+dial_scheduler = DialScheduler(
+    max_concurrency=int(os.getenv("DIAL_MAX_CONCURRENCY", "5")),
+    per_destination=int(os.getenv("DIAL_PER_NUMBER_CONCURRENCY", "1")),
+    rate=float(os.getenv("DIAL_RATE_PER_SECOND", "2")),
+    burst=int(os.getenv("DIAL_RATE_BURST", "5")),
+)
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused for a different call"""
+
+class CallDeduplicator:
+    """Makes single call creates idempotent.
+    
+    A create is identified by its Idempotency-Key, or without one by a hash
+    of the phone number, assistant type and patient fields. The first
+    request claims the identity in the call store, so other processes see
+    it too, dials, and records the call id for key_ttl seconds (window for
+    content hashes). Duplicates get that call id without dialling; while
+    the first request is still dialling they wait for it. A failed dial
+    releases the claim: duplicates in the same process get the same error,
+    those in other processes dial themselves. Claims whose owner died
+    expire after pending_ttl.
+    """
+    
+    def __init__(self, key_ttl, window, pending_ttl, max_entries, poll_interval=0.1):
+        self.key_ttl = key_ttl
+        self.window = window
+        self.pending_ttl = pending_ttl
+        self.max_entries = max_entries
+        self.poll_interval = poll_interval
+        self.in_flight = {}
+        self.deduplicated = 0
+        self.conflicts = 0
+    
+    @staticmethod
+    def fingerprint(context):
+        payload = json.dumps([context.phone_number, context.assistant_type, dict(context.variables)], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    async def run(self, context, dial, idempotency_key=None):
+        """Dial once per identity; returns (call_id, replayed)"""
+        fingerprint = self.fingerprint(context)
+        if idempotency_key:
+            identity = "key:" + hashlib.sha256(idempotency_key.encode("utf-8")).hexdigest()
+            ttl = self.key_ttl
+        elif self.window > 0:
+            identity, ttl = "content:" + fingerprint, self.window
+        else:
+            return await dial(), False
         
-        if hasattr(call, 'started_at') and call.started_at:
-            call_status = "in_progress"
+        while True:
+            # Duplicates within this process wait on the first request's future
+            if identity in self.in_flight:
+                first_fingerprint, future = self.in_flight[identity]
+                if first_fingerprint != fingerprint:
+                    self.conflicts += 1
+                    raise IdempotencyConflict("This Idempotency-Key was already used for a different call")
+                try:
+                    return self.replayed(await asyncio.shield(future))
+                except asyncio.CancelledError:
+                    # The first request was cancelled, not this one: dial instead
+                    if not future.cancelled():
+                        raise
+                    continue
             
-        if hasattr(call, 'ended_reason'):
-            if call.ended_reason == "completed":
-                # Check if evaluation is available and use it for status
-                if (hasattr(call, 'analysis') and 
-                    hasattr(call.analysis, 'success_evaluation') and 
-                    call.analysis.success_evaluation is not None):
-                    # Convert string "true"/"false" to boolean values
-                    success_eval = False
-                    if isinstance(call.analysis.success_evaluation, str):
-                        success_eval = call.analysis.success_evaluation.lower() == "true"
-                    else:
-                        success_eval = bool(call.analysis.success_evaluation)
-                    call_status = "completed" if success_eval else "failed"
+            future = asyncio.get_running_loop().create_future()
+            self.in_flight[identity] = (fingerprint, future)
+            try:
+                call_id, replayed = await self.claim_and_dial(identity, fingerprint, ttl, dial)
+            except BaseException as e:
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
                 else:
-                    call_status = "completed"
-            elif call.ended_reason:
-                call_status = call.ended_reason
-        
-        # Get analysis data with proper null checks
-        analysis_data = {
-            "id": call_id,
-            "status": call_status,
-            "summary": None,
-            "structured_data": {},
-            "ended_reason": call.ended_reason if hasattr(call, 'ended_reason') else None,
-            "success_evaluation": None,
-            "started_at": call.started_at if hasattr(call, 'started_at') else None,
-            "ended_at": call.ended_at if hasattr(call, 'ended_at') else None,
-            "duration": None,  # Will calculate if both timestamps exist
-            "transcript": call.transcript if hasattr(call, 'transcript') else None,
-            "recording_url": call.recordingUrl if hasattr(call, 'recordingUrl') else None,
-            "cost": call.cost if hasattr(call, 'cost') else None
-        }
+                    future.set_exception(e)
+                    # Waiters see the error; mark it retrieved for when there are none
+                    future.exception()
+                raise
+            else:
+                future.set_result(call_id)
+            finally:
+                del self.in_flight[identity]
+            return call_id, replayed
+    
+    async def claim_and_dial(self, identity, fingerprint, ttl, dial):
+        """Dial under a claim in the call store, or return the call id of whoever holds it"""
+        store = get_call_store()
+        while True:
+            existing = await asyncio.to_thread(store.claim_idempotency, identity, fingerprint, self.pending_ttl, self.max_entries)
+            if existing is None:
+                break
+            if existing[0] != fingerprint:
+                self.conflicts += 1
+                raise IdempotencyConflict("This Idempotency-Key was already used for a different call")
+            # Another process may still be dialling; wait for its call id or for the claim to go
+            while existing is not None and existing[1] is None:
+                await asyncio.sleep(self.poll_interval)
+                existing = await asyncio.to_thread(store.lookup_idempotency, identity)
+            if existing is not None:
+                return self.replayed(existing[1])
         
-        # Extract analysis data carefully
-        if hasattr(call, 'analysis'):
-            if hasattr(call.analysis, 'summary'):
-                analysis_data["summary"] = call.analysis.summary
-                
-            if hasattr(call.analysis, 'structured_data'):
-                analysis_data["structured_data"] = call.analysis.structured_data
-                
-            if hasattr(call.analysis, 'success_evaluation'):
-                # Convert string "true"/"false" to boolean values
-                if isinstance(call.analysis.success_evaluation, str):
-                    analysis_data["success_evaluation"] = call.analysis.success_evaluation.lower() == "true"
-                else:
-                    analysis_data["success_evaluation"] = bool(call.analysis.success_evaluation)
-                    
-        # Calculate call duration if we have both timestamps
-        if analysis_data["started_at"] and analysis_data["ended_at"]:
+        try:
+            call_id = await dial()
+        except BaseException:
             try:
-                # Handle datetime objects directly
-                start_time = analysis_data["started_at"]
-                end_time = analysis_data["ended_at"]
-                
-                # Calculate duration in seconds
-                duration_seconds = (end_time - start_time).total_seconds()
-                
-                # Format as minutes and seconds
-                minutes = int(duration_seconds // 60)
-                seconds = int(duration_seconds % 60)
-                analysis_data["duration"] = f"{minutes}m {seconds}s"
-                
-                # Format timestamps for display
-                analysis_data["started_at_formatted"] = start_time.strftime("%Y-%m-%d %H:%M:%S UTC")
-                analysis_data["ended_at_formatted"] = end_time.strftime("%Y-%m-%d %H:%M:%S UTC")
+                await asyncio.to_thread(store.release_idempotency, identity)
             except Exception as e:
-                print(f"Error calculating duration: {e}")
-                # Provide a fallback
-                analysis_data["duration"] = "Unknown"
-        
-        # Update call record
-        updated = False
-        for call_record in call_records:
-            if call_record["id"] == call_id:
-                call_record["status"] = call_status
-                call_record["results"] = analysis_data
-                updated = True
-                break
-                
-        # If no record found, create one
-        if not updated:
-            call_record = {
-                "id": call_id,
-                "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "status": call_status,
-                "results": analysis_data
-            }
-            
-            # Get phone number if available
-            if hasattr(call, 'customer') and hasattr(call.customer, 'number'):
-                call_record["phone_number"] = call.customer.number
-                
-            call_records.append(call_record)
-                
-        # Save to JSON file as backup
-        save_call_records()
-        
-        return analysis_data
-    except Exception as error:
-        print(f"Error retrieving call results: {error}")
-        raise error
-
-def save_call_records():
-    """Save call records to a JSON file in /tmp directory"""
-    # Create /tmp directory if it doesn't exist
-    if not os.path.exists('/tmp'):
+                print(f"Error releasing idempotency claim: {e}")
+            raise
         try:
-            os.makedirs('/tmp', exist_ok=True)
-            print("Created /tmp directory")
+            await asyncio.to_thread(store.complete_idempotency, identity, fingerprint, call_id, ttl)
         except Exception as e:
-            print(f"Could not create /tmp directory: {e}")
+            print(f"Error recording idempotency entry for call {call_id}: {e}")
+        return call_id, False
     
-    # Use /tmp directory on Vercel or local directory in development
-    file_path = '/tmp/call_records.json' if os.path.exists('/tmp') else 'call_records.json'
+    def replayed(self, call_id):
+        self.deduplicated += 1
+        return call_id, True
     
-    # Ensure the directory for the file exists
-    os.makedirs(os.path.dirname(file_path) if os.path.dirname(file_path) else '.', exist_ok=True)
+    def stats(self):
+        return {
+            "in_flight": len(self.in_flight),
+            "deduplicated": self.deduplicated,
+            "conflicts": self.conflicts,
+            "key_ttl": self.key_ttl,
+            "window": self.window,
+        }
+
+# Idempotency-Key entries are kept for IDEMPOTENCY_KEY_TTL seconds; creates
+# without a key are deduplicated on content for CALL_DEDUP_WINDOW seconds
+# (0 turns that off)
+call_deduplicator = CallDeduplicator(
+    key_ttl=float(os.getenv("IDEMPOTENCY_KEY_TTL", "86400")),
+    window=float(os.getenv("CALL_DEDUP_WINDOW", "120")),
+    pending_ttl=float(os.getenv("IDEMPOTENCY_PENDING_TTL", "120")),
+    max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "100000")),
+)
+
+DAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+def parse_open_hours(spec):
+    """Parse "mon-fri 08:00-18:00, sat 09:00-12:00" or "always" into minute ranges per weekday"""
+    if spec.strip().lower() == "always":
+        return {day: [(0, 1440)] for day in range(7)}
+    hours = {day: [] for day in range(7)}
+    for part in spec.split(","):
+        try:
+            days, span = part.split()
+            first, _, last = days.lower().partition("-")
+            first_day, last_day = DAY_NAMES.index(first), DAY_NAMES.index(last or first)
+            start, end = (int(hour) * 60 + int(minute) for hour, minute in (clock.split(":") for clock in span.split("-")))
+        except ValueError:
+            raise ValueError(f"Could not parse open hours {part.strip()!r}; expected e.g. 'mon-fri 08:00-18:00'")
+        if not 0 <= start < end <= 1440:
+            raise ValueError(f"Open hours {part.strip()!r} must start before they end, within one day")
+        for offset in range((last_day - first_day) % 7 + 1):
+            hours[(first_day + offset) % 7].append((start, end))
+    return hours
+
+class DialingHours:
+    """A carrier's open hours in its own timezone.
     
-    try:
-        with open(file_path, 'w') as f:
-            json.dump(call_records, f, indent=4, default=str)
-        print(f"Saved call records to {file_path}")
-    except Exception as e:
-        print(f"Error saving call records to {file_path}: {e}")
+    Each local day's open windows are computed once, as epoch seconds, so
+    DST is handled by pytz and checking a time is a few comparisons.
+    """
+    
+    def __init__(self, timezone, spec):
+        import pytz
+        self.timezone = pytz.timezone(timezone)
+        self.spec = spec
+        self.hours = parse_open_hours(spec)
+        self.days = {}  # local date -> [(open, close)]
+    
+    def windows(self, day):
+        windows = self.days.get(day)
+        if windows is None:
+            if len(self.days) > 31:
+                self.days.clear()
+            windows = self.days[day] = [(self.at(day, start), self.at(day, end)) for start, end in self.hours[day.weekday()]]
+        return windows
+    
+    def at(self, day, minutes):
+        """Epoch seconds of a local wall-clock time, minutes after midnight of day"""
+        day += datetime.timedelta(days=minutes // 1440)
+        local = datetime.datetime.combine(day, datetime.time(minutes % 1440 // 60, minutes % 60))
+        return self.timezone.localize(local).timestamp()
+    
+    def next_window(self, moment):
+        """The (open, close) window containing moment or, failing that, the next one; None if never open"""
+        today = datetime.datetime.fromtimestamp(moment, self.timezone).date()
+        for offset in range(8):
+            for window in self.windows(today + datetime.timedelta(days=offset)):
+                if window[1] > moment:
+                    return window
+        return None
+    
+    def is_open(self, moment):
+        window = self.next_window(moment)
+        return window is not None and window[0] <= moment
 
-def load_call_records():
-    """Load call records from JSON file if it exists"""
-    global call_records
+def format_epoch(moment):
+    return datetime.datetime.fromtimestamp(moment, datetime.timezone.utc).isoformat(timespec="seconds")
+
+CALL_QUEUE_WAIT_SECONDS = metrics.histogram(
+    "call_queue_wait_seconds", "Time from queueing a held call to dialling it", ("carrier",), WAIT_BUCKETS)
+
+class CallQueue:
+    """Holds calls until their carrier's line is open.
+    
+    Each carrier (the insurance_carrier field, or Emblem Health for its
+    assistant) has open hours in its own timezone. A call made while its
+    carrier is open dials at once. Otherwise it is saved to the call store
+    with a slot in the next open window, spacing seconds after the last
+    call already waiting for that window, so a night's backlog is spread
+    over the morning instead of dialling at opening time. Calls that end
+    with one of redial_reasons are queued again redial_delay seconds
+    later, up to max_attempts in all.
+    
+    Any process may dispatch: due entries are claimed atomically, lowest
+    priority (the attempt number) first, and dialled through
+    dial_scheduler. An entry whose window passed while it waited is given
+    a slot in the next one. An entry still claimed claim_timeout seconds
+    later, because its process stopped before dialling it, is queued again. Calls are only held while this process runs
+    the dispatcher, so nothing is queued where nothing would dial it.
+    """
+    
+    ID_PREFIX = "queue-"
+    
+    def __init__(self, enabled, carrier_hours, default_hours, spacing, interval, max_in_flight,
+                 redial_reasons, max_attempts, redial_delay, keep_days, claim_timeout):
+        self.enabled = enabled
+        self.carrier_hours = carrier_hours  # carrier -> (timezone, spec)
+        self.default_hours = default_hours
+        for _, spec in [default_hours, *carrier_hours.values()]:
+            parse_open_hours(spec)
+        self.spacing = spacing
+        self.interval = interval
+        self.max_in_flight = max_in_flight
+        self.redial_reasons = redial_reasons
+        self.max_attempts = max_attempts
+        self.redial_delay = redial_delay
+        self.keep_seconds = keep_days * 86400
+        self.claim_timeout = claim_timeout
+        self.hours = {}  # (timezone, spec) -> DialingHours
+        self.depth = {}
+        self.in_flight = 0
+        self.pruned_at = 0.0
+        self.reclaimed_at = 0.0
+        self.running = False
+        self.held = 0
+        self.redials = 0
+        self.dialled = 0
+        self.failed = 0
+    
+    @staticmethod
+    def carrier_of(context):
+        if context.assistant_type == "emblem_health":
+            return "EMBLEM HEALTH"
+        return (context.variables.get("insurance_carrier") or "UNKNOWN").strip().upper()
+    
+    def hours_for(self, carrier):
+        config = self.carrier_hours.get(carrier, self.default_hours)
+        hours = self.hours.get(config)
+        if hours is None:
+            hours = self.hours[config] = DialingHours(*config)
+        return hours
+    
+    def holds(self, result_id):
+        """True if an id returned by submit is a queue entry rather than a call"""
+        return result_id.startswith(self.ID_PREFIX)
+    
+    def slot(self, carrier, earliest):
+        """First time from earliest inside an open window and spacing after the calls already queued in it"""
+        hours = self.hours_for(carrier)
+        store = get_call_store()
+        moment = earliest
+        while True:
+            window = hours.next_window(moment)
+            if window is None:
+                raise ValueError(f"{carrier} has no open hours")
+            open_at, close_at = window
+            slot = max(open_at, moment)
+            last = store.last_queued_slot(carrier, open_at, close_at)
+            if last is not None:
+                slot = max(slot, last + self.spacing)
+            if slot < close_at:
+                return slot
+            moment = close_at
     
-    # Create /tmp directory if it doesn't exist
-    if not os.path.exists('/tmp'):
+    def enqueue(self, context, earliest, entry_id=None, redial_of=None):
+        """Save a queue entry for context; None if entry_id is already queued. Runs in a worker thread"""
+        carrier = self.carrier_of(context)
+        entry = {
+            "id": entry_id or self.ID_PREFIX + uuid.uuid4().hex,
+            "carrier": carrier,
+            "priority": context.attempt,
+            "attempt": context.attempt,
+            "not_before": self.slot(carrier, earliest),
+            "status": "queued",
+            "enqueued_at": time.time(),
+            "redial_of": redial_of,
+            "call_id": None,
+            "error": None,
+            "context": {
+                "phone_number": context.phone_number,
+                "assistant_type": context.assistant_type,
+                "variables": dict(context.variables),
+            },
+        }
+        return entry if get_call_store().enqueue_call(entry) else None
+    
+    async def submit(self, context, dial):
+        """Dial now if the carrier is open, otherwise queue the call; returns the call id or queue entry id"""
+        carrier = self.carrier_of(context)
+        if not self.running or self.hours_for(carrier).is_open(time.time()):
+            return await dial()
+        entry = await asyncio.to_thread(self.enqueue, context, time.time())
+        self.held += 1
+        print(f"{carrier} is closed; call to {context.phone_number} queued for {format_epoch(entry['not_before'])}")
+        return entry["id"]
+    
+    async def redial(self, call_record):
+        """Queue another attempt at a call that ended with a redial reason"""
+        attempt = call_record.get("attempt", 1) + 1
+        if not self.running or attempt > self.max_attempts or not call_record.get("patient_data") or not call_record.get("phone_number"):
+            return
+        context = CallContext.create(call_record["phone_number"], call_record.get("assistant_type"), call_record["patient_data"], attempt)
+        entry = await asyncio.to_thread(
+            self.enqueue, context, time.time() + self.redial_delay,
+            f"{self.ID_PREFIX}redial-{call_record['id']}", call_record["id"],
+        )
+        if entry is not None:
+            self.redials += 1
+            print(f"Call {call_record['id']} ended with {call_record['status']}; attempt {attempt} queued for {format_epoch(entry['not_before'])}")
+    
+    async def get(self, entry_id):
+        return await asyncio.to_thread(get_call_store().load_queued_call, entry_id)
+    
+    async def dispatch_due(self):
+        store = get_call_store()
+        now = time.time()
+        if now - self.pruned_at > 3600:
+            await asyncio.to_thread(store.prune_call_queue, now - self.keep_seconds)
+            self.pruned_at = now
+        if now - self.reclaimed_at > self.claim_timeout:
+            requeued = await asyncio.to_thread(store.requeue_stale_calls, now - self.claim_timeout)
+            if requeued:
+                print(f"Queued {requeued} calls again that were claimed but never dialled")
+            self.reclaimed_at = now
+        self.depth = await asyncio.to_thread(store.queue_depth)
+        room = self.max_in_flight - self.in_flight
+        if room <= 0 or vapi_breaker.is_open():
+            return
+        for entry in await asyncio.to_thread(store.claim_due_calls, now, room):
+            self.in_flight += 1
+            spawn_background(self.dial(entry))
+    
+    async def dial(self, entry):
+        store = get_call_store()
         try:
-            os.makedirs('/tmp', exist_ok=True)
-            print("Created /tmp directory")
+            now = time.time()
+            if not self.hours_for(entry["carrier"]).is_open(now):
+                entry.update(status="queued", not_before=await asyncio.to_thread(self.slot, entry["carrier"], now))
+            else:
+                fields = entry["context"]
+                context = CallContext.create(fields["phone_number"], fields["assistant_type"], fields["variables"], entry["attempt"])
+                try:
+                    call_id = await dial_scheduler.run(context.phone_number, lambda: dispatch_call(context))
+                except VapiUnavailable as e:
+                    entry.update(status="queued", not_before=now + e.retry_after)
+                except Exception as e:
+                    self.failed += 1
+                    entry.update(status="failed", error=str(e))
+                else:
+                    self.dialled += 1
+                    entry.update(status="placed", call_id=call_id, dialled_at=time.time())
+                    CALL_QUEUE_WAIT_SECONDS.observe(entry["dialled_at"] - entry["enqueued_at"], entry["carrier"])
+            await asyncio.to_thread(store.update_queued_call, entry)
         except Exception as e:
-            print(f"Could not create /tmp directory: {e}")
+            print(f"Error dialling queued call {entry['id']}: {e}")
+        finally:
+            self.in_flight -= 1
+    
+    async def run(self):
+        print("Call queue started")
+        self.running = True
+        try:
+            while True:
+                try:
+                    await self.dispatch_due()
+                except Exception as e:
+                    print(f"Error dispatching queued calls: {e}")
+                await asyncio.sleep(self.interval)
+        finally:
+            self.running = False
+    
+    def stats(self):
+        now = time.time()
+        carriers = {}
+        for carrier in sorted({*self.carrier_hours, *self.depth}):
+            hours = self.hours_for(carrier)
+            window = hours.next_window(now)
+            carriers[carrier] = {
+                "timezone": hours.timezone.zone,
+                "hours": hours.spec,
+                "open": hours.is_open(now),
+                "next_open": format_epoch(window[0]) if window and window[0] > now else None,
+                "queued": self.depth.get(carrier, 0),
+            }
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "default_hours": {"timezone": self.default_hours[0], "hours": self.default_hours[1]},
+            "carriers": carriers,
+            "in_flight": self.in_flight,
+            "held": self.held,
+            "redials": self.redials,
+            "dialled": self.dialled,
+            "failed": self.failed,
+        }
+
+def parse_carrier_hours(value):
+    """CARRIER_HOURS: {"METLIFE PPO": {"timezone": "America/New_York", "hours": "mon-fri 08:00-20:00"}}"""
+    return {
+        carrier.strip().upper(): (config.get("timezone", CARRIER_DEFAULT_TIMEZONE), config.get("hours", CARRIER_DEFAULT_HOURS))
+        for carrier, config in json.loads(value).items()
+    }
+
+# Carriers missing from CARRIER_HOURS use the default timezone and hours
+CARRIER_DEFAULT_TIMEZONE = os.getenv("CARRIER_DEFAULT_TIMEZONE", "America/New_York")
+CARRIER_DEFAULT_HOURS = os.getenv("CARRIER_DEFAULT_HOURS", "mon-fri 08:00-18:00")
+
+call_queue = CallQueue(
+    enabled=os.getenv("CALL_QUEUE_ENABLED", "false").lower() == "true" and not SERVERLESS,
+    carrier_hours=parse_carrier_hours(os.getenv("CARRIER_HOURS", "{}")),
+    default_hours=(CARRIER_DEFAULT_TIMEZONE, CARRIER_DEFAULT_HOURS),
+    spacing=float(os.getenv("CALL_QUEUE_SPACING", "10")),
+    interval=float(os.getenv("CALL_QUEUE_INTERVAL", "1")),
+    max_in_flight=int(os.getenv("CALL_QUEUE_MAX_IN_FLIGHT", "5")),
+    redial_reasons=frozenset(os.getenv(
+        "CALL_REDIAL_REASONS", "customer-busy,customer-did-not-answer,voicemail,twilio-failed-to-connect-call"
+    ).split(",")),
+    max_attempts=int(os.getenv("CALL_REDIAL_MAX_ATTEMPTS", "3")),
+    redial_delay=float(os.getenv("CALL_REDIAL_DELAY", "1800")),
+    keep_days=float(os.getenv("CALL_QUEUE_KEEP_DAYS", "7")),
+    claim_timeout=float(os.getenv("CALL_QUEUE_CLAIM_TIMEOUT", "600")),
+)
+
+# Largest batch accepted by POST /api/calls/batch
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "10000"))
+
+# Progress of recent batches, oldest dropped first
+call_batches = collections.OrderedDict()
+MAX_TRACKED_BATCHES = 100
+
+# Keep references to fire-and-forget tasks so they are not garbage collected
+background_tasks = set()
+
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def parse_batch_rows(request):
+    """Read CSV or JSON rows from the request and validate all of them up front"""
+    body = await request.body()
+    try:
+        if "csv" in request.headers.get("content-type", ""):
+            raw_rows = list(csv.DictReader(io.StringIO(body.decode("utf-8-sig"))))
+        else:
+            payload = json.loads(body)
+            raw_rows = payload.get("rows") if isinstance(payload, dict) else payload
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse batch: {e}")
     
-    # Try /tmp directory first (for Vercel), then local directory
-    file_paths = ['/tmp/call_records.json', 'call_records.json']
+    if not isinstance(raw_rows, list) or not raw_rows:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one row")
+    if len(raw_rows) > BATCH_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {BATCH_MAX_ROWS} rows")
     
-    for file_path in file_paths:
+    rows, errors = [], []
+    for index, raw_row in enumerate(raw_rows):
         try:
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    call_records = json.load(f)
-                    print(f"Loaded call records from {file_path}")
-                    return
+            row = CallRequestRow.model_validate(raw_row)
+        except ValidationError as e:
+            errors.append({"row": index, "errors": jsonable_encoder(e.errors(include_url=False, include_context=False, include_input=False))})
+            continue
+        if row.assistant_type not in ("general", "emblem_health"):
+            errors.append({"row": index, "errors": [{"loc": ["assistant_type"], "msg": "must be general or emblem_health"}]})
+            continue
+        rows.append(row)
+    
+    if errors:
+        raise HTTPException(status_code=422, detail={"errors": errors})
+    return rows
+
+async def run_batch(batch, rows):
+    """Dial every row of a batch through the scheduler and record progress"""
+    async def dial_row(index, row):
+        try:
+            context = CallContext.create(row.phone_number, row.assistant_type, row.model_dump(exclude={"phone_number", "assistant_type"}))
+            call_id = await call_queue.submit(context, lambda: dial_scheduler.run(row.phone_number, lambda: dispatch_call(context)))
+            batch["call_ids"][index] = call_id
+            batch["queued" if call_queue.holds(call_id) else "dispatched"] += 1
         except Exception as e:
-            print(f"Error loading call records from {file_path}: {e}")
+            batch["failed"] += 1
+            batch["errors"].append({"row": index, "error": str(e)})
+    
+    await asyncio.gather(*(dial_row(index, row) for index, row in enumerate(rows)))
+    batch["status"] = "completed"
+    batch["completed_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"Batch {batch['id']} finished: {batch['dispatched']} dispatched, {batch['queued']} queued, {batch['failed']} failed")
+
+class CallReconciler:
+    """Background loop that keeps every non-terminal call record current.
+    
+    Each tracked call has its own poll interval: ringing calls start at
+    fast_interval, calls in progress start at conversation_interval, and
+    both back off by backoff up to max_interval between polls that bring
+    no change. Calls drop out once they reach a terminal status. When
+    enough calls are due at once they are refreshed with one calls.list
+    request; the rest are fetched individually with at most max_in_flight
+    requests outstanding.
+    """
+    
+    ACTIVE_STATUSES = ("scheduled", "in_progress")
+    
+    def __init__(self, fast_interval=5.0, conversation_interval=15.0, max_interval=60.0,
+                 backoff=1.5, max_in_flight=4, bulk_min=3, tick=1.0, lease_ttl=15.0):
+        self.fast_interval = fast_interval
+        self.conversation_interval = conversation_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_in_flight = max_in_flight
+        self.bulk_min = bulk_min
+        self.tick = tick
+        self.lease_ttl = lease_ttl
+        self.schedule = {}  # call id -> (next poll time, interval, last status)
+        self.running = False
+        self.leader = False
+        self.polls = 0
+        self.bulk_polls = 0
+    
+    def active_ids(self):
+        ids = set()
+        for status in self.ACTIVE_STATUSES:
+            ids |= call_records.ids_with_status(status)
+        return ids
+    
+    def reschedule(self, call_id, status, now):
+        """Set the next poll time for a call from its current status"""
+        if status not in self.ACTIVE_STATUSES:
+            self.schedule.pop(call_id, None)
+            return
+        previous = self.schedule.get(call_id)
+        if previous is None or previous[2] != status:
+            interval = self.fast_interval if status == "scheduled" else self.conversation_interval
+        else:
+            interval = min(previous[1] * self.backoff, self.max_interval)
+        self.schedule[call_id] = (now + interval, interval, status)
+    
+    def due_ids(self, now):
+        active = self.active_ids()
+        for call_id in list(self.schedule):
+            if call_id not in active:
+                del self.schedule[call_id]
+        return [call_id for call_id in active if call_id not in self.schedule or self.schedule[call_id][0] <= now]
+    
+    async def poll_bulk(self, due):
+        """Refresh due calls from one calls.list page; return the ids it covered"""
+        timestamps = [call_records.get(call_id).get("timestamp") for call_id in due]
+        try:
+            earliest = min(datetime.datetime.strptime(t, "%Y-%m-%d %H:%M:%S") for t in timestamps if t)
+        except ValueError:
+            return set()
+        # Record timestamps are naive local time; allow for clock skew
+        created_after = (earliest - datetime.timedelta(minutes=5)).astimezone()
+        with time_vapi_request("list"):
+            calls = await get_vapi_client().calls.list(
+                created_at_ge=created_after, limit=1000, request_options=VAPI_REQUEST_OPTIONS,
+            )
+        self.bulk_polls += 1
+        
+        wanted = set(due)
+        covered = set()
+        for call in calls:
+            if call.id in wanted:
+                call_result_cache.put(call.id, await apply_vapi_call(call))
+                covered.add(call.id)
+        return covered
+    
+    async def poll_one(self, call_id, slots):
+        async with slots:
+            self.polls += 1
+            await call_result_cache.get(call_id, get_call_results)
+    
+    async def reconcile_once(self):
+        if vapi_breaker.is_open():
+            return
+        now = time.monotonic()
+        due = self.due_ids(now)
+        if not due:
+            return
+        
+        remaining = list(due)
+        if len(due) >= self.bulk_min:
+            try:
+                covered = await self.poll_bulk(due)
+                remaining = [call_id for call_id in due if call_id not in covered]
+            except Exception as e:
+                print(f"Error listing calls for reconciliation: {e}")
+        
+        slots = asyncio.Semaphore(self.max_in_flight)
+        outcomes = await asyncio.gather(*(self.poll_one(call_id, slots) for call_id in remaining), return_exceptions=True)
+        for call_id, outcome in zip(remaining, outcomes):
+            if isinstance(outcome, Exception):
+                print(f"Error reconciling call {call_id}: {outcome}")
+        
+        now = time.monotonic()
+        for call_id in due:
+            call_record = call_records.get(call_id)
+            self.reschedule(call_id, call_record.get("status") if call_record else None, now)
+    
+    async def hold_lease(self):
+        """Take or renew the reconciler lease so one process polls for all of them.
+        
+        The others still serve current records, copied in from the leader's
+        writes by call_change_watcher.
+        """
+        leader = await asyncio.to_thread(get_call_store().acquire_lease, "reconciler", PROCESS_ID, self.lease_ttl)
+        if leader != self.leader:
+            print("Call reconciler is polling" if leader else "Call reconciler is standing by; another process is polling")
+            self.leader = leader
+            self.schedule.clear()
+        return leader
     
-    print("No call records found or could be loaded")
+    async def run(self):
+        self.running = True
+        print("Call reconciler started")
+        try:
+            while True:
+                try:
+                    if await self.hold_lease():
+                        await self.reconcile_once()
+                except Exception as e:
+                    print(f"Error in call reconciler: {e}")
+                await asyncio.sleep(self.tick)
+        finally:
+            self.running = False
+            self.leader = False
+    
+    def stats(self):
+        return {
+            "running": self.running,
+            "leader": self.leader,
+            "tracked": len(self.schedule),
+            "polls": self.polls,
+            "bulk_polls": self.bulk_polls,
+        }
+
+call_reconciler = CallReconciler(
+    fast_interval=float(os.getenv("RECONCILE_FAST_INTERVAL", "5")),
+    conversation_interval=float(os.getenv("RECONCILE_CONVERSATION_INTERVAL", "15")),
+    max_interval=float(os.getenv("RECONCILE_MAX_INTERVAL", "60")),
+    max_in_flight=int(os.getenv("RECONCILE_MAX_IN_FLIGHT", "4")),
+    lease_ttl=float(os.getenv("RECONCILE_LEASE_TTL", "15")),
+)
+
+# The reconciler needs a long-lived process, so it is off by default on
+# serverless hosts
+RECONCILER_ENABLED = os.getenv("RECONCILER_ENABLED", "false" if SERVERLESS else "true").lower() == "true"
+
+def build_search_query(text, carrier=None):
+    """Turn free text into an FTS5 query: every word or "quoted phrase" must match"""
+    terms = []
+    for phrase, word in re.findall(r'"([^"]+)"|(\S+)', text):
+        term = (phrase or word).replace('"', "")
+        if term.strip():
+            terms.append('"' + term + '"')
+    if carrier:
+        terms.append('carrier : "' + carrier.replace('"', "") + '"')
+    return " ".join(terms)
+
+# Gauges and counters read from live state when /metrics is scraped
+metrics.gauge("call_records", "Call records held in memory", lambda: len(call_records))
+metrics.gauge("call_result_cache_entries", "Entries in the call result cache", lambda: len(call_result_cache.entries))
+metrics.gauge("call_result_cache_bytes", "Estimated size of the call result cache", lambda: call_result_cache.total_bytes)
+metrics.gauge("call_result_cache_in_flight", "Vapi fetches in flight through the cache", lambda: len(call_result_cache.in_flight))
+metrics.gauge("call_result_cache_hits_total", "Cache hits", lambda: call_result_cache.hits, "counter")
+metrics.gauge("call_result_cache_misses_total", "Cache misses", lambda: call_result_cache.misses, "counter")
+metrics.gauge("call_result_cache_coalesced_total", "Lookups that joined an in-flight fetch", lambda: call_result_cache.coalesced, "counter")
+metrics.gauge("call_result_cache_evictions_total", "Cache evictions", lambda: call_result_cache.evictions, "counter")
+metrics.gauge("reconciler_tracked_calls", "Non-terminal calls the reconciler is polling", lambda: len(call_reconciler.schedule))
+metrics.gauge("reconciler_polls_total", "Reconciler polls", lambda: call_reconciler.polls, "counter")
+metrics.gauge("dial_queued", "Dials waiting for a scheduler slot", lambda: dial_scheduler.queued)
+metrics.gauge("dial_active", "Dials in progress", lambda: dial_scheduler.active)
+metrics.gauge("sse_subscribers", "Open call event streams", lambda: len(call_events.subscribers))
+metrics.gauge("sse_queued_events", "Events waiting in stream queues", lambda: sum(queue.qsize() for queue in list(call_events.subscribers)))
+metrics.gauge("background_tasks", "Running background tasks", lambda: len(background_tasks))
+metrics.gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample", lambda: event_loop_lag)
+metrics.gauge("call_changes_applied_total", "Records copied in from other processes' writes", lambda: call_change_watcher.applied, "counter")
+metrics.gauge("vapi_circuit_open", "1 while the Vapi circuit breaker refuses requests", lambda: int(vapi_breaker.is_open()))
+metrics.gauge("vapi_circuit_opens_total", "Times the Vapi circuit breaker opened", lambda: vapi_breaker.opens, "counter")
+metrics.gauge("vapi_requests_rejected_total", "Vapi requests refused by the open circuit", lambda: vapi_breaker.rejected, "counter")
+metrics.gauge("vapi_retries_total", "Vapi requests retried by the transport", lambda: vapi_transport.retried if vapi_transport else 0, "counter")
+metrics.gauge("call_queue_depth", "Calls waiting for their carrier to open", lambda: {(carrier,): depth for carrier, depth in call_queue.depth.items()}, label_names=("carrier",))
+metrics.gauge("call_queue_held_total", "Calls queued because their carrier was closed", lambda: call_queue.held, "counter")
+metrics.gauge("call_queue_redials_total", "Redials queued for calls that ended unanswered or busy", lambda: call_queue.redials, "counter")
+metrics.gauge("call_creates_deduplicated_total", "Call creates answered with an earlier call id", lambda: call_deduplicator.deduplicated, "counter")
+metrics.gauge("call_archive_segments", "Segment files in the call archive", lambda: sum(1 for footer in call_archive.segments.values() if footer))
+metrics.gauge("call_archive_lookups_total", "Lookups in the call archive", lambda: call_archive.lookups, "counter")
+metrics.gauge("call_archive_block_reads_total", "Archive blocks read from disk", lambda: call_archive.block_reads, "counter")
+metrics.gauge("calls_archived_total", "Call records this process moved to the archive", lambda: call_retention.archived, "counter")
+metrics.gauge("response_cache_entries", "Rendered responses in the response cache", lambda: len(response_cache.entries))
+metrics.gauge("response_cache_hits_total", "Responses served without rendering", lambda: response_cache.hits, "counter")
+metrics.gauge("response_cache_misses_total", "Responses rendered because the cache had no current copy", lambda: response_cache.misses, "counter")
+metrics.gauge("reconciler_leader", "1 if this process holds the reconciler lease", lambda: int(call_reconciler.leader))
 
 # Application startup event
 @app.on_event("startup")
 async def startup_event():
-    # Create /tmp directory if it doesn't exist (useful for Vercel)
-    if not os.path.exists('/tmp'):
+    # Follow other processes' writes from before the load starts, so none are missed
+    call_change_watcher.mark()
+    # Serve as soon as the newest calls are loaded; the rest load in the background
+    call_record_loader.begin()
+    call_record_loader.load_next()
+    # Loads the remaining chunks, then builds the search index if it was missing
+    spawn_background(call_record_loader.run())
+    if VAPI_PREWARM:
+        spawn_background(asyncio.to_thread(prewarm_vapi_client))
+    spawn_background(probe_event_loop_lag(LOOP_LAG_INTERVAL))
+    spawn_background(call_change_watcher.run())
+    if call_queue.enabled:
+        spawn_background(call_queue.run())
+    if call_retention.enabled:
+        spawn_background(call_retention.run())
+    # Keep non-terminal calls current without waiting for page views
+    if RECONCILER_ENABLED:
+        spawn_background(call_reconciler.run())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in list(background_tasks):
+        task.cancel()
+    # Let another process take over reconciliation straight away
+    if call_reconciler.leader:
         try:
-            os.makedirs('/tmp', exist_ok=True)
-            print("Created /tmp directory during startup")
+            await asyncio.to_thread(get_call_store().release_lease, "reconciler", PROCESS_ID)
         except Exception as e:
-            print(f"Could not create /tmp directory during startup: {e}")
-    
-    # Create templates directory if it doesn't exist
-    os.makedirs('templates', exist_ok=True)
-    # Create static directory and js subdirectory if they don't exist
-    os.makedirs('static/js', exist_ok=True)
-    # Initialize call records from file on startup
-    load_call_records()
+            print(f"Error releasing the reconciler lease: {e}")
 
 # API Routes
-@app.post("/api/calls", response_model=CallResponse, responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
-async def create_call(request: PhoneNumberRequest):
+def vapi_unavailable_error(error):
+    """503 telling the client when the circuit breaker will let requests through again"""
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": str(math.ceil(error.retry_after))})
+
+@app.post("/api/calls", response_model=CallResponse, responses={400: {"model": ErrorResponse}, 422: {"model": ErrorResponse}, 500: {"model": ErrorResponse}, 503: {"model": ErrorResponse}})
+async def create_call(
+    request: PhoneNumberRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
     if not request.phone_number:
         raise HTTPException(status_code=400, detail="Phone number is required")
     
     try:
-        call_id = call_squad(request.phone_number)
+        context = CallContext.create(request.phone_number, "general", patient_clinic_data)
+        call_id, replayed = await call_deduplicator.run(
+            context, lambda: call_queue.submit(context, lambda: call_squad(context)), idempotency_key
+        )
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
+        if call_queue.holds(call_id):
+            entry = await call_queue.get(call_id)
+            response.status_code = 202
+            return {"success": True, "call_id": entry["call_id"], "queue_id": entry["id"], "scheduled_for": format_epoch(entry["not_before"])}
         return {"success": True, "call_id": call_id}
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except VapiUnavailable as e:
+        raise vapi_unavailable_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/calls/{call_id}", response_model=Dict[str, Any], responses={500: {"model": ErrorResponse}})
+@app.post("/api/calls/batch", response_model=BatchResponse, status_code=202, responses={400: {"model": ErrorResponse}, 422: {"model": ErrorResponse}})
+async def create_call_batch(request: Request):
+    rows = await parse_batch_rows(request)
+    
+    batch = {
+        "id": str(uuid.uuid4()),
+        "status": "running",
+        "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "completed_at": None,
+        "total": len(rows),
+        "dispatched": 0,
+        "queued": 0,
+        "failed": 0,
+        "call_ids": [None] * len(rows),
+        "errors": [],
+    }
+    call_batches[batch["id"]] = batch
+    while len(call_batches) > MAX_TRACKED_BATCHES:
+        call_batches.popitem(last=False)
+    
+    spawn_background(run_batch(batch, rows))
+    return {"success": True, "batch_id": batch["id"], "total": len(rows)}
+
+@app.get("/api/calls/batch/{batch_id}", response_model=Dict[str, Any], responses={404: {"model": ErrorResponse}})
+async def get_call_batch(batch_id: str):
+    batch = call_batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return {**batch, "pending": batch["total"] - batch["dispatched"] - batch["queued"] - batch["failed"]}
+
+@app.get("/api/calls/stream")
+async def stream_calls(request: Request, last_event_id: Optional[str] = None):
+    queue = call_events.subscribe(parse_last_event_id(request, last_event_id))
+    return stream_response(call_event_stream(request, queue))
+
+@app.get("/api/calls/{call_id}/stream")
+async def stream_call(request: Request, call_id: str, last_event_id: Optional[str] = None):
+    resume_from = parse_last_event_id(request, last_event_id)
+    queue = call_events.subscribe(resume_from, call_id)
+    
+    # A fresh subscriber gets the current state first so it never misses a
+    # change made between rendering the page and opening the stream
+    call_record = find_call_record(call_id) or await find_archived_call(call_id)
+    if resume_from is None and call_record is not None:
+        call_events.send_snapshot(queue, call_record)
+    
+    async def poll():
+        call_record = find_call_record(call_id)
+        if call_record is None or not (call_record.get("results") or {}).get("ended_reason"):
+            await get_call_data(call_id)
+    
+    return stream_response(call_event_stream(request, queue, call_id, poll=None if local_state_is_current() else poll))
+
+@app.get("/api/calls/{call_id}/transcript", responses={404: {"model": ErrorResponse}})
+async def get_call_transcript(
+    request: Request,
+    call_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(200, ge=1, le=2000),
+):
+    transcript = await asyncio.to_thread(get_call_store().load_transcript, call_id)
+    if transcript is None and find_call_record(call_id) is None:
+        archived = await asyncio.to_thread(call_archive.find, call_id)
+        transcript = archived[1] if archived else None
+    if transcript is None:
+        raise HTTPException(status_code=404, detail="Transcript not found")
+    
+    # Byte ranges over the UTF-8 text, e.g. for resumable downloads
+    range_header = request.headers.get("range")
+    if range_header:
+        data = transcript.encode("utf-8")
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+        if not match or (not match.group(1) and not match.group(2)):
+            raise HTTPException(status_code=416, detail="Invalid range")
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), len(data) - 1) if match.group(2) else len(data) - 1
+        else:
+            start = max(len(data) - int(match.group(2)), 0)
+            end = len(data) - 1
+        if start > end:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{len(data)}"})
+        return Response(
+            content=data[start:end + 1],
+            status_code=206,
+            media_type="text/plain; charset=utf-8",
+            headers={"Content-Range": f"bytes {start}-{end}/{len(data)}", "Accept-Ranges": "bytes"},
+        )
+    
+    lines = transcript.splitlines()
+    return JSONResponse(
+        content={
+            "call_id": call_id,
+            "offset": offset,
+            "total_lines": len(lines),
+            "lines": lines[offset:offset + limit],
+        },
+        headers={"Accept-Ranges": "bytes"},
+    )
+
+@app.get("/api/calls/{call_id}", response_model=Dict[str, Any], responses={500: {"model": ErrorResponse}, 503: {"model": ErrorResponse}})
 async def get_call(call_id: str):
     try:
-        call_data = get_call_results(call_id)
+        call_data = await get_call_data(call_id)
         return call_data
+    except VapiUnavailable as e:
+        raise vapi_unavailable_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/vapi/webhook")
+async def vapi_webhook(request: Request):
+    body = await request.body()
+    if not VAPI_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Webhook secret is not configured")
+    if not verify_webhook_signature(body, request.headers):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+    
+    message = payload.get("message") if isinstance(payload, dict) else None
+    if not isinstance(message, dict):
+        raise HTTPException(status_code=400, detail="Missing message")
+    
+    results = await apply_webhook_message(message)
+    return {"received": True, "applied": results is not None}
+
 @app.get("/api/calls", response_model=List[Dict[str, Any]])
-async def get_all_calls():
-    return sorted(call_records, key=lambda x: x.get("timestamp", ""), reverse=True)
+async def get_all_calls(
+    request: Request,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    assistant_type: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    phone_number: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    cache_key = ("api_calls", request.url.query)
+    entry = response_cache.get(cache_key)
+    if entry is None:
+        calls, next_cursor = list_calls(
+            limit, cursor, status, assistant_type, since, until, phone_number,
+            fields=[f.strip() for f in fields.split(",") if f.strip()] if fields else None,
+        )
+        rendered = JSONResponse(content=jsonable_encoder(calls))
+        # The validator hashes the page itself rather than this process's
+        # data version, so every worker gives the same page the same ETag
+        digest = hashlib.sha1(rendered.body + (next_cursor or "").encode()).hexdigest()
+        page_headers = {"ETag": f'W/"{digest}"'}
+        if next_cursor:
+            page_headers["X-Next-Cursor"] = next_cursor
+        entry = response_cache.put(cache_key, rendered.body, rendered.headers["content-type"], page_headers)
+    headers = {"Cache-Control": "no-cache"}
+    if not_modified(request, entry["headers"]["ETag"]):
+        return Response(status_code=304, headers={**headers, "ETag": entry["headers"]["ETag"]})
+    next_cursor = entry["headers"].get("X-Next-Cursor")
+    if next_cursor:
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return response_cache.respond(request, entry, headers)
+
+@app.get("/api/search", response_model=List[Dict[str, Any]], responses={400: {"model": ErrorResponse}})
+async def search_calls(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    carrier: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+):
+    query = build_search_query(q, carrier)
+    if not query:
+        raise HTTPException(status_code=400, detail="Search query is empty")
+    try:
+        rows, truncated = await asyncio.to_thread(get_call_store().search, query, limit)
+    except sqlite3.OperationalError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid search query: {e}")
+    if truncated:
+        # Older matches beyond the ranked candidates were left out
+        response.headers["X-Search-Truncated"] = "true"
+    
+    hits = []
+    for call_id, rank, snippet in rows:
+        call_record = find_call_record(call_id) or await find_archived_call(call_id) or {}
+        hits.append({
+            "id": call_id,
+            "score": round(-rank, 6),
+            "snippet": snippet,
+            "timestamp": call_record.get("timestamp"),
+            "status": call_record.get("status"),
+            "carrier": call_carrier(call_record),
+        })
+    return hits
+
+@app.get("/api/exports/structured-data", responses={400: {"model": ErrorResponse}, 501: {"model": ErrorResponse}})
+async def export_structured_data_route(
+    export_format: str = Query("csv", alias="format"),
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    carrier: Optional[str] = None,
+    status: Optional[str] = None,
+):
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    if export_format == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Parquet export requires pyarrow to be installed")
+    
+    # First pass settles the column schema, second pass streams the rows;
+    # both walk every matching record, so neither runs on the event loop
+    columns = await asyncio.to_thread(export_columns, iter_export_chunks(since, until, carrier, status))
+    filename = f"structured-data-{datetime.date.today().isoformat()}.{export_format}"
+    return StreamingResponse(
+        export_structured_data(export_format, columns, iter_export_chunks(since, until, carrier, status)),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/api/analytics", response_model=Dict[str, Any], responses={400: {"model": ErrorResponse}})
+async def get_analytics(group_by: Optional[str] = None):
+    if group_by and group_by not in CallAnalytics.DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of: {', '.join(CallAnalytics.DIMENSIONS)}")
+    return call_analytics.report(group_by)
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/debug/profile", responses={404: {"model": ErrorResponse}, 409: {"model": ErrorResponse}})
+async def profile(seconds: float = Query(10, gt=0, le=60), interval: float = Query(0.01, ge=0.001, le=1)):
+    """Sample stacks for a while and return them in collapsed-stack format for flame graphs"""
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if profiler_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    async with profiler_lock:
+        counts = await asyncio.to_thread(sample_stacks, seconds, interval)
+    lines = [f"{stack} {count}" for stack, count in counts.most_common()]
+    return Response(content="\n".join(lines) + "\n", media_type="text/plain")
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    return {**call_result_cache.stats(), "responses": response_cache.stats()}
+
+@app.get("/api/reconciler/stats")
+async def get_reconciler_stats():
+    return call_reconciler.stats()
+
+@app.get("/api/vapi/stats")
+async def get_vapi_stats():
+    return {**vapi_breaker.stats(), "retries": vapi_transport.retried if vapi_transport else 0}
+
+@app.get("/api/queue")
+async def get_call_queue_stats():
+    return call_queue.stats()
+
+@app.get("/api/queue/{queue_id}", responses={404: {"model": ErrorResponse}})
+async def get_queued_call(queue_id: str):
+    entry = await call_queue.get(queue_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Queued call not found")
+    return entry
+
+@app.get("/api/archive/stats")
+async def get_archive_stats():
+    return await asyncio.to_thread(call_retention.stats)
+
+@app.get("/api/idempotency/stats")
+async def get_idempotency_stats():
+    return call_deduplicator.stats()
 
 # Web Routes
 @app.get("/")
 async def index(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    entry = response_cache.get(("index",))
+    if entry is None:
+        rendered = get_templates().TemplateResponse("index.html", {"request": request, "idempotency_key": FORM_KEY_PLACEHOLDER})
+        entry = response_cache.put(("index",), rendered.body, rendered.headers["content-type"], versioned=False)
+    # Each page load needs its own form key, so only the render is shared; the compression middleware compresses it
+    body = entry["body"].replace(FORM_KEY_PLACEHOLDER.encode(), uuid.uuid4().hex.encode())
+    return Response(content=body, headers={"Content-Type": entry["content_type"], "Vary": "Accept-Encoding"})
 
 @app.get("/calls")
-async def calls_page(request: Request):
-    sorted_calls = sorted(call_records, key=lambda x: x.get("timestamp", ""), reverse=True)
-    return templates.TemplateResponse("calls.html", {"request": request, "calls": sorted_calls})
+async def calls_page(request: Request, status: Optional[str] = None, assistant_type: Optional[str] = None):
+    cache_key = ("calls", status, assistant_type)
+    entry = response_cache.get(cache_key)
+    if entry is None:
+        # Only the first page is rendered; the template loads the rest from /api/calls
+        calls, next_cursor = list_calls(status=status, assistant_type=assistant_type)
+        rendered = get_templates().TemplateResponse("calls.html", {
+            "request": request,
+            "calls": calls,
+            "next_cursor": next_cursor,
+            "filters": {"status": status, "assistant_type": assistant_type},
+        })
+        entry = response_cache.put(cache_key, rendered.body, rendered.headers["content-type"])
+    return response_cache.respond(request, entry)
 
 @app.get("/calls/{call_id}")
 async def call_details(request: Request, call_id: str):
-    # Always fetch the latest data from the API for the call details page
     try:
-        call_data = get_call_results(call_id)
+        call_data = await get_call_data(call_id)
         
         # Find the call record
-        found_call = None
-        for call in call_records:
-            if call["id"] == call_id:
-                found_call = call
-                break
+        found_call = find_call_record(call_id) or await find_archived_call(call_id)
         
         # If call wasn't found in records, create a new record
         if not found_call:
-            new_call = {
-                "id": call_id,
-                "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "status": call_data.get("status", "unknown"),
-                "results": call_data
-            }
-            call_records.append(new_call)
-            save_call_records()
-            found_call = new_call
+            found_call = await store_call_results(call_id, call_data)
             
-        return templates.TemplateResponse("call_details.html", {"request": request, "call": found_call})
+        return get_templates().TemplateResponse("call_details.html", {"request": request, "call": found_call})
     except Exception as e:
-        return templates.TemplateResponse("error.html", {"request": request, "error": str(e)})
+        return get_templates().TemplateResponse("error.html", {"request": request, "error": str(e)})
 
 @app.post("/create_call")
 async def create_call_web(
@@ -520,7 +4868,8 @@ async def create_call_web(
     clinic_name: str = Form(...),
     practice_tax_id: str = Form(...),
     treating_dentist_name: str = Form(...),
-    dentist_npi: str = Form(...)
+    dentist_npi: str = Form(...),
+    idempotency_key: Optional[str] = Form(None, max_length=255),
 ):
     # Create form data dictionary
     form_data = {
@@ -546,38 +4895,37 @@ async def create_call_web(
     }
     
     try:
-        # Update global patient_clinic_data with form values
-        global patient_clinic_data
+        # Build an immutable per-request context from the form values
+        context = CallContext.create(phone_number, assistant_type, form_data)
+        # A double-clicked submit carries the same form key, so it lands on the same call
+        call_id, _ = await call_deduplicator.run(
+            context, lambda: call_queue.submit(context, lambda: dispatch_call(context)), idempotency_key
+        )
+        if call_queue.holds(call_id):
+            entry = await call_queue.get(call_id)
+            if entry["call_id"] is None:
+                notice = f"{entry['carrier']} is closed. The call to {phone_number} is queued and will be placed at {format_epoch(entry['not_before'])}."
+                return get_templates().TemplateResponse("index.html", {"request": request, "notice": notice, "idempotency_key": uuid.uuid4().hex})
+            call_id = entry["call_id"]
         
-        # Prepare the required data based on assistant type
-        if assistant_type == "emblem_health":
-            # For Emblem Health, we only need 4 specific fields
-            emblem_data = {
-                "patient_name": form_data["patient_name"],
-                "group_number": form_data["group_number"],  # Member ID
-                "patient_dob": form_data["patient_dob"],
-                "dentist_npi": form_data["dentist_npi"]     # NPI Number
-            }
-            
-            # Update patient_clinic_data with just the required fields for Emblem Health
-            patient_clinic_data = emblem_data
-            
-            # Make the call
-            call_id = call_emblem_health(phone_number)
-        else:  # Default to "general" assistant which uses the squad
-            # Update patient_clinic_data with all form values
-            patient_clinic_data = form_data
-            
-            call_id = call_squad(phone_number)
-            
         return RedirectResponse(url=f"/calls/{call_id}", status_code=303)
     except Exception as e:
-        return templates.TemplateResponse("index.html", {"request": request, "error": str(e)})
+        return get_templates().TemplateResponse("index.html", {"request": request, "error": str(e), "idempotency_key": uuid.uuid4().hex})
 
-if __name__ == "__main__":
+if __name__ == "__main__" and sys.argv[1:] == ["build-static"]:
+    # Write content-hashed, precompressed copies of the static files for deployment
+    manifest = build_static_assets()
+    print(f"Built {len(manifest)} static files into {STATIC_BUILD_DIR}")
+elif __name__ == "__main__" and sys.argv[1:] == ["rebuild-analytics"]:
+    # Recompute the analytics rollups from the call store
+    call_records.replace_all(get_call_store().load_all())
+    rebuild_call_analytics()
+    print(f"Rebuilt call analytics from {len(call_records)} call records")
+elif __name__ == "__main__":
     # Run the FastAPI app with uvicorn
     port = int(os.getenv("PORT", "8000"))
     debug = os.getenv("DEBUG", "False").lower() == "true"
+    import uvicorn
     uvicorn.run("main:app", host="127.0.0.1", port=port, reload=debug)
 
 # For Vercel serverless deployment